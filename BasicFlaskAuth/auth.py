@@ -0,0 +1,348 @@
+import os
+import json
+import time
+import threading
+import http.client
+from functools import wraps
+from urllib.parse import urlparse
+
+from flask import request
+from jose import jwt
+
+
+AUTH0_DOMAIN = 'zobot.auth0.com'
+ALGORITHMS = ['RS256']
+API_AUDIENCE = 'image'
+
+# where fetched keys are kept between restarts, and how long they are trusted
+JWKS_URL = os.environ.get('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_CACHE_FILE = os.environ.get(
+    'JWKS_CACHE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.jwks_cache.json'))
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 24 * 60 * 60))
+# how long expired keys keep verifying tokens while the issuer cannot be reached
+JWKS_STALE_GRACE = int(os.environ.get('JWKS_STALE_GRACE', 6 * 60 * 60))
+
+
+class AuthError(Exception):
+    def __init__(self, error, status_code):
+        self.error = error
+        self.status_code = status_code
+
+
+class Timings:
+    """Thread-safe call counts and cumulative seconds per auth step"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, step, seconds):
+        with self._lock:
+            count, total = self._stats.get(step, (0, 0.0))
+            self._stats[step] = (count + 1, total + seconds)
+
+    def snapshot(self):
+        """{step: {'count': n, 'total_ms': ..., 'mean_ms': ...}}"""
+        with self._lock:
+            return {
+                step: {
+                    'count': count,
+                    'total_ms': total * 1000,
+                    'mean_ms': total * 1000 / count,
+                }
+                for step, (count, total) in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+timings = Timings()
+
+
+class JWKSCache:
+    """Signing keys by kid, fetched once and kept in memory and in cache_file.
+
+    Refreshes reuse one keep-alive HTTPS connection. An unknown kid triggers at most one
+    refresh per min_refresh_interval, so garbage tokens cannot turn into a fetch per request.
+    A file:// url reads a local JWKS instead, e.g. for offline tests.
+
+    One thread fetches at a time, without holding the lock. Meanwhile other requests keep
+    verifying with the keys already cached, and only requests that have no usable key wait.
+    When a fetch fails, expired keys go on verifying for up to stale_grace seconds past ttl,
+    and the fetch is retried at most once per min_refresh_interval.
+    """
+
+    def __init__(self, url=JWKS_URL, cache_file=JWKS_CACHE_FILE, ttl=JWKS_TTL,
+                 min_refresh_interval=60, timeout=5, stale_grace=JWKS_STALE_GRACE):
+        self.url = url
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.stale_grace = stale_grace
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.fetches = 0
+
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self._refreshing = False
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._failed_at = 0.0
+        self._connection = None
+        self._load_cache_file()
+
+    def get_key(self, kid):
+        """The rsa key dict for kid, or None when the issuer does not publish it"""
+        keys = self._keys
+        if kid in keys and not self._expired():
+            return keys[kid]
+
+        if self._start_refresh(kid):
+            try:
+                self._refresh()
+            except AuthError:
+                self._failed_at = time.time()
+                if self._past_grace():
+                    raise
+            finally:
+                self._finish_refresh()
+        elif kid not in self._keys or self._past_grace():
+            # nothing to verify with meanwhile: wait for the fetch in flight, if any
+            with self._refreshed:
+                self._refreshed.wait_for(lambda: not self._refreshing, timeout=2 * self.timeout + 1)
+
+        if self._past_grace():
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch the signing keys.'
+            }, 503)
+        return self._keys.get(kid)
+
+    def _start_refresh(self, kid):
+        """Whether this thread should fetch the keys now; it must then call _finish_refresh"""
+        with self._lock:
+            if self._refreshing or (kid in self._keys and not self._expired()):
+                return False
+            now = time.time()
+            if now - self._failed_at < self.min_refresh_interval:
+                return False
+            if not self._expired() and now - self._fetched_at < self.min_refresh_interval:
+                return False
+            self._refreshing = True
+            return True
+
+    def _finish_refresh(self):
+        with self._refreshed:
+            self._refreshing = False
+            self._refreshed.notify_all()
+
+    def _expired(self):
+        return time.time() - self._fetched_at >= self.ttl
+
+    def _past_grace(self):
+        return time.time() - self._fetched_at >= self.ttl + self.stale_grace
+
+    def _refresh(self):
+        jwks = self._fetch()
+        self.fetches += 1
+        self._keys = {
+            key['kid']: {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+            for key in jwks['keys'] if 'kid' in key
+        }
+        self._fetched_at = time.time()
+        self._write_cache_file()
+
+    def _fetch(self):
+        url = urlparse(self.url)
+        if url.scheme == 'file':
+            try:
+                with open(url.path) as jwks_file:
+                    return json.load(jwks_file)
+            except (OSError, ValueError):
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch the signing keys.'
+                }, 503)
+
+        # one retry on a fresh connection: the server may have closed the idle keep-alive one
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = http.client.HTTPSConnection(url.netloc, timeout=self.timeout)
+            try:
+                self._connection.request('GET', url.path, headers={'Connection': 'keep-alive'})
+                response = self._connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                self._connection.close()
+                self._connection = None
+                if attempt:
+                    raise AuthError({
+                        'code': 'jwks_unavailable',
+                        'description': 'Unable to fetch the signing keys.'
+                    }, 503)
+                continue
+            if response.status != 200:
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch the signing keys.'
+                }, 503)
+            return json.loads(body)
+
+    def _load_cache_file(self):
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file) as cache:
+                cached = json.load(cache)
+        except (OSError, ValueError):  # no cache yet, or a torn one: fetch on first use
+            return
+        if cached.get('url') != self.url:
+            return
+        self._keys = cached['keys']
+        self._fetched_at = cached['fetched_at']
+
+    def _write_cache_file(self):
+        if not self.cache_file:
+            return
+        tmp_path = self.cache_file + '.tmp'
+        try:
+            with open(tmp_path, 'w') as cache:
+                json.dump({'url': self.url, 'fetched_at': self._fetched_at, 'keys': self._keys}, cache)
+            os.replace(tmp_path, self.cache_file)
+        except OSError:  # read-only deploys still get the in-memory cache
+            pass
+
+
+jwks_cache = JWKSCache()
+
+
+def get_token_auth_header():
+    """Obtains the Access Token from the Authorization Header
+    """
+    start = time.perf_counter()
+    try:
+        auth = request.headers.get('Authorization', None)
+        if not auth:
+            raise AuthError({
+                'code': 'authorization_header_missing',
+                'description': 'Authorization header is expected.'
+            }, 401)
+
+        parts = auth.split()
+        if not parts or parts[0].lower() != 'bearer':
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Authorization header must start with "Bearer".'
+            }, 401)
+
+        elif len(parts) == 1:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Token not found.'
+            }, 401)
+
+        elif len(parts) > 2:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Authorization header must be bearer token.'
+            }, 401)
+
+        token = parts[1]
+        return token
+    finally:
+        timings.record('header', time.perf_counter() - start)
+
+
+def verify_decode_jwt(token, jwks=None):
+    jwks = jwks or jwks_cache
+
+    start = time.perf_counter()
+    try:
+        try:
+            unverified_header = jwt.get_unverified_header(token)
+        except jwt.JWTError:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Unable to parse authentication token.'
+            }, 401)
+        if 'kid' not in unverified_header:
+            raise AuthError({
+                'code': 'invalid_header',
+                'description': 'Authorization malformed.'
+            }, 401)
+        rsa_key = jwks.get_key(unverified_header['kid'])
+    finally:
+        timings.record('key_lookup', time.perf_counter() - start)
+
+    if not rsa_key:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to find the appropriate key.'
+        }, 400)
+
+    start = time.perf_counter()
+    try:
+        return jwt.decode(
+            token,
+            rsa_key,
+            algorithms=ALGORITHMS,
+            audience=API_AUDIENCE,
+            issuer='https://' + AUTH0_DOMAIN + '/'
+        )
+
+    except jwt.ExpiredSignatureError:
+        raise AuthError({
+            'code': 'token_expired',
+            'description': 'Token expired.'
+        }, 401)
+
+    except jwt.JWTClaimsError:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Incorrect claims. Please, check the audience and issuer.'
+        }, 401)
+
+    except jwt.JWTError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
+
+    finally:
+        timings.record('signature', time.perf_counter() - start)
+
+
+def check_permissions(permission, payload):
+    if 'permissions' not in payload:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Permissions not included in JWT.'
+        }, 400)
+    if permission not in payload['permissions']:
+        raise AuthError({
+            'code': 'unauthorized',
+            'description': 'Permission not found.'
+        }, 403)
+    return True
+
+
+def requires_auth(permission=''):
+    def requires_auth_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            token = get_token_auth_header()
+            payload = verify_decode_jwt(token)
+            check_permissions(permission, payload)
+
+            return f(payload, *args, **kwargs)
+
+        return wrapper
+    return requires_auth_decorator
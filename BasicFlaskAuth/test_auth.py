@@ -0,0 +1,147 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from jose import jwt
+
+import auth
+from app import app
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+JWKS_FIXTURE = os.path.join(FIXTURES, 'jwks.json')
+
+
+def make_token(permissions=('get:images',), kid='fixture-key', **claims):
+    """Signs a token with the fixture key that jwks.json publishes"""
+    with open(os.path.join(FIXTURES, 'private_key.pem')) as key_file:
+        private_key = key_file.read()
+    payload = {
+        'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+        'aud': auth.API_AUDIENCE,
+        'sub': 'auth0|fixture',
+        'exp': int(time.time()) + 60,
+        'permissions': list(permissions),
+    }
+    payload.update(claims)
+    return jwt.encode(payload, private_key, algorithm='RS256', headers={'kid': kid})
+
+
+class AuthTestCase(unittest.TestCase):
+    """Verifies tokens offline against the local JWKS fixture"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'jwks_cache.json')
+        self.jwks = auth.JWKSCache(url='file://' + JWKS_FIXTURE, cache_file=self.cache_file)
+        patch = mock.patch.object(auth, 'jwks_cache', self.jwks)
+        patch.start()
+        self.addCleanup(patch.stop)
+        auth.timings.reset()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_headers(self, token):
+        return self.client.get('/headers', headers={'Authorization': 'Bearer ' + token})
+
+    def test_valid_token(self):
+        res = self.get_headers(make_token())
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, b'Access Granted')
+
+    def test_keys_are_fetched_once(self):
+        for _ in range(5):
+            self.assertEqual(self.get_headers(make_token()).status_code, 200)
+
+        self.assertEqual(self.jwks.fetches, 1)
+        stats = auth.timings.snapshot()
+        for step in ('header', 'key_lookup', 'signature'):
+            self.assertEqual(stats[step]['count'], 5)
+
+    def test_cache_survives_restart(self):
+        self.get_headers(make_token())
+        restarted = auth.JWKSCache(url='file://' + JWKS_FIXTURE, cache_file=self.cache_file)
+
+        self.assertIsNotNone(restarted.get_key('fixture-key'))
+        self.assertEqual(restarted.fetches, 0)
+
+    def test_unknown_kid_does_not_refetch_every_request(self):
+        for _ in range(3):
+            res = self.get_headers(make_token(kid='unknown-key'))
+            self.assertEqual(res.status_code, 400)
+
+        self.assertEqual(self.jwks.fetches, 1)
+
+    def expire(self, jwks):
+        jwks._fetched_at -= jwks.ttl
+
+    def test_stale_keys_are_served_while_the_issuer_is_down(self):
+        self.assertIsNotNone(self.jwks.get_key('fixture-key'))
+        self.expire(self.jwks)
+        self.jwks.url = 'file://' + os.path.join(self.tmp_dir, 'unreachable.json')
+
+        self.assertEqual(self.get_headers(make_token()).status_code, 200)
+        # the failed fetch is not retried on every request
+        with mock.patch.object(self.jwks, '_fetch', wraps=self.jwks._fetch) as fetch:
+            self.assertEqual(self.get_headers(make_token()).status_code, 200)
+        self.assertEqual(fetch.call_count, 0)
+
+        # past the grace period the keys are no longer trusted
+        self.jwks._fetched_at -= self.jwks.stale_grace
+        self.jwks._failed_at = 0.0
+        res = self.get_headers(make_token())
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.get_json()['message']['code'], 'jwks_unavailable')
+
+    def test_requests_do_not_wait_for_a_refresh(self):
+        jwks = self.jwks
+        jwks.get_key('fixture-key')
+        self.expire(jwks)
+        fetching, release = threading.Event(), threading.Event()
+        fetch = jwks._fetch
+
+        def slow_fetch():
+            fetching.set()
+            release.wait(5)
+            return fetch()
+
+        with mock.patch.object(jwks, '_fetch', side_effect=slow_fetch):
+            refresher = threading.Thread(target=jwks.get_key, args=('fixture-key',))
+            refresher.start()
+            self.assertTrue(fetching.wait(5))
+            # served from the expired keys while the fetch is in flight, without a second fetch
+            start = time.perf_counter()
+            self.assertIsNotNone(jwks.get_key('fixture-key'))
+            self.assertLess(time.perf_counter() - start, 1)
+            release.set()
+            refresher.join(5)
+        self.assertEqual(jwks.fetches, 2)
+        self.assertFalse(jwks._expired())
+
+    def test_errors_keep_their_status(self):
+        missing = self.client.get('/headers')
+        self.assertEqual(missing.status_code, 401)
+        self.assertEqual(missing.get_json()['message']['code'], 'authorization_header_missing')
+
+        expired = self.get_headers(make_token(exp=int(time.time()) - 10))
+        self.assertEqual(expired.get_json()['message']['code'], 'token_expired')
+
+        wrong_audience = self.get_headers(make_token(aud='other'))
+        self.assertEqual(wrong_audience.get_json()['message']['code'], 'invalid_claims')
+
+        forbidden = self.get_headers(make_token(permissions=()))
+        self.assertEqual(forbidden.status_code, 403)
+
+        garbage = self.get_headers('not-a-token')
+        self.assertEqual(garbage.status_code, 401)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,9 @@
+import os
 from functools import wraps
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, abort
+
+from greetings_store import GreetingsStore, EncodedGreetings, is_valid
+from negotiation import LanguageNegotiator
 
 
 def requires_auth(f):
@@ -27,7 +31,7 @@ def get_token_auth_header():
 
 app = Flask(__name__)
 
-greetings = {
+default_greetings = {
     'en': 'hello',
     'es': 'Hola',
     'ar': 'مرحبا',
@@ -37,27 +41,57 @@ greetings = {
     'ja': 'こんにちは'
 }
 
+# set GREETINGS_LOG to share added greetings between workers and keep them across restarts
+greetings = GreetingsStore(initial=default_greetings, path=os.environ.get('GREETINGS_LOG'))
+encoded_greetings = EncodedGreetings(greetings)
+negotiator = LanguageNegotiator(greetings, default='en')
+# path segments of /greeting/... routes, which /greeting/<lang> could never reach
+RESERVED_LANGS = ('negotiate',)
+
+
+def json_body(body):
+    """Sends a pre-encoded body, or 304 when the client's If-None-Match already has it"""
+    response = Response(body.data, mimetype='application/json')
+    response.set_etag(body.etag)
+    return response.make_conditional(request)
+
 
 @app.route('/greeting', methods=['GET'])
 def greeting_all():
-    return jsonify({'greetings': greetings})
+    return json_body(encoded_greetings.all())
+
+
+@app.route('/greeting/negotiate', methods=['GET'])
+def greeting_negotiate():
+    lang = negotiator.resolve(request.headers.get('Accept-Language'))
+    body = encoded_greetings.one(lang) if lang is not None else None
+    if body is None:
+        abort(406)
+    response = json_body(body)
+    response.headers['Content-Language'] = lang
+    response.vary.add('Accept-Language')
+    return response
 
 
 @app.route('/greeting/<lang>', methods=['GET'])
 def greeting_one(lang):
-    print(lang)
-    if (lang not in greetings):
+    body = encoded_greetings.one(lang)
+    if body is None:
         abort(404)
-    return jsonify({'greeting': greetings[lang]})
+    return json_body(body)
 
 
 @app.route('/greeting', methods=['POST'])
 def greeting_add():
-    info = request.get_json()
+    info = request.get_json(silent=True)
+    if not isinstance(info, dict):
+        abort(400)
     if ('lang' not in info or 'greeting' not in info):
         abort(422)
-    greetings[info['lang']] = info['greeting']
-    return jsonify({'greetings': greetings})
+    if not is_valid(info['lang'], info['greeting']) or info['lang'] in RESERVED_LANGS:
+        abort(400)
+    greetings.set(info['lang'], info['greeting'])
+    return json_body(encoded_greetings.all())
 
 
 @app.route('/headers')
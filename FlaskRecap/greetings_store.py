@@ -0,0 +1,230 @@
+import os
+import json
+import uuid
+import fcntl
+import hashlib
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from types import MappingProxyType
+
+
+def is_valid(lang, greeting):
+    """Whether lang and greeting are non-empty strings, the only entries the store keeps"""
+    return isinstance(lang, str) and isinstance(greeting, str) and bool(lang) and bool(greeting)
+
+
+class GreetingsStore:
+    """lang -> greeting map with lock-free reads and serialized writes.
+
+    Readers get an immutable snapshot; every write publishes a new one (copy-on-write), so a
+    reader never sees a half-applied change and never waits for a writer.
+
+    With a path, writes are also appended to a JSON-lines log that every process using the same
+    path replays, so workers share greetings and a restart picks up where it left off. The log
+    is compacted to one line per lang once it holds compact_every lines more than that.
+    """
+
+    def __init__(self, initial=None, path=None, compact_every=1000):
+        self.path = path
+        self.compact_every = compact_every
+
+        self._write_lock = threading.Lock()
+        self._snapshot = MappingProxyType(dict(initial or {}))
+        self._version = 0
+        self._log_id = None
+        self._stat = None
+        self._offset = 0
+        self._lines = 0
+
+        if path:
+            with self._write_lock, self._file_lock():
+                if not os.path.exists(path) or os.path.getsize(path) == 0:
+                    self._write_compacted(self._snapshot)
+                self._catch_up()
+
+    #  ----------------------------------------------------------------
+    #  Reads
+    #  ----------------------------------------------------------------
+
+    def snapshot(self):
+        """The current greetings as a read-only mapping"""
+        if self.path and self._log_changed():
+            with self._write_lock:
+                self._catch_up()
+        return self._snapshot
+
+    def get(self, lang, default=None):
+        return self.snapshot().get(lang, default)
+
+    def version(self):
+        """Increases every time a new snapshot is published"""
+        self.snapshot()
+        return self._version
+
+    #  ----------------------------------------------------------------
+    #  Writes
+    #  ----------------------------------------------------------------
+
+    def set(self, lang, greeting):
+        """Stores a greeting and returns the snapshot that includes it.
+
+        Raises ValueError unless lang and greeting are non-empty strings.
+        """
+        if not is_valid(lang, greeting):
+            raise ValueError('lang and greeting must be non-empty strings')
+        with self._write_lock:
+            if not self.path:
+                self._publish_with(lang, greeting)
+                return self._snapshot
+
+            with self._file_lock():
+                # apply other processes' writes first so ours lands after them
+                self._catch_up()
+                line = json.dumps({'lang': lang, 'greeting': greeting}, ensure_ascii=False) + '\n'
+                with open(self.path, 'a', encoding='utf-8') as log:
+                    log.write(line)
+                self._offset += len(line.encode('utf-8'))
+                self._lines += 1
+                self._stat = self._stat_key()
+                self._publish_with(lang, greeting)
+
+                if self._lines >= len(self._snapshot) + self.compact_every:
+                    self._write_compacted(self._snapshot)
+            return self._snapshot
+
+    def compact(self):
+        """Rewrites the log as one line per lang"""
+        if not self.path:
+            return
+        with self._write_lock, self._file_lock():
+            self._catch_up()
+            self._write_compacted(self._snapshot)
+
+    #  ----------------------------------------------------------------
+    #  Internals
+    #  ----------------------------------------------------------------
+
+    def _publish(self, greetings):
+        self._snapshot = MappingProxyType(greetings)
+        self._version += 1
+
+    def _publish_with(self, lang, greeting):
+        greetings = dict(self._snapshot)
+        greetings[lang] = greeting
+        self._publish(greetings)
+
+    @contextmanager
+    def _file_lock(self):
+        # a separate lock file, since compaction swaps the log's inode
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _stat_key(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _log_changed(self):
+        return self._stat_key() != self._stat
+
+    def _catch_up(self):
+        """Applies log lines written since the last read; call with _write_lock held"""
+        stat = self._stat_key()
+        if stat is None or stat == self._stat:
+            return
+
+        with open(self.path, 'rb') as log:
+            header = json.loads(log.readline().decode('utf-8'))
+            if header.get('log') != self._log_id or stat[1] < self._offset:
+                # compacted by another process (or first read): replay the whole file
+                greetings, self._lines = {}, 0
+                self._log_id = header['log']
+                self._offset = log.tell()
+            else:
+                greetings = dict(self._snapshot)
+                log.seek(self._offset)
+            data = log.read()
+
+        # a line still being appended by another process is picked up next time
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            self._lines += 1
+            try:
+                entry = json.loads(line.decode('utf-8'))
+                lang, greeting = entry['lang'], entry['greeting']
+            except (ValueError, TypeError, KeyError):
+                continue
+            # a bad record (e.g. written before set() checked its arguments) is skipped, not
+            # published, and compaction drops it
+            if is_valid(lang, greeting):
+                greetings[lang] = greeting
+        self._offset += len(complete)
+        self._stat = stat if len(complete) == len(data) else None
+        self._publish(greetings)
+
+    def _write_compacted(self, greetings):
+        """Replaces the log with one line per lang; call with both locks held"""
+        log_id = uuid.uuid4().hex
+        tmp_path = self.path + '.compact'
+        with open(tmp_path, 'w', encoding='utf-8') as log:
+            # the header tells readers this is a new file, even if the filesystem reuses the inode
+            log.write(json.dumps({'log': log_id}) + '\n')
+            for lang, greeting in greetings.items():
+                log.write(json.dumps({'lang': lang, 'greeting': greeting}, ensure_ascii=False) + '\n')
+            log.flush()
+            os.fsync(log.fileno())
+        os.replace(tmp_path, self.path)
+        self._log_id = log_id
+        self._offset = os.path.getsize(self.path)
+        self._lines = len(greetings)
+        self._stat = self._stat_key()
+
+
+def encode_json(data):
+    """The bytes jsonify would send for data with its default settings"""
+    return (json.dumps(data, separators=(',', ':'), sort_keys=True) + '\n').encode('utf-8')
+
+
+Body = namedtuple('Body', 'data etag')
+
+
+def make_body(data):
+    encoded = encode_json(data)
+    # content-based, so every worker hands out the same etag for the same greetings
+    return Body(encoded, hashlib.sha1(encoded).hexdigest())
+
+
+class EncodedGreetings:
+    """Pre-encoded response bodies for a GreetingsStore, rebuilt only when its snapshot changes"""
+
+    def __init__(self, store):
+        self.store = store
+        self._encoded = (None, None, {})
+
+    def all(self):
+        """Body of {'greetings': {...}}"""
+        return self._current()[1]
+
+    def one(self, lang):
+        """Body of {'greeting': ...}, or None for an unknown lang"""
+        return self._current()[2].get(lang)
+
+    def _current(self):
+        snapshot = self.store.snapshot()
+        encoded = self._encoded
+        if encoded[0] is not snapshot:
+            # racing threads build identical bodies, so the last assignment wins harmlessly
+            encoded = (
+                snapshot,
+                make_body({'greetings': dict(snapshot)}),
+                {lang: make_body({'greeting': greeting}) for lang, greeting in snapshot.items()},
+            )
+            self._encoded = encoded
+        return encoded
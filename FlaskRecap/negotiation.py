@@ -0,0 +1,98 @@
+import threading
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1024)
+def parse_accept_language(header):
+    """Language ranges of an Accept-Language header, best first, without the q=0 ones.
+
+    EXAMPLE
+        parse_accept_language('es-MX,es;q=0.9,en;q=0.5,fr;q=0') == ('es-mx', 'es', 'en')
+    """
+    ranges = []
+    for position, part in enumerate(header.split(',')):
+        tag, _, params = part.partition(';')
+        tag = tag.strip().lower()
+        if not tag:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, position, tag))
+    # sorting on position too keeps the client's order between equal qualities
+    return tuple(tag for _, _, tag in sorted(ranges))
+
+
+def build_locale_index(langs):
+    """Lowercased tag -> available lang, with every prefix of a lang falling back to it.
+
+    An exact lang always wins over a prefix, so {'es', 'es-MX'} indexes 'es' -> 'es' while
+    {'pt-BR'} alone indexes 'pt' -> 'pt-BR'.
+    """
+    index = {}
+    for lang in sorted(langs, key=lambda lang: (lang.count('-'), lang)):
+        subtags = lang.lower().split('-')
+        for end in range(len(subtags), 0, -1):
+            index.setdefault('-'.join(subtags[:end]), lang)
+    for lang in langs:
+        index[lang.lower()] = lang
+    return index
+
+
+class LanguageNegotiator:
+    """Picks the greetings lang for an Accept-Language header in O(1) for headers seen before.
+
+    The locale index is rebuilt only when the store publishes a new snapshot; resolved headers
+    are cached per snapshot, at most max_headers of them.
+    """
+
+    def __init__(self, store, default='en', max_headers=4096):
+        self.store = store
+        self.default = default
+        self.max_headers = max_headers
+        self._lock = threading.Lock()
+        self._state = (None, {}, {})
+
+    def resolve(self, header):
+        """The best available lang for header, or None when nothing acceptable exists"""
+        snapshot, index, resolved = self._current()
+        header = (header or '').strip()
+        if header in resolved:
+            return resolved[header]
+
+        lang = self._lookup(parse_accept_language(header) if header else ('*',), index, snapshot)
+        with self._lock:
+            if self._state[2] is resolved:
+                if len(resolved) >= self.max_headers:
+                    resolved.clear()
+                resolved[header] = lang
+        return lang
+
+    def _lookup(self, ranges, index, snapshot):
+        for tag in ranges:
+            if tag == '*':
+                return self.default if self.default in snapshot else next(iter(snapshot), None)
+            # es-MX falls back to es, then to whatever the index maps es to
+            subtags = tag.split('-')
+            for end in range(len(subtags), 0, -1):
+                lang = index.get('-'.join(subtags[:end]))
+                if lang is not None:
+                    return lang
+        return None
+
+    def _current(self):
+        snapshot = self.store.snapshot()
+        state = self._state
+        if state[0] is not snapshot:
+            with self._lock:
+                state = self._state
+                if state[0] is not snapshot:
+                    state = (snapshot, build_locale_index(snapshot), {})
+                    self._state = state
+        return state
@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import json, jsonify
+
+from greetings_store import GreetingsStore, EncodedGreetings
+from FlaskRecap import app
+
+
+class GreetingsStoreTestCase(unittest.TestCase):
+    """Checks copy-on-write snapshots and the shared append-only log"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'greetings.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_snapshots_are_not_changed_by_writes(self):
+        store = GreetingsStore(initial={'en': 'hello'})
+        before = store.snapshot()
+        version = store.version()
+
+        store.set('fi', 'Hei')
+
+        self.assertEqual(dict(before), {'en': 'hello'})
+        self.assertEqual(store.get('fi'), 'Hei')
+        self.assertGreater(store.version(), version)
+        with self.assertRaises(TypeError):
+            before['de'] = 'Hallo'
+
+    def test_stores_on_one_log_see_each_others_writes(self):
+        first = GreetingsStore(initial={'en': 'hello'}, path=self.path)
+        second = GreetingsStore(initial={'en': 'ignored'}, path=self.path)
+
+        first.set('es', 'Hola')
+        second.set('ja', 'こんにちは')
+
+        for store in (first, second):
+            self.assertEqual(dict(store.snapshot()), {'en': 'hello', 'es': 'Hola', 'ja': 'こんにちは'})
+
+    def test_compaction_is_picked_up_by_other_stores(self):
+        first = GreetingsStore(initial={'en': 'hello'}, path=self.path, compact_every=3)
+        second = GreetingsStore(path=self.path)
+
+        for n in range(10):
+            first.set('en', 'hello %d' % n)
+        second.set('fi', 'Hei')
+
+        with open(self.path) as log:
+            # the header and at most compact_every lines past one per lang
+            self.assertLessEqual(len(log.readlines()), 1 + 2 + 3)
+        self.assertEqual(dict(first.snapshot()), {'en': 'hello 9', 'fi': 'Hei'})
+        self.assertEqual(dict(second.snapshot()), {'en': 'hello 9', 'fi': 'Hei'})
+
+    def test_restart_replays_the_log(self):
+        store = GreetingsStore(initial={'en': 'hello'}, path=self.path)
+        store.set('en', 'hi')
+        store.set('he', 'שלום')
+        store.compact()
+        store.set('ru', 'Привет')
+
+        restarted = GreetingsStore(initial={'en': 'hello'}, path=self.path)
+        self.assertEqual(dict(restarted.snapshot()), {'en': 'hi', 'he': 'שלום', 'ru': 'Привет'})
+
+    def test_partial_line_waits_for_its_end(self):
+        store = GreetingsStore(initial={'en': 'hello'}, path=self.path)
+        with open(self.path, 'a', encoding='utf-8') as log:
+            log.write('{"lang": "fi", ')
+        self.assertIsNone(store.get('fi'))
+
+        with open(self.path, 'a', encoding='utf-8') as log:
+            log.write('"greeting": "Hei"}\n')
+        self.assertEqual(store.get('fi'), 'Hei')
+
+    def test_bad_values_are_rejected(self):
+        store = GreetingsStore(initial={'en': 'hello'}, path=self.path)
+        for lang, greeting in ((5, 'x'), ('de', None), ('', 'Hallo'), ('de', ['Hallo'])):
+            with self.assertRaises(ValueError):
+                store.set(lang, greeting)
+        self.assertEqual(dict(store.snapshot()), {'en': 'hello'})
+
+    def test_replay_skips_bad_records(self):
+        store = GreetingsStore(initial={'en': 'hello'}, path=self.path)
+        with open(self.path, 'a', encoding='utf-8') as log:
+            log.write('{"lang": 5, "greeting": "x"}\n{"lang": "de"}\nnot json\n{"lang": "fi", "greeting": "Hei"}\n')
+
+        restarted = GreetingsStore(path=self.path)
+        for current in (store, restarted):
+            self.assertEqual(dict(current.snapshot()), {'en': 'hello', 'fi': 'Hei'})
+        self.assertEqual(json.loads(EncodedGreetings(restarted).all().data),
+                         {'greetings': {'en': 'hello', 'fi': 'Hei'}})
+
+
+class EncodedGreetingsTestCase(unittest.TestCase):
+    """Checks the pre-encoded bodies and the conditional GET endpoints"""
+
+    def test_bodies_are_reused_until_a_write(self):
+        store = GreetingsStore(initial={'en': 'hello'})
+        encoded = EncodedGreetings(store)
+
+        body = encoded.all()
+        self.assertIs(encoded.all(), body)
+        self.assertEqual(json.loads(body.data), {'greetings': {'en': 'hello'}})
+
+        store.set('fi', 'Hei')
+        self.assertIsNot(encoded.all(), body)
+        self.assertNotEqual(encoded.all().etag, body.etag)
+        self.assertEqual(json.loads(encoded.one('fi').data), {'greeting': 'Hei'})
+        self.assertIsNone(encoded.one('de'))
+
+    def test_matching_etag_is_not_modified(self):
+        client = app.test_client()
+        for url in ('/greeting', '/greeting/ja'):
+            res = client.get(url)
+            self.assertEqual(res.status_code, 200)
+            with app.app_context():
+                self.assertEqual(res.data, jsonify(res.get_json()).data)
+
+            cached = client.get(url, headers={'If-None-Match': res.headers['ETag']})
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached.data, b'')
+
+        self.assertEqual(client.get('/greeting/ja').get_json(), {'greeting': 'こんにちは'})
+        self.assertEqual(client.get('/greeting/xx').status_code, 404)
+
+    def test_bad_greetings_are_rejected(self):
+        client = app.test_client()
+        for info in ({'lang': 5, 'greeting': 'x'}, {'lang': 'de', 'greeting': ''}, ['de', 'Hallo']):
+            self.assertEqual(client.post('/greeting', json=info).status_code, 400)
+        self.assertEqual(client.post('/greeting', data='not json').status_code, 400)
+        self.assertEqual(client.post('/greeting', json={'lang': 'de'}).status_code, 422)
+        self.assertEqual(client.get('/greeting').status_code, 200)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from greetings_store import GreetingsStore
+from negotiation import LanguageNegotiator, build_locale_index, parse_accept_language
+from FlaskRecap import app
+
+
+class NegotiationTestCase(unittest.TestCase):
+    """Checks Accept-Language parsing and resolution through the locale index"""
+
+    def setUp(self):
+        self.store = GreetingsStore(initial={'en': 'hello', 'es': 'Hola', 'pt-BR': 'Olá'})
+        self.negotiator = LanguageNegotiator(self.store)
+
+    def test_parse_orders_by_quality(self):
+        self.assertEqual(parse_accept_language('fr;q=0.2, es-MX, en;q=0.5, de;q=0'), ('es-mx', 'en', 'fr'))
+        self.assertEqual(parse_accept_language('da, en-gb;q=0.8, en;q=0.8'), ('da', 'en-gb', 'en'))
+        self.assertEqual(parse_accept_language('fi;q=abc, ,ja'), ('ja',))
+
+    def test_index_falls_back_both_ways(self):
+        index = build_locale_index(['es', 'es-MX', 'pt-BR'])
+        self.assertEqual(index['es'], 'es')
+        self.assertEqual(index['es-mx'], 'es-MX')
+        self.assertEqual(index['pt'], 'pt-BR')
+
+    def test_resolve(self):
+        self.assertEqual(self.negotiator.resolve('es-MX,en;q=0.5'), 'es')
+        self.assertEqual(self.negotiator.resolve('pt;q=0.9, de'), 'pt-BR')
+        self.assertEqual(self.negotiator.resolve('de, *;q=0.1'), 'en')
+        self.assertEqual(self.negotiator.resolve(None), 'en')
+        self.assertIsNone(self.negotiator.resolve('de, fr'))
+
+    def test_cache_is_dropped_when_greetings_change(self):
+        self.assertIsNone(self.negotiator.resolve('de-AT'))
+        self.store.set('de', 'Hallo')
+        self.assertEqual(self.negotiator.resolve('de-AT'), 'de')
+
+    def test_endpoint(self):
+        client = app.test_client()
+
+        res = client.get('/greeting/negotiate', headers={'Accept-Language': 'ja-JP, en;q=0.5'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json(), {'greeting': 'こんにちは'})
+        self.assertEqual(res.headers['Content-Language'], 'ja')
+        self.assertIn('Accept-Language', res.headers['Vary'])
+
+        res = client.get('/greeting/negotiate', headers={'Accept-Language': 'xx'})
+        self.assertEqual(res.status_code, 406)
+
+    def test_negotiate_is_not_a_language(self):
+        client = app.test_client()
+        res = client.post('/greeting', json={'lang': 'negotiate', 'greeting': 'shadowed'})
+        self.assertEqual(res.status_code, 400)
+        self.assertNotIn('negotiate', client.get('/greeting').get_json()['greetings'])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,303 @@
+"""Replays a Postman collection against a running app and reports latency per request.
+
+EXAMPLE
+    python postman_load.py ../FlaskRecap/udacity-fsnd-flaskrecap.postman_collection.json \\
+        --concurrency 8 --duration 10
+"""
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+from collections import namedtuple
+from urllib.parse import urlsplit, urlencode
+
+PlannedRequest = namedtuple('PlannedRequest', 'label method url headers body')
+
+VARIABLE = re.compile(r'{{\s*([^{}\s]+)\s*}}')
+PERCENTILES = (50, 90, 99)
+
+
+#  ----------------------------------------------------------------
+#  Collections
+#  ----------------------------------------------------------------
+
+def substitute(text, variables, missing):
+    def replace(match):
+        name = match.group(1)
+        if name not in variables:
+            missing.add(name)
+            return match.group(0)
+        return str(variables[name])
+    return VARIABLE.sub(replace, text)
+
+
+def load_collection(path, variables=None, folders=None, base_url=None):
+    """The requests of a v2.x collection, in order, with variables and inherited auth applied.
+
+    variables override the collection's own; folders keeps only requests under those folder
+    names; base_url replaces the scheme and host of every request. Raises ValueError when a
+    {{variable}} has no value.
+    """
+    with open(path, encoding='utf-8') as collection_file:
+        collection = json.load(collection_file)
+
+    values = {variable['key']: variable.get('value', '') for variable in collection.get('variable', [])}
+    values.update(variables or {})
+    missing = set()
+    planned = []
+
+    def walk(items, trail, auth, selected):
+        for item in items:
+            in_folder = selected or not folders or item.get('name') in folders
+            if 'item' in item:
+                walk(item['item'], trail + [item['name']], item.get('auth', auth), in_folder)
+            elif in_folder:
+                planned.append(plan_request(item, trail, auth, values, missing, base_url))
+
+    walk(collection['item'], [], collection.get('auth'), False)
+    if missing:
+        raise ValueError('no value for collection variables: ' + ', '.join(sorted(missing))
+                         + ' (pass them with --var name=value)')
+    return planned
+
+
+def plan_request(item, trail, inherited_auth, values, missing, base_url):
+    request = item['request']
+    url = request['url']['raw'] if isinstance(request['url'], dict) else request['url']
+    url = substitute(url, values, missing)
+    if '://' not in url:
+        url = 'http://' + url
+    if base_url:
+        parts = urlsplit(url)
+        url = base_url.rstrip('/') + parts.path + ('?' + parts.query if parts.query else '')
+
+    headers = {}
+    for header in request.get('header', []):
+        if not header.get('disabled'):
+            headers[header['key']] = substitute(header['value'], values, missing)
+
+    auth = request.get('auth', inherited_auth)
+    if auth and auth.get('type') == 'bearer' and 'Authorization' not in headers:
+        token = {entry['key']: entry.get('value', '') for entry in auth.get('bearer', [])}.get('token', '')
+        headers['Authorization'] = 'Bearer ' + substitute(token, values, missing)
+
+    body = None
+    spec = request.get('body') or {}
+    if spec.get('mode') == 'raw' and spec.get('raw'):
+        body = substitute(spec['raw'], values, missing).encode('utf-8')
+        if spec.get('options', {}).get('raw', {}).get('language') == 'json':
+            headers.setdefault('Content-Type', 'application/json')
+    elif spec.get('mode') == 'urlencoded':
+        fields = [(field['key'], substitute(field.get('value', ''), values, missing))
+                  for field in spec['urlencoded'] if not field.get('disabled')]
+        body = urlencode(fields).encode('utf-8')
+        headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+
+    label = '/'.join(trail + [item['name']])
+    return PlannedRequest(label, request['method'], url, headers, body)
+
+
+#  ----------------------------------------------------------------
+#  Load
+#  ----------------------------------------------------------------
+
+class RequestStats:
+    def __init__(self, planned):
+        self.planned = planned
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def percentile(self, pct):
+        """Nearest-rank percentile of the latencies, in seconds"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        rank = max(1, -(-pct * len(ordered) // 100))
+        return ordered[int(rank) - 1]
+
+
+class Worker(threading.Thread):
+    """Sends the planned requests round-robin over keep-alive connections until told to stop"""
+
+    def __init__(self, planned, offset, deadline, budget, timeout):
+        super().__init__(daemon=True)
+        self.planned = planned
+        self.offset = offset
+        self.deadline = deadline
+        self.budget = budget
+        self.timeout = timeout
+        # per worker, so recording never contends with other threads
+        self.stats = [RequestStats(request) for request in planned]
+        self._connections = {}
+
+    def run(self):
+        position = self.offset
+        while time.perf_counter() < self.deadline and self.budget.take():
+            index = position % len(self.planned)
+            position += 1
+            self.send(index)
+        for connection in self._connections.values():
+            connection.close()
+
+    def send(self, index):
+        request = self.planned[index]
+        stats = self.stats[index]
+        parts = urlsplit(request.url)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+        start = time.perf_counter()
+        try:
+            connection = self.connection(parts.scheme, parts.netloc)
+            connection.request(request.method, path, body=request.body, headers=request.headers)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            stats.errors += 1
+            broken = self._connections.pop((parts.scheme, parts.netloc), None)
+            if broken is not None:
+                broken.close()
+            return
+        stats.latencies.append(time.perf_counter() - start)
+        stats.statuses[response.status] = stats.statuses.get(response.status, 0) + 1
+        if response.will_close:
+            self._connections.pop((parts.scheme, parts.netloc)).close()
+
+    def connection(self, scheme, netloc):
+        key = (scheme, netloc)
+        if key not in self._connections:
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            self._connections[key] = connection_class(netloc, timeout=self.timeout)
+        return self._connections[key]
+
+
+class Budget:
+    """Shared count of requests left to send; None means unlimited"""
+
+    def __init__(self, total=None):
+        self.left = total
+        self._lock = threading.Lock()
+
+    def take(self):
+        if self.left is None:
+            return True
+        with self._lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+def run_load(planned, concurrency=4, duration=10.0, max_requests=None, timeout=10.0):
+    """Replays planned from concurrency threads for duration seconds or max_requests requests.
+
+    Returns (elapsed seconds, [RequestStats per planned request, merged over workers]).
+    """
+    if not planned:
+        raise ValueError('the collection has no requests to replay')
+    start = time.perf_counter()
+    budget = Budget(max_requests)
+    workers = [Worker(planned, offset, start + duration, budget, timeout) for offset in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    merged = [RequestStats(request) for request in planned]
+    for worker in workers:
+        for total, stats in zip(merged, worker.stats):
+            total.latencies.extend(stats.latencies)
+            total.errors += stats.errors
+            for status, count in stats.statuses.items():
+                total.statuses[status] = total.statuses.get(status, 0) + count
+    return elapsed, merged
+
+
+#  ----------------------------------------------------------------
+#  Report
+#  ----------------------------------------------------------------
+
+def summarize(elapsed, results):
+    """One dict per request plus a final 'TOTAL' row"""
+    total = RequestStats(PlannedRequest('TOTAL', '', '', {}, None))
+    rows = []
+    for stats in results + [total]:
+        if stats is not total:
+            total.latencies.extend(stats.latencies)
+            total.errors += stats.errors
+            for status, count in stats.statuses.items():
+                total.statuses[status] = total.statuses.get(status, 0) + count
+        row = {
+            'request': stats.planned.label,
+            'method': stats.planned.method,
+            'count': len(stats.latencies),
+            'errors': stats.errors,
+            'rps': len(stats.latencies) / elapsed if elapsed else 0.0,
+            'statuses': dict(sorted(stats.statuses.items())),
+        }
+        for pct in PERCENTILES:
+            value = stats.percentile(pct)
+            row['p%d_ms' % pct] = None if value is None else value * 1000
+        rows.append(row)
+    return rows
+
+
+def format_table(rows):
+    columns = ['method', 'request', 'count', 'errors', 'rps'] + ['p%d_ms' % pct for pct in PERCENTILES] + ['statuses']
+    cells = [[
+        '-' if row[column] is None
+        else '%.1f' % row[column] if isinstance(row[column], float)
+        else ' '.join('%s:%s' % item for item in row[column].items()) if isinstance(row[column], dict)
+        else str(row[column])
+        for column in columns
+    ] for row in rows]
+    widths = [max(len(column), *(len(line[i]) for line in cells)) for i, column in enumerate(columns)]
+    lines = [columns] + cells
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in lines)
+
+
+def parse_variables(pairs):
+    variables = {}
+    for pair in pairs:
+        name, sep, value = pair.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError('--var expects name=value, got %r' % pair)
+        variables[name] = value
+    return variables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('collection', help='path to a Postman v2.x collection')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='parallel connections (default 4)')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='seconds to run (default 10)')
+    parser.add_argument('-n', '--requests', type=int, help='stop after this many requests in total')
+    parser.add_argument('--base-url', help='send everything here instead, e.g. http://127.0.0.1:8000')
+    parser.add_argument('--var', action='append', default=[], metavar='NAME=VALUE',
+                        help='set a collection variable, e.g. --var host=localhost:5000')
+    parser.add_argument('--folder', action='append', help='only replay requests in this folder')
+    parser.add_argument('--timeout', type=float, default=10.0, help='per request timeout in seconds')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        planned = load_collection(args.collection, parse_variables(args.var), args.folder, args.base_url)
+    except (ValueError, argparse.ArgumentTypeError) as error:
+        parser.error(str(error))
+
+    elapsed, results = run_load(planned, args.concurrency, args.duration, args.requests, args.timeout)
+    rows = summarize(elapsed, results)
+    if args.json:
+        print(json.dumps({'elapsed_s': elapsed, 'concurrency': args.concurrency, 'requests': rows}, indent=2))
+    else:
+        print('%d requests in %.1fs from %d connections' % (rows[-1]['count'], elapsed, args.concurrency))
+        print(format_table(rows))
+    return 1 if rows[-1]['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
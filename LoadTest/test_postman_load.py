@@ -0,0 +1,112 @@
+import os
+import json
+import http.client
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import postman_load
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLASK_RECAP = os.path.join(ROOT, 'FlaskRecap', 'udacity-fsnd-flaskrecap.postman_collection.json')
+COFFEE_SHOP = os.path.join(ROOT, 'projects', '03_coffee_shop_full_stack', 'starter_code', 'backend',
+                           'udacity-fsnd-udaspicelatte.postman_collection.json')
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle_one(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        body = b'{}'
+        self.send_response(404 if self.path == '/missing' else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = handle_one
+
+    def log_message(self, *args):
+        pass
+
+
+class LoadCollectionTestCase(unittest.TestCase):
+    """Checks how collections turn into requests"""
+
+    def test_shipped_collections(self):
+        greetings = postman_load.load_collection(FLASK_RECAP, base_url='http://localhost:8000')
+        self.assertEqual([request.method for request in greetings], ['GET', 'GET', 'POST'])
+        self.assertEqual(greetings[2].url, 'http://localhost:8000/greeting')
+        self.assertEqual(json.loads(greetings[2].body), {'lang': 'fr', 'greeting': 'bonjour'})
+
+        drinks = postman_load.load_collection(COFFEE_SHOP, folders=['manager'])
+        self.assertTrue(all(request.label.startswith('manager/') for request in drinks))
+        self.assertEqual(drinks[0].url, 'http://localhost:5000/drinks')
+        # the folder's bearer token is inherited by its requests
+        self.assertTrue(drinks[0].headers['Authorization'].startswith('Bearer ey'))
+
+        public = postman_load.load_collection(COFFEE_SHOP, folders=['public'])
+        # an explicit header wins over auth, and noauth sends none
+        self.assertEqual(public[2].headers, {'Authorization': 'Bearer'})
+        self.assertNotIn('Authorization', public[0].headers)
+
+
+class RunLoadTestCase(unittest.TestCase):
+    """Replays a collection against a local server"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.collection = os.path.join(self.tmp_dir, 'collection.json')
+        with open(self.collection, 'w') as collection_file:
+            json.dump({
+                'variable': [{'key': 'host', 'value': 'localhost:1'}],
+                'item': [
+                    {'name': 'ok', 'request': {'method': 'GET', 'url': '{{host}}/ok'}},
+                    {'name': 'missing', 'request': {'method': 'GET', 'url': {'raw': '{{host}}/missing'}}},
+                ],
+            }, collection_file)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_stats_per_request(self):
+        host = '127.0.0.1:%d' % self.server.server_address[1]
+        planned = postman_load.load_collection(self.collection, variables={'host': host})
+
+        elapsed, results = postman_load.run_load(planned, concurrency=2, duration=5, max_requests=40)
+        rows = postman_load.summarize(elapsed, results)
+
+        self.assertEqual([row['count'] for row in rows], [20, 20, 40])
+        self.assertEqual(rows[0]['statuses'], {200: 20})
+        self.assertEqual(rows[1]['statuses'], {404: 20})
+        self.assertEqual(rows[2]['errors'], 0)
+        self.assertLessEqual(rows[2]['p50_ms'], rows[2]['p99_ms'])
+        self.assertIn('TOTAL', postman_load.format_table(rows))
+
+    def test_missing_variable(self):
+        with open(self.collection, 'w') as collection_file:
+            json.dump({'item': [{'name': 'ok', 'request': {'method': 'GET', 'url': '{{host}}/ok'}}]}, collection_file)
+        with self.assertRaises(ValueError):
+            postman_load.load_collection(self.collection)
+
+    def test_connection_errors_are_counted(self):
+        planned = postman_load.load_collection(self.collection, variables={'host': '127.0.0.1:1'})
+        close = http.client.HTTPConnection.close
+        with mock.patch.object(http.client.HTTPConnection, 'close', autospec=True, side_effect=close) as closed:
+            _, results = postman_load.run_load(planned, concurrency=1, duration=5, max_requests=4, timeout=1)
+        self.assertEqual([stats.errors for stats in results], [2, 2])
+        # every failed connection is closed, not just dropped
+        self.assertEqual(closed.call_count, 4)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
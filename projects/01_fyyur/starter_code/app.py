@@ -2,28 +2,39 @@
 # Imports
 # ----------------------------------------------------------------------------#
 
-import os, sys, datetime
+import os
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-import logging
-from logging import Formatter, FileHandler
-from flask_wtf import Form
-from forms import *
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify
+from sqlalchemy import and_, func, or_
+from assets import Assets
+from templating import setup_templates
+from log_queue import setup_logging
+from lazy import lazy_import
+from fsnd_shared.metrics import Metrics
+from query_audit import QueryAudit
+from replicas import RoutingSQLAlchemy
+import geo
+from autocomplete import PrefixIndex
+
+# imported on first use, so workers only pay for them when a request needs them;
+# run profile_imports.py to see what startup still costs
+dateutil_parser = lazy_import('dateutil.parser')
+babel_dates = lazy_import('babel.dates')
+forms = lazy_import('forms')
 
 # ----------------------------------------------------------------------------#
 # App Config.
 # ----------------------------------------------------------------------------#
 
 app = Flask(__name__)
-moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+db = RoutingSQLAlchemy(app)  # GET requests read from the replica binds, see replicas.py
+metrics = Metrics(app)
+query_audit = QueryAudit(app)  # N+1 reports, on in debug or with QUERY_AUDIT=true
+assets = Assets(app)  # hashed static files once `python assets.py` has built them
+# Flask-Migrate is set up in manage.py, so only `flask db` commands load it
+
 
 # ----------------------------------------------------------------------------#
 # Models.
@@ -45,7 +56,32 @@ class Venue(db.Model):
     website = db.Column(db.String(500))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
-    shows = db.relationship('Show', backref='venue', lazy=True, cascade='delete')
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(geo.MAX_PRECISION), index=True)  # see geo.py
+    # the database deletes a venue's shows (ON DELETE CASCADE), the ORM does not load them for it
+    shows = db.relationship('Show', backref='venue', lazy=True, cascade='all, delete', passive_deletes=True)
+
+    def set_location(self, latitude, longitude):
+        self.latitude, self.longitude = latitude, longitude
+        self.geohash = geo.encode(latitude, longitude) if latitude is not None else None
+
+    @classmethod
+    def near(cls, latitude, longitude, radius_km, limit):
+        """[(venue, distance in km)] of the venues within radius_km, nearest first.
+
+        Distances are only computed for venues in the geohash cells around the point.
+        """
+        cells = []
+        for low, high in map(geo.prefix_range, geo.covering_cells(latitude, longitude, radius_km)):
+            cells.append(cls.geohash >= low if high is None else and_(cls.geohash >= low, cls.geohash < high))
+        found = []
+        for venue in cls.query.filter(or_(*cells)):
+            distance = geo.distance_km(latitude, longitude, venue.latitude, venue.longitude)
+            if distance <= radius_km:
+                found.append((venue, distance))
+        found.sort(key=lambda item: item[1])
+        return found[:limit]
 
 
 class Artist(db.Model):
@@ -62,16 +98,70 @@ class Artist(db.Model):
     website = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String(500))
-    shows = db.relationship('Show', backref='artist', lazy=True, cascade='delete')
+    shows = db.relationship('Show', backref='artist', lazy=True, cascade='all, delete', passive_deletes=True)
+
+
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+# bounds how far back a booking check looks, so it only reads the index near the new show
+MAX_SHOW_DURATION = timedelta(hours=24)
+
+
+def default_end_time(context):
+    return context.get_current_parameters()['start_time'] + DEFAULT_SHOW_DURATION
 
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    # on postgres, the migration also adds exclusion constraints that reject overlapping
+    # shows of one venue or artist, even when two bookings race past find_conflict
+    __table_args__ = (
+        db.Index('ix_show_venue_start', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_start', 'artist_id', 'start_time'),
+        db.CheckConstraint('end_time > start_time', name='ck_show_end_after_start'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False, default=default_end_time)
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time
+
+    @classmethod
+    def find_conflict(cls, venue_id, artist_id, start_time, end_time):
+        """A show of the venue or the artist overlapping [start_time, end_time), or None"""
+        return cls.overlapping(venue_id, artist_id, start_time, end_time).first()
+
+    @classmethod
+    def overlapping(cls, venue_id, artist_id, start_time, end_time):
+        """Shows last at most MAX_SHOW_DURATION, so only shows starting in
+        (start_time - MAX_SHOW_DURATION, end_time) can overlap: one range scan on the
+        (venue_id, start_time) and (artist_id, start_time) indexes, however many shows
+        the venue or artist has.
+        """
+        return cls.query.filter(
+            or_(cls.venue_id == venue_id, cls.artist_id == artist_id),
+            cls.start_time > start_time - MAX_SHOW_DURATION,
+            cls.start_time < end_time,
+            cls.end_time > start_time,
+        ).order_by(cls.start_time)
+
+
+def load_names():
+    # its own connection rather than db.session, since reloads run in a background thread
+    with db.engine.connect() as connection:
+        return ([('venue', venue_id, name) for venue_id, name in
+                 connection.execute(db.select([Venue.id, Venue.name]))] +
+                [('artist', artist_id, name) for artist_id, name in
+                 connection.execute(db.select([Artist.id, Artist.name]))])
+
+
+# venue and artist names for /autocomplete, reloaded in the background every minute for other
+# workers' edits
+name_index = PrefixIndex(load_names, max_age=60)
 
 
 # ----------------------------------------------------------------------------#
@@ -79,15 +169,23 @@ class Show(db.Model):
 # ----------------------------------------------------------------------------#
 
 def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
+    date = value if isinstance(value, datetime) else dateutil_parser.parse(value)
     if format == 'full':
         format = "EEEE MMMM, d, y 'at' h:mma"
     elif format == 'medium':
         format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format)
+    return babel_dates.format_datetime(date, format)
 
 
 app.jinja_env.filters['datetime'] = format_datetime
+# after the filters: templates using one that is not registered yet do not compile
+template_timings = setup_templates(app)
+
+
+def locate_venue(venue):
+    """Sets the venue's coordinates to those of its city in the gazetteer, if it is there"""
+    location = geo.locate(venue.city, venue.state, app.config['GAZETTEER_FILE'])
+    venue.set_location(*(location or (None, None)))
 
 
 def extract_genres(genre_string):
@@ -108,6 +206,27 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+@app.route('/autocomplete')
+def autocomplete():
+    # venues and artists with a word starting with ?q=, as JSON; ?type=venue|artist narrows it
+    kind = request.args.get('type')
+    limit = request.args.get('limit', 10, type=int)
+    if kind not in (None, 'venue', 'artist') or not 0 < limit <= 50:
+        return jsonify({'error': 'type is venue or artist, limit is 1 to 50'}), 400
+    suggestions = name_index.search(request.args.get('q', ''), limit, kind)
+    return jsonify({
+        'suggestions': [
+            {
+                'type': record_kind,
+                'id': record_id,
+                'name': name,
+                'url': url_for('show_' + record_kind, **{record_kind + '_id': record_id}),
+            }
+            for record_kind, record_id, name in suggestions
+        ]
+    })
+
+
 @app.route('/venues')
 def venues():
     venues = Venue.query.all()
@@ -151,6 +270,47 @@ def search_venues():
     return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
+@app.route('/venues/near')
+def venues_near():
+    # nearest venues to ?lat=&lon=, or to ?city=&state=, within ?radius= km, as JSON
+    try:
+        if 'city' in request.args:
+            location = geo.locate(request.args['city'], request.args.get('state', ''), app.config['GAZETTEER_FILE'])
+            if location is None:
+                return jsonify({'error': 'unknown city'}), 404
+            latitude, longitude = location
+        else:
+            latitude, longitude = float(request.args['lat']), float(request.args['lon'])
+        radius = float(request.args.get('radius', 25))
+        limit = int(request.args.get('limit', 10))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'lat and lon, or city and state, are required'}), 400
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < radius <= 1000 and 0 < limit <= 100):
+        return jsonify({'error': 'lat, lon, radius (up to 1000 km) or limit (up to 100) out of range'}), 400
+
+    found = Venue.near(latitude, longitude, radius, limit)
+    upcoming = dict(db.session.query(Show.venue_id, func.count(Show.id)).filter(
+        Show.venue_id.in_([venue.id for venue, _ in found]),
+        Show.start_time > datetime.now()).group_by(Show.venue_id)) if found else {}
+    return jsonify({
+        'latitude': latitude,
+        'longitude': longitude,
+        'radius_km': radius,
+        'count': len(found),
+        'venues': [
+            {
+                'id': venue.id,
+                'name': venue.name,
+                'city': venue.city,
+                'state': venue.state,
+                'distance_km': round(distance, 2),
+                'num_upcoming_shows': upcoming.get(venue.id, 0),
+            }
+            for venue, distance in found
+        ],
+    })
+
+
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
@@ -199,7 +359,7 @@ def show_venue(venue_id):
 
 @app.route('/venues/create', methods=['GET'])
 def create_venue_form():
-    form = VenueForm()
+    form = forms.VenueForm()
     return render_template('forms/new_venue.html', form=form)
 
 
@@ -216,16 +376,14 @@ def create_venue_submission():
 def delete_venue(venue_id):
     name = ""
     try:
-        venue = Venue.query.get(venue_id)
-        name = " " + venue.name
-        db.session.delete(venue)
-        db.session.commit()
+        name = " " + delete_with_shows(Venue, int(venue_id))
+        name_index.remove('venue', int(venue_id))
         # on successful db delete, flash success
         flash("Venue" + name + ' was successfully deleted!')
     except:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+        app.logger.exception('Could not delete venue %s', venue_id)
         # on unsuccessful db delete, flash an error instead.
         flash('An error occurred. Venue' + name + ' could not be deleted.')
     finally:
@@ -319,7 +477,7 @@ def edit_artist(artist_id):
     artist = Artist.query.get(artist_id)
 
     # populate artist form with current data
-    form = ArtistForm(
+    form = forms.ArtistForm(
         name=artist.name,
         city=artist.city,
         state=artist.state,
@@ -347,13 +505,14 @@ def edit_artist_submission(artist_id):
         artist.facebook_link = form['facebook_link']
         db.session.add(artist)
         db.session.commit()
+        name_index.add('artist', artist.id, artist.name)
         name = " " + str(artist.id)
         # on successful db update, flash success
         flash("Artist" + name + ' was successfully edited!')
     except:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+        app.logger.exception('Could not edit artist %s', artist_id)
         # on unsuccessful db update, flash an error instead.
         flash('An error occurred. Artist' + name + ' could not be edited.')
     finally:
@@ -362,12 +521,31 @@ def edit_artist_submission(artist_id):
     return redirect(url_for('show_artist', artist_id=artist_id))
 
 
+@app.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+    name = ""
+    try:
+        name = " " + delete_with_shows(Artist, artist_id)
+        name_index.remove('artist', artist_id)
+        # on successful db delete, flash success
+        flash("Artist" + name + ' was successfully deleted!')
+    except:
+        db.session.rollback()
+        app.logger.exception('Could not delete artist %s', artist_id)
+        # on unsuccessful db delete, flash an error instead.
+        flash('An error occurred. Artist' + name + ' could not be deleted.')
+    finally:
+        db.session.close()
+
+    return redirect(url_for('index'))
+
+
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
     venue = Venue.query.get(venue_id)
 
     # populate venue form with current data
-    form = VenueForm(
+    form = forms.VenueForm(
         name=venue.name,
         city=venue.city,
         state=venue.state,
@@ -390,19 +568,21 @@ def edit_venue_submission(venue_id):
         venue.name = form['name']
         venue.city = form['city']
         venue.state = form['state']
+        locate_venue(venue)
         venue.address = form['address']
         venue.phone = form['phone']
         venue.genres = str(form.getlist('genres'))  # store genres as a string of the list of genres
         venue.facebook_link = form['facebook_link']
         db.session.add(venue)
         db.session.commit()
+        name_index.add('venue', venue.id, venue.name)
         name = " " + str(venue.id)
         # on successful db update, flash success
         flash("Venue" + name + ' was successfully edited!')
     except:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+        app.logger.exception('Could not edit venue %s', venue_id)
         # on unsuccessful db update, flash an error instead.
         flash('An error occurred. Venue' + name + ' could not be edited.')
     finally:
@@ -416,7 +596,7 @@ def edit_venue_submission(venue_id):
 
 @app.route('/artists/create', methods=['GET'])
 def create_artist_form():
-    form = ArtistForm()
+    form = forms.ArtistForm()
     return render_template('forms/new_artist.html', form=form)
 
 
@@ -452,7 +632,7 @@ def shows():
 @app.route('/shows/create')
 def create_shows():
     # renders form. do not touch.
-    form = ShowForm()
+    form = forms.ShowForm()
     return render_template('forms/new_show.html', form=form)
 
 
@@ -460,7 +640,28 @@ def create_shows():
 def create_show_submission():
     # called to create new shows in the db, upon submitting new show listing form
     form = request.form
-    data = create_record(form, "Show")  # can create and insert any of Show, Artist, and Venue
+    try:
+        venue_id, artist_id = int(form['venue_id']), int(form['artist_id'])
+        start_time = dateutil_parser.parse(form['start_time'])
+        duration = timedelta(minutes=int(form.get('duration') or DEFAULT_SHOW_DURATION.seconds // 60))
+    except (KeyError, ValueError, OverflowError):
+        flash('An error occurred. Show could not be listed: check the ids and start time.')
+        return render_template('forms/new_show.html', form=forms.ShowForm(form)), 400
+    if not timedelta(0) < duration <= MAX_SHOW_DURATION:
+        flash('An error occurred. Shows last from 1 minute to %d hours.' % (MAX_SHOW_DURATION.total_seconds() // 3600))
+        return render_template('forms/new_show.html', form=forms.ShowForm(form)), 400
+
+    end_time = start_time + duration
+    conflict = Show.find_conflict(venue_id, artist_id, start_time, end_time)
+    if conflict is not None:
+        who = 'Venue %d' % venue_id if conflict.venue_id == venue_id else 'Artist %d' % artist_id
+        flash('%s is already booked from %s to %s (show %d).' % (
+            who, format_datetime(conflict.start_time), format_datetime(conflict.end_time), conflict.id))
+        return render_template('forms/new_show.html', form=forms.ShowForm(form)), 409
+
+    # can create and insert any of Show, Artist, and Venue
+    data = create_record({'venue_id': venue_id, 'artist_id': artist_id,
+                          'start_time': start_time, 'end_time': end_time}, "Show")
 
     return render_template('pages/home.html')
 
@@ -470,6 +671,20 @@ def create_show_submission():
 # ----------------------------------------------------------------------------#
 
 
+def delete_with_shows(model, record_id):
+    """Deletes a Venue or Artist and all its shows in one DELETE each, and returns its name.
+
+    Raises NoResultFound when there is no such record. The shows are deleted explicitly
+    rather than left to ON DELETE CASCADE, which SQLite only honours with foreign keys on.
+    """
+    name = db.session.query(model.name).filter(model.id == record_id).one()[0]
+    show_column = Show.venue_id if model is Venue else Show.artist_id
+    Show.query.filter(show_column == record_id).delete(synchronize_session=False)
+    model.query.filter(model.id == record_id).delete(synchronize_session=False)
+    db.session.commit()
+    return name
+
+
 def create_record(form, record_type):
     name = ""
     try:
@@ -477,6 +692,7 @@ def create_record(form, record_type):
             name = " " + form['name']
             if record_type == "Venue":
                 data = Venue(**form)
+                locate_venue(data)
             elif record_type == "Artist":
                 data = Artist(**form)
             data.genres = str(form.getlist('genres'))  # store genres as a string of the list of genres
@@ -486,12 +702,14 @@ def create_record(form, record_type):
         db.session.commit()
         if record_type == "Show":
             name = " " + str(data.id)
+        else:
+            name_index.add(record_type.lower(), data.id, data.name)
         # on successful db insert, flash success
         flash(record_type + name + ' was successfully listed!')
     except:
         db.session.rollback()
         error = True
-        print(sys.exc_info())
+        app.logger.exception('Could not list %s%s', record_type, name)
         # on unsuccessful db insert, flash an error instead.
         flash('An error occurred. ' + record_type + name + ' could not be listed.')
     finally:
@@ -510,13 +728,8 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    # JSON lines to a rotating error.log, written by a background thread
+    log_handler = setup_logging(app)
     app.logger.info('errors')
 
 # ----------------------------------------------------------------------------#
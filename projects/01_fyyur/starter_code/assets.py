@@ -0,0 +1,198 @@
+"""Fingerprinted, precompressed static assets.
+
+The build copies every file under static/ to static/dist/ with a content hash in its name
+(css/main.css -> css/main.3f9c2a1b0d4e.css), rewrites url(...) references between stylesheets
+and the files they load, and writes .gz and .br (brotli, when the Brotli package is
+installed) siblings next to anything that compresses. A manifest maps the original names to
+the hashed ones.
+
+With a manifest present, url_for('static', filename='css/main.css') returns the hashed file.
+Hashed files never change, so they are served with a one year immutable Cache-Control and
+repeat page loads fetch nothing from /static. Files missing from the manifest are served
+the usual way.
+
+BUILD
+    python assets.py            # after changing anything under static/
+"""
+import os
+import re
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+import argparse
+import mimetypes
+import posixpath
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(HERE, 'static')
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.otf', '.ttf', '.eot')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+#  ----------------------------------------------------------------
+#  Build
+#  ----------------------------------------------------------------
+
+def hashed_name(path, data):
+    """css/main.css -> css/main.<first 12 hex digits of its sha256>.css"""
+    root, ext = posixpath.splitext(path)
+    return '%s.%s%s' % (root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def rewrite_css(path, text, manifest):
+    """Points url(...) references in the stylesheet at path to their hashed files"""
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        target, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        resolved = posixpath.normpath(posixpath.join(posixpath.dirname(path), target))
+        if resolved not in manifest:
+            return match.group(0)
+        # the stylesheet keeps its directory, so the reference stays relative to it
+        relative = posixpath.relpath(manifest[resolved], posixpath.dirname(path) or '.')
+        return 'url(%s%s%s%s)' % (quote, relative, suffix, quote)
+    return CSS_URL.sub(replace, text)
+
+
+def compress(data):
+    """{suffix: compressed bytes} for the encodings that make data smaller"""
+    variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {suffix: body for suffix, body in variants.items() if len(body) < len(data)}
+
+
+def build(static_dir=STATIC_DIR, out_dir=None):
+    """Writes the hashed and compressed copies of static_dir to out_dir and returns the manifest"""
+    out_dir = out_dir or os.path.join(static_dir, DIST)
+    building = out_dir + '.tmp'
+    # the output, and what a crashed build left of it, are not sources
+    outputs = {os.path.abspath(out_dir), os.path.abspath(building)}
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) not in outputs)
+        for name in sorted(files):
+            sources.append(os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/'))
+
+    shutil.rmtree(building, ignore_errors=True)
+    manifest = {}
+    # stylesheets last: their hashes depend on the rewritten names of what they load
+    for path in sorted(sources, key=lambda path: path.endswith('.css')):
+        with open(os.path.join(static_dir, path), 'rb') as source:
+            data = source.read()
+        if path.endswith('.css'):
+            data = rewrite_css(path, data.decode('utf-8'), manifest).encode('utf-8')
+        manifest[path] = hashed_name(path, data)
+
+        target = os.path.join(building, manifest[path])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as out:
+            out.write(data)
+        if path.endswith(COMPRESSIBLE):
+            for suffix, body in compress(data).items():
+                with open(target + suffix, 'wb') as out:
+                    out.write(body)
+
+    with open(os.path.join(building, MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.rename(building, out_dir)
+    return manifest
+
+
+#  ----------------------------------------------------------------
+#  Serving
+#  ----------------------------------------------------------------
+
+class Assets:
+    """Flask extension sending url_for('static') to the built files and serving them.
+
+    CONFIG
+        ASSETS_DIR  where `python assets.py` wrote the files (default static/dist)
+    """
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.directory = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_DIR', os.path.join(app.static_folder, DIST))
+        app.extensions['assets'] = self
+        self.load(app.config['ASSETS_DIR'])
+        app.url_defaults(self._fingerprint)
+        self._send_static = app.view_functions['static']
+        app.view_functions['static'] = self.send_static
+
+    def load(self, directory):
+        """Reads the manifest in directory; without one, static files are not rewritten"""
+        try:
+            with open(os.path.join(directory, MANIFEST)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            manifest = {}
+        self.directory = directory
+        self.manifest = {path: DIST + '/' + hashed for path, hashed in manifest.items()}
+
+    def _fingerprint(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest.get(values['filename'], values['filename'])
+
+    def send_static(self, filename):
+        if not self.manifest or not filename.startswith(DIST + '/'):
+            return self._send_static(filename=filename)
+
+        path = filename[len(DIST) + 1:]
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(os.path.join(self.directory, path + suffix)):
+                response = send_from_directory(self.directory, path + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.directory, path, mimetype=mimetype)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--static', default=STATIC_DIR, help='directory to build (default static/)')
+    parser.add_argument('--out', help='output directory (default <static>/dist)')
+    args = parser.parse_args(argv)
+
+    out_dir = args.out or os.path.join(args.static, DIST)
+    manifest = build(args.static, out_dir)
+    totals = {'': 0, '.gz': 0, '.br': 0}
+    for hashed in manifest.values():
+        size = os.path.getsize(os.path.join(out_dir, hashed))
+        for suffix in totals:
+            variant = os.path.join(out_dir, hashed + suffix)
+            totals[suffix] += os.path.getsize(variant) if suffix and os.path.exists(variant) else size
+    summary = '%d files in %s: %.1fKB, %.1fKB gzip' % (len(manifest), out_dir, totals[''] / 1024, totals['.gz'] / 1024)
+    if brotli is None:
+        print(summary + '\nBrotli is not installed, so no .br files were written (pip install Brotli)')
+    else:
+        print(summary + ', %.1fKB brotli' % (totals['.br'] / 1024))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""In-memory prefix index for search-as-you-type.
+
+Every name is stored once per word it contains, as the lowercased text from that word to
+the end ('The Musical Hop' as 'the musical hop', 'musical hop' and 'hop'), in one sorted
+list. The names matching a typed prefix are then a bisect and a short walk along the list,
+so suggestions cost microseconds however many names there are.
+
+Writers build a new list and swap it in, so readers never take a lock. The index is loaded
+from the database on first use and kept current by the handlers that change names. After
+max_age seconds it is rebuilt in a background thread, one rebuild at a time, to pick up
+changes made by other worker processes; searches keep using the old list meanwhile, and
+changes made during the rebuild are applied again to the new list before it is swapped in.
+"""
+import re
+import time
+import logging
+import threading
+from bisect import bisect_left, insort
+
+WORD = re.compile(r'\w+')
+
+logger = logging.getLogger(__name__)
+
+
+def words(text):
+    return WORD.findall(text.casefold())
+
+
+class PrefixIndex:
+    """Names of (kind, id) records, searchable by the prefix of any of their words.
+
+    loader returns (kind, id, name) for every record; it is called on first use and after
+    max_age seconds (None: only on first use).
+    """
+
+    def __init__(self, loader, max_age=60):
+        self.loader = loader
+        self.max_age = max_age
+        # (sorted [(key, kind, id)], {(kind, id): name}), swapped as one
+        self._snapshot = None
+        self._loaded_at = None
+        self._pending = None  # changes made while a load runs, as functions of a snapshot
+        self._lock = threading.Lock()  # guards _snapshot and _pending
+        self._load_lock = threading.Lock()  # one load at a time
+        self._refresher = None
+
+    def _keys(self, name):
+        tokens = words(name)
+        return [' '.join(tokens[start:]) for start in range(len(tokens))]
+
+    def load(self):
+        """Rebuilds the index from loader"""
+        with self._load_lock:
+            self._load()
+
+    def _load(self):
+        """Rebuilds the index; call with _load_lock held"""
+        with self._lock:
+            self._pending = []
+        try:
+            names = {(kind, record_id): name for kind, record_id, name in self.loader()}
+            entries = sorted((key, kind, record_id) for (kind, record_id), name in names.items()
+                             for key in self._keys(name))
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            # the loader may or may not have seen these changes; both are safe to apply again
+            snapshot = (entries, names)
+            for change in self._pending:
+                snapshot = change(snapshot)
+            self._snapshot, self._loaded_at, self._pending = snapshot, time.monotonic(), None
+
+    def _refresh(self):
+        try:
+            self._load()
+        except Exception:
+            # keep serving the old names, and try again after max_age
+            self._loaded_at = time.monotonic()
+            logger.exception('Could not reload the autocomplete index')
+        finally:
+            self._load_lock.release()
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._load_lock:
+                if self._snapshot is None:
+                    self._load()
+            return self._snapshot
+        stale = self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age
+        if stale and self._load_lock.acquire(blocking=False):
+            self._refresher = threading.Thread(target=self._refresh, name='autocomplete-reload', daemon=True)
+            self._refresher.start()
+        return snapshot
+
+    def search(self, prefix, limit=10, kind=None):
+        """[(kind, id, name)] of up to limit records (of one kind, if given) with a word
+        starting with prefix"""
+        query = ' '.join(words(prefix))
+        if not query:
+            return []
+        entries, names = self._current()
+        found, seen = [], set()
+        for index in range(bisect_left(entries, (query,)), len(entries)):
+            key, record_kind, record_id = entries[index]
+            if not key.startswith(query):
+                break
+            if (record_kind, record_id) not in seen and kind in (None, record_kind):
+                seen.add((record_kind, record_id))
+                found.append((record_kind, record_id, names[(record_kind, record_id)]))
+                if len(found) == limit:
+                    break
+        return found
+
+    #  ----------------------------------------------------------------
+    #  Incremental updates
+    #  ----------------------------------------------------------------
+
+    def add(self, kind, record_id, name):
+        """Adds a record, or renames it"""
+        self._change(lambda snapshot: self._with(snapshot, kind, record_id, name))
+
+    def remove(self, kind, record_id):
+        self._change(lambda snapshot: self._without(snapshot, kind, record_id))
+
+    def _change(self, change):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(change)
+            if self._snapshot is not None:
+                self._snapshot = change(self._snapshot)
+            # else not loaded yet, and the first search loads it from the database
+
+    def _with(self, snapshot, kind, record_id, name):
+        """Copies of the snapshot's entries and names, with the record under name"""
+        entries, names = self._without(snapshot, kind, record_id, copy=True)
+        for key in self._keys(name):
+            insort(entries, (key, kind, record_id))
+        names[(kind, record_id)] = name
+        return entries, names
+
+    def _without(self, snapshot, kind, record_id, copy=False):
+        """Copies of the snapshot's entries and names, less the record"""
+        if (kind, record_id) not in snapshot[1] and not copy:
+            return snapshot
+        entries, names = list(snapshot[0]), dict(snapshot[1])
+        old_name = names.pop((kind, record_id), None)
+        if old_name is not None:
+            for key in self._keys(old_name):
+                index = bisect_left(entries, (key, kind, record_id))
+                if index < len(entries) and entries[index] == (key, kind, record_id):
+                    del entries[index]
+        return entries, names
@@ -0,0 +1,121 @@
+"""Measures what rendering Fyyur's templates costs, at startup and per request.
+
+Time to first render is measured in fresh interpreters, once without precompiling and with
+an empty bytecode cache (what every new worker used to pay), then precompiling into an empty
+cache, then precompiling from the warm cache. Render cost per request is measured in this
+process for the form pages, with the pre-rendered <select> widgets and with WTForms' own.
+
+EXAMPLE
+    python bench_templates.py --rounds 500
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+import time
+import warnings
+from contextlib import contextmanager, nullcontext
+from types import SimpleNamespace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FIRST_RENDER = '''
+import json, time
+start = time.perf_counter()
+import app
+started = time.perf_counter()
+import forms
+with app.app.test_request_context():
+    form = forms.VenueForm()
+    render_start = time.perf_counter()
+    app.render_template('forms/new_venue.html', form=form)
+print(json.dumps({'startup': started - start, 'first_render': time.perf_counter() - render_start}))
+'''
+
+
+def first_render(cache_dir, precompile, python=sys.executable):
+    """{'startup': seconds, 'first_render': seconds} of a fresh interpreter"""
+    env = dict(os.environ, TEMPLATE_CACHE_DIR=cache_dir, PRECOMPILE_TEMPLATES=str(precompile).lower())
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    result = subprocess.run([python, '-c', FIRST_RENDER], cwd=HERE, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        raise RuntimeError('rendering failed:\n%s' % result.stderr[-2000:])
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+@contextmanager
+def plain_selects(forms):
+    """Renders the state and genres fields with WTForms' Select widget inside the block"""
+    from wtforms.widgets import Select
+    fields = [(form_class, name) for form_class in (forms.VenueForm, forms.ArtistForm)
+              for name in ('state', 'genres')]
+    saved = [getattr(form_class, name).kwargs['widget'] for form_class, name in fields]
+    for form_class, name in fields:
+        getattr(form_class, name).kwargs['widget'] = Select(multiple=name == 'genres')
+    try:
+        yield
+    finally:
+        for (form_class, name), widget in zip(fields, saved):
+            getattr(form_class, name).kwargs['widget'] = widget
+
+
+def render_cost(rounds):
+    """{(page, widgets): microseconds per render}"""
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    sys.path.insert(0, HERE)
+    import app
+    import forms
+
+    # forms.py still subclasses flask_wtf.Form, which warns on every instance
+    warnings.filterwarnings('ignore', message='"flask_wtf.Form"')
+    record = SimpleNamespace(id=1, name='The Musical Hop')
+    pages = {
+        'forms/new_venue.html': lambda: {'form': forms.VenueForm()},
+        'forms/new_artist.html': lambda: {'form': forms.ArtistForm()},
+        'forms/edit_artist.html': lambda: {
+            'form': forms.ArtistForm(state='CA', genres=['Jazz', 'Soul']), 'artist': record},
+    }
+    results = {}
+    with app.app.test_request_context():
+        for widgets in ('prerendered', 'wtforms'):
+            with plain_selects(forms) if widgets == 'wtforms' else nullcontext():
+                for page, context in pages.items():
+                    app.render_template(page, **context())
+                    start = time.perf_counter()
+                    for _ in range(rounds):
+                        app.render_template(page, **context())
+                    results[(page, widgets)] = (time.perf_counter() - start) / rounds * 1e6
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=200, help='renders per page (default 200)')
+    args = parser.parse_args(argv)
+
+    cache_dir = tempfile.mkdtemp(prefix='fyyur-jinja-')
+    try:
+        runs = [
+            ('lazy compile, no cache', first_render(tempfile.mkdtemp(dir=cache_dir), False)),
+            ('precompile, cold cache', first_render(cache_dir, True)),
+            ('precompile, warm cache', first_render(cache_dir, True)),
+        ]
+    finally:
+        shutil.rmtree(cache_dir)
+    print('%-26s %12s %16s' % ('startup', 'import ms', 'first render ms'))
+    for name, timing in runs:
+        print('%-26s %12.1f %16.2f' % (name, timing['startup'] * 1000, timing['first_render'] * 1000))
+
+    print('\n%-26s %12s %16s' % ('per request', 'prerendered us', 'wtforms us'))
+    costs = render_cost(args.rounds)
+    for page in sorted({page for page, _ in costs}):
+        print('%-26s %12.1f %16.1f' % (page, costs[(page, 'prerendered')], costs[(page, 'wtforms')]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
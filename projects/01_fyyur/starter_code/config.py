@@ -1,8 +1,7 @@
 import os
-# Import secret password for postgres account from a non-version control file.
-from db_password import db_password
 
-SECRET_KEY = os.urandom(32)
+# Signs the session cookie; every worker must share it to read the cookies of the others.
+SECRET_KEY = os.environ.get('SECRET_KEY')
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -12,5 +11,23 @@ DEBUG = True
 # Turn off the warning for tracking modifications.
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# City coordinates for venue locations, see geo.py.
+GAZETTEER_FILE = os.environ.get('GAZETTEER_FILE', os.path.join(basedir, 'data', 'us_cities.csv'))
+
 # Connect to the database.
-SQLALCHEMY_DATABASE_URI = 'postgresql://zoe:' + db_password + '@localhost:5432/fyyur'
+# DATABASE_URL wins; otherwise the postgres password comes from a non-version control file.
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+if not SQLALCHEMY_DATABASE_URI:
+    from db_password import db_password
+    SQLALCHEMY_DATABASE_URI = 'postgresql://zoe:' + db_password + '@localhost:5432/fyyur'
+
+# Read replicas of that database, space separated; see replicas.py.
+SQLALCHEMY_BINDS = {'replica_%d' % number: uri for number, uri
+                    in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(), 1)}
+
+if not SECRET_KEY:
+    if SQLALCHEMY_BINDS:
+        # read-your-writes stickiness lives in the session cookie, see replicas.py
+        raise RuntimeError('DATABASE_REPLICA_URLS needs SECRET_KEY set, the same for every worker')
+    # only the process that made it accepts its cookies
+    SECRET_KEY = os.urandom(32)
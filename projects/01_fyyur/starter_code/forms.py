@@ -1,7 +1,49 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, NumberRange
+from wtforms.widgets import Select, html_params
+from markupsafe import Markup
+
+
+class PrerenderedSelect(Select):
+    """Select widget rendering each <option> once per process instead of on every render.
+
+    The option list of a form with nothing selected is kept whole, so a new venue or artist
+    form copies one string per select.
+    """
+
+    def __init__(self, multiple=False):
+        super().__init__(multiple=multiple)
+        self._options = {}
+        self._blank_lists = {}
+
+    def __call__(self, field, **kwargs):
+        kwargs.setdefault('id', field.id)
+        if self.multiple:
+            kwargs['multiple'] = True
+        if 'required' not in kwargs and 'required' in getattr(field, 'flags', []):
+            kwargs['required'] = True
+        choices = list(field.iter_choices())
+        if any(selected for _, _, selected in choices):
+            options = ''.join(self._option(*choice) for choice in choices)
+        else:
+            key = tuple(choices)
+            options = self._blank_lists.get(key)
+            if options is None:
+                options = self._blank_lists[key] = ''.join(self._option(*choice) for choice in choices)
+        return Markup('<select %s>%s</select>' % (html_params(name=field.name, **kwargs), options))
+
+    def _option(self, value, label, selected):
+        key = (value, label, selected)
+        option = self._options.get(key)
+        if option is None:
+            option = self._options[key] = self.render_option(value, label, selected)
+        return option
+
+
+STATE_SELECT = PrerenderedSelect()
+GENRES_SELECT = PrerenderedSelect(multiple=True)
 
 
 class ShowForm(Form):
@@ -16,6 +58,11 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default=datetime.today()
     )
+    duration = IntegerField(
+        'duration',
+        validators=[NumberRange(min=1, max=24 * 60)],
+        default=120
+    )
 
 
 class VenueForm(Form):
@@ -26,7 +73,7 @@ class VenueForm(Form):
         'city', validators=[DataRequired()]
     )
     state = SelectField(
-        'state', validators=[DataRequired()],
+        'state', validators=[DataRequired()], widget=STATE_SELECT,
         choices=[
             ('AL', 'AL'),
             ('AK', 'AK'),
@@ -92,7 +139,7 @@ class VenueForm(Form):
     )
     genres = SelectMultipleField(
         # TODO implement enum restriction
-        'genres', validators=[DataRequired()],
+        'genres', validators=[DataRequired()], widget=GENRES_SELECT,
         choices=[
             ('Alternative', 'Alternative'),
             ('Blues', 'Blues'),
@@ -128,7 +175,7 @@ class ArtistForm(Form):
         'city', validators=[DataRequired()]
     )
     state = SelectField(
-        'state', validators=[DataRequired()],
+        'state', validators=[DataRequired()], widget=STATE_SELECT,
         choices=[
             ('AL', 'AL'),
             ('AK', 'AK'),
@@ -192,7 +239,7 @@ class ArtistForm(Form):
     )
     genres = SelectMultipleField(
         # TODO implement enum restriction
-        'genres', validators=[DataRequired()],
+        'genres', validators=[DataRequired()], widget=GENRES_SELECT,
         choices=[
             ('Alternative', 'Alternative'),
             ('Blues', 'Blues'),
@@ -0,0 +1,143 @@
+"""Geohashes, distances and the city gazetteer behind the "venues near me" search.
+
+A geohash names a lat/lon cell; every extra character splits the cell into 32 and cells
+inside a cell share its hash as a prefix. Venues store the hash of their location in an
+indexed column, so the venues in a cell are one range scan on that index. A search around
+a point reads the cell of the point and its 8 neighbours, at the finest precision whose
+cells are still at least as big as the radius, and only computes distances for the
+venues in those 9 cells.
+
+GAZETTEER
+    CSV with city, state, latitude and longitude columns, or a US Census Gazetteer places
+    file (tab separated, USPS / NAME / INTPTLAT / INTPTLONG columns). data/us_cities.csv
+    has the larger US cities; set GAZETTEER_FILE to use another.
+"""
+import os
+import csv
+import math
+from functools import lru_cache
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+MAX_PRECISION = 12
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'us_cities.csv')
+# Census place names end in the kind of place they are
+PLACE_SUFFIXES = (' city', ' town', ' village', ' borough', ' CDP', ' municipality')
+
+
+def encode(latitude, longitude, precision=MAX_PRECISION):
+    """The geohash of the cell of the given precision holding the point"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(latitude degrees, longitude degrees) spanned by a cell"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great circle (haversine) distance"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def search_precision(latitude, radius_km):
+    """The finest precision whose cells near this latitude are at least radius_km on each side"""
+    # cells narrow towards the poles, so size them at the point of the circle nearest a pole
+    latitude = min(90.0, abs(latitude) + radius_km / KM_PER_DEGREE)
+    for precision in range(MAX_PRECISION, 0, -1):
+        lat_degrees, lon_degrees = cell_size(precision)
+        width_km = lon_degrees * KM_PER_DEGREE * math.cos(math.radians(latitude))
+        if min(lat_degrees * KM_PER_DEGREE, width_km) >= radius_km:
+            return precision
+    return 0
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Geohash prefixes of the cells that cover every point within radius_km of the point.
+
+    An empty prefix means the whole world: the radius is larger than a precision 1 cell.
+    """
+    precision = search_precision(latitude, radius_km)
+    if precision == 0:
+        return ['']
+    lat_degrees, lon_degrees = cell_size(precision)
+    cells = set()
+    for lat_step in (-1, 0, 1):
+        lat = min(max(latitude + lat_step * lat_degrees, -90.0), 90.0)
+        for lon_step in (-1, 0, 1):
+            lon = (longitude + lon_step * lon_degrees + 180.0) % 360.0 - 180.0
+            cells.add(encode(lat, lon, precision))
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    """(low, high) bounds of the hashes starting with prefix, for an index range scan.
+
+    high is the next prefix of the same or shorter length, or None when nothing follows
+    ('', 'zz'). Both bounds only hold base32 characters, so the range is the same under any
+    collation that orders digits and lowercase letters as ASCII does; a sentinel such as
+    prefix + '{' only sorts after 'z' in the C collation.
+    """
+    stem = prefix.rstrip(BASE32[-1])
+    if not stem:
+        return prefix, None
+    return prefix, stem[:-1] + BASE32[BASE32.index(stem[-1]) + 1]
+
+
+#  ----------------------------------------------------------------
+#  Gazetteer
+#  ----------------------------------------------------------------
+
+def place_key(city, state):
+    return ' '.join(city.lower().replace('.', '').split()), state.strip().upper()
+
+
+@lru_cache(maxsize=4)
+def load_gazetteer(path=DEFAULT_GAZETTEER):
+    """{(city, state): (latitude, longitude)} read from a gazetteer file"""
+    places = {}
+    with open(path, newline='', encoding='utf-8') as gazetteer_file:
+        dialect = 'excel-tab' if '\t' in gazetteer_file.readline() else 'excel'
+        gazetteer_file.seek(0)
+        for row in csv.DictReader(gazetteer_file, dialect=dialect):
+            row = {name.strip().lower(): value.strip() for name, value in row.items() if name}
+            city = row.get('city') or row.get('name', '')
+            for suffix in PLACE_SUFFIXES:
+                if city.endswith(suffix):
+                    city = city[:-len(suffix)]
+                    break
+            state = row.get('state') or row.get('usps', '')
+            try:
+                location = (float(row.get('latitude') or row['intptlat']),
+                            float(row.get('longitude') or row['intptlong']))
+            except (KeyError, ValueError):
+                continue
+            # the first entry wins when a state has two places of one name
+            places.setdefault(place_key(city, state), location)
+    return places
+
+
+def locate(city, state, path=DEFAULT_GAZETTEER):
+    """(latitude, longitude) of the city in the gazetteer, or None"""
+    return load_gazetteer(path).get(place_key(city, state))
@@ -0,0 +1,41 @@
+import importlib
+import threading
+
+
+class LazyObject(object):
+    """Stands in for the result of loader, which runs on first attribute access or call.
+
+    Lets app.py name heavy dependencies at module level while only the requests that use
+    them pay for the import.
+    """
+
+    def __init__(self, loader):
+        object.__setattr__(self, '_loader', loader)
+        object.__setattr__(self, '_target', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _resolve(self):
+        target = self._target
+        if target is None:
+            with self._lock:
+                target = self._target
+                if target is None:
+                    target = self._loader()
+                    object.__setattr__(self, '_target', target)
+        return target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        if self._target is None:
+            return '<lazy, not loaded yet>'
+        return repr(self._target)
+
+
+def lazy_import(name):
+    """A module that is imported the first time one of its attributes is used"""
+    return LazyObject(lambda: importlib.import_module(name))
@@ -0,0 +1,119 @@
+"""Logging that never does I/O on the request thread.
+
+Request threads only put records on an in-memory queue; a listener thread formats them as
+JSON lines and writes them to a size-rotated file. When the queue is full, records are
+dropped and counted rather than making the request wait.
+
+One process per log file: RotatingFileHandler does not coordinate rotation between
+processes, so give each worker its own LOG_FILE when running several.
+"""
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import has_request_context, request
+from flask.logging import default_handler
+
+# fields every LogRecord has, so anything else on a record came from extra={...}
+RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'request'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, source, request and extras"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'source': '%s:%d' % (record.pathname, record.lineno),
+        }
+        if getattr(record, 'request', None):
+            entry['request'] = record.request
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        for key, value in vars(record).items():
+            if key not in RECORD_FIELDS:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queues records without blocking, starting the listener in each (forked) process"""
+
+    def __init__(self, log_queue, handler):
+        super().__init__(log_queue)
+        self.handler = handler
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # resolve everything that depends on the request thread here; the listener only writes
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if has_request_context():
+            record.request = {'method': request.method, 'path': request.path, 'endpoint': request.endpoint}
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._listener = QueueListener(self.queue, self.handler, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        """Writes out everything queued so far and stops the listener thread"""
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+def setup_logging(app, path=None, max_bytes=None, backup_count=None, queue_size=10000, level=logging.INFO):
+    """Sends app.logger through a queue to a rotating JSON-lines file.
+
+    Defaults come from LOG_FILE (error.log), LOG_MAX_BYTES (10MB) and LOG_BACKUP_COUNT (5) in
+    app.config. Flask's stderr handler is taken off app.logger, since it would write on the
+    request thread. Returns the queue handler, whose stop() flushes the file.
+    """
+    file_handler = RotatingFileHandler(
+        path or app.config.get('LOG_FILE', 'error.log'),
+        maxBytes=max_bytes or app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+        backupCount=backup_count if backup_count is not None else app.config.get('LOG_BACKUP_COUNT', 5),
+        delay=True)
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.setLevel(level)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size), file_handler)
+    queue_handler.setLevel(level)
+    app.logger.setLevel(level)
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(queue_handler)
+    queue_handler.start()
+    atexit.register(queue_handler.stop)
+    return queue_handler
@@ -0,0 +1,32 @@
+# ----------------------------------------------------------------------------#
+# Migration and data tooling, kept out of the web process.
+#
+#   $ export FLASK_APP=manage.py
+#   $ flask db migrate
+#   $ flask db upgrade
+#   $ flask geocode-venues
+# ----------------------------------------------------------------------------#
+
+import click
+from flask_migrate import Migrate
+
+from app import app, db, locate_venue, Venue
+
+migrate = Migrate(app, db)
+
+
+@app.cli.command('geocode-venues')
+@click.option('--all', 'everything', is_flag=True, help='Also relocate venues that already have coordinates.')
+def geocode_venues(everything):
+    """Sets venue coordinates from the gazetteer (GAZETTEER_FILE)."""
+    query = Venue.query if everything else Venue.query.filter(Venue.geohash.is_(None))
+    located = missing = 0
+    for venue in query:
+        locate_venue(venue)
+        if venue.geohash is None:
+            missing += 1
+            click.echo('not in the gazetteer: %s (%s, %s)' % (venue.name, venue.city, venue.state))
+        else:
+            located += 1
+    db.session.commit()
+    click.echo('located %d venues, %d not found' % (located, missing))
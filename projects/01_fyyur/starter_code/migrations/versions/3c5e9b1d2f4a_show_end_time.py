@@ -0,0 +1,53 @@
+"""show end time and booking overlap constraints
+
+Revision ID: 3c5e9b1d2f4a
+Revises: 7a888c71fe06
+Create Date: 2020-05-02 18:12:40.301129
+
+Existing shows get the default two hour duration. On postgres, two shows of the same venue
+or the same artist may no longer overlap; the upgrade fails if some already do and names
+the first conflicting pair in the error so it can be fixed first.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e9b1d2f4a'
+down_revision = '7a888c71fe06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    if postgres:
+        op.execute('UPDATE "Show" SET end_time = start_time + interval \'2 hours\'')
+    else:
+        op.execute('UPDATE "Show" SET end_time = datetime(start_time, \'+2 hours\')')
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_check_constraint('ck_show_end_after_start', 'end_time > start_time')
+    op.create_index('ix_show_venue_start', 'Show', ['venue_id', 'start_time'])
+    op.create_index('ix_show_artist_start', 'Show', ['artist_id', 'start_time'])
+
+    if postgres:
+        # btree_gist lets one gist index compare the ids with = and the time ranges with &&
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for column in ('venue_id', 'artist_id'):
+            op.execute(
+                'ALTER TABLE "Show" ADD CONSTRAINT ex_show_{0}_overlap '
+                'EXCLUDE USING gist ({0} WITH =, tsrange(start_time, end_time) WITH &&)'.format(column))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE "Show" DROP CONSTRAINT ex_show_artist_id_overlap')
+        op.execute('ALTER TABLE "Show" DROP CONSTRAINT ex_show_venue_id_overlap')
+    op.drop_index('ix_show_artist_start', table_name='Show')
+    op.drop_index('ix_show_venue_start', table_name='Show')
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_constraint('ck_show_end_after_start', type_='check')
+        batch_op.drop_column('end_time')
@@ -0,0 +1,32 @@
+"""venue location and geohash index
+
+Revision ID: 8d2f6a4c1e7b
+Revises: 3c5e9b1d2f4a
+Create Date: 2020-05-09 11:40:02.518344
+
+Run `flask geocode-venues` afterwards to fill in the locations of existing venues.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2f6a4c1e7b'
+down_revision = '3c5e9b1d2f4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index(op.f('ix_Venue_geohash'), 'Venue', ['geohash'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_Venue_geohash'), table_name='Venue')
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
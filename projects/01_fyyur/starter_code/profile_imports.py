@@ -0,0 +1,64 @@
+"""Reports what importing the web app costs, per top-level package.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter and sums the
+self time of every module under each top-level package.
+
+EXAMPLE
+    python profile_imports.py --top 15
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+# imported by app.py only when a request needs them, so they should not show up here
+LAZY_MODULES = ('babel', 'dateutil', 'flask_migrate', 'alembic', 'forms', 'wtforms', 'flask_wtf')
+
+
+def profile(module='app', python=sys.executable):
+    """{top-level package: (self microseconds, modules)} for importing module"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([python, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=here, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                            universal_newlines=True)
+    if result.returncode:
+        raise RuntimeError('importing %s failed:\n%s' % (module, result.stderr[-2000:]))
+
+    packages = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        top = match.group(4).split('.')[0]
+        self_us, count = packages.get(top, (0, 0))
+        packages[top] = (self_us + int(match.group(1)), count + 1)
+    return packages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='app', help='module to import (default app)')
+    parser.add_argument('--top', type=int, default=20, help='packages to list (default 20)')
+    args = parser.parse_args(argv)
+
+    packages = profile(args.module)
+    total = sum(self_us for self_us, _ in packages.values())
+    print('importing %s: %.1fms in %d modules' % (
+        args.module, total / 1000, sum(count for _, count in packages.values())))
+    print('%-24s %10s %8s' % ('package', 'self ms', 'modules'))
+    ranked = sorted(packages.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (self_us, count) in ranked[:args.top]:
+        print('%-24s %10.1f %8d' % (name, self_us / 1000, count))
+
+    eager = [name for name in LAZY_MODULES if name in packages]
+    if eager:
+        print('\nloaded at startup although app.py defers them: ' + ', '.join(eager))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""N+1 query detection for development and staging.
+
+Every SQL statement a request runs is reduced to a fingerprint (its text with literals and
+placeholders folded together). A fingerprint seen threshold times or more in one request is
+almost always a loop issuing one query per row, e.g. reading show.venue for every show. Such
+requests are reported with the view and the line of app code that issued the statement,
+through app.logger (so error.log when not in debug) or as JSON lines to a file.
+
+CONFIG
+    QUERY_AUDIT            on or off, defaults to app.debug; env QUERY_AUDIT=true|false
+    QUERY_AUDIT_THRESHOLD  repeats of one fingerprint that get reported (default 5)
+    QUERY_AUDIT_REPORT     'log', or a path to append JSON reports to
+
+TESTS
+    with query_audit.budget(max_queries=2, max_repeats=1):
+        client.get('/artists')
+"""
+import os
+import re
+import json
+import threading
+import traceback
+from collections import deque
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+    """The statement with literals, placeholders and IN lists normalized away"""
+    statement = STRING_LITERAL.sub('?', statement)
+    statement = NUMBER_LITERAL.sub('?', statement)
+    statement = PLACEHOLDER.sub('?', statement)
+    statement = PLACEHOLDER_LIST.sub('(?+)', statement)
+    return WHITESPACE.sub(' ', statement).strip()
+
+
+def call_site():
+    """'file.py:line in function' of the innermost app frame issuing the current statement"""
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        # skips library frames, and code generated at runtime ('<string>')
+        if not frame.filename.endswith('.py'):
+            continue
+        filename = os.path.abspath(frame.filename)
+        if (filename.startswith(APP_DIR) and filename != os.path.abspath(__file__)
+                and 'site-packages' not in filename):
+            return '%s:%d in %s' % (os.path.relpath(filename, APP_DIR), frame.lineno, frame.name)
+    return None
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryAudit:
+    """Flask extension fingerprinting each request's SQL and reporting N+1 patterns"""
+
+    def __init__(self, app=None, max_reports=100):
+        self.reports = deque(maxlen=max_reports)
+        self._lock = threading.Lock()
+        self._watchers = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        enabled = os.environ.get('QUERY_AUDIT')
+        app.config.setdefault('QUERY_AUDIT', app.debug if enabled is None else enabled == 'true')
+        app.config.setdefault('QUERY_AUDIT_THRESHOLD', 5)
+        app.config.setdefault('QUERY_AUDIT_REPORT', os.environ.get('QUERY_AUDIT_REPORT', 'log'))
+        if not app.config['QUERY_AUDIT']:
+            return
+
+        app.extensions['query_audit'] = self
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+        listen_to_engines()
+
+    #  ----------------------------------------------------------------
+    #  Request hooks
+    #  ----------------------------------------------------------------
+
+    def _start_request(self):
+        g.query_audit = {}
+
+    def _finish_request(self, error=None):
+        statements = g.pop('query_audit', None)
+        if statements is None:
+            return
+        threshold = current_app.config['QUERY_AUDIT_THRESHOLD']
+        report = {
+            'view': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'total_queries': sum(entry['count'] for entry in statements.values()),
+            'repeated': sorted(
+                ({'statement': statement, 'count': entry['count'], 'call_site': entry['call_site']}
+                 for statement, entry in statements.items() if entry['count'] >= threshold),
+                key=lambda repeat: -repeat['count']),
+            'max_repeats': max((entry['count'] for entry in statements.values()), default=0),
+        }
+        with self._lock:
+            watchers = list(self._watchers)
+        for watcher in watchers:
+            watcher.append(report)
+        if report['repeated']:
+            self.reports.append(report)
+            self._write(report)
+
+    def _write(self, report):
+        destination = current_app.config['QUERY_AUDIT_REPORT']
+        if destination == 'log':
+            current_app.logger.warning(
+                'N+1 queries in %s %s (view %s, %d queries): %s', report['method'], report['path'],
+                report['view'], report['total_queries'],
+                '; '.join('%dx at %s: %s' % (repeat['count'], repeat['call_site'], repeat['statement'])
+                          for repeat in report['repeated']))
+        else:
+            with open(destination, 'a') as report_file:
+                report_file.write(json.dumps(report) + '\n')
+
+    def record(self, statement):
+        key = fingerprint(statement)
+        entry = g.query_audit.get(key)
+        if entry is None:
+            g.query_audit[key] = {'count': 1, 'call_site': None}
+        else:
+            entry['count'] += 1
+            if entry['call_site'] is None:
+                # stacks are only walked for statements that repeat
+                entry['call_site'] = call_site()
+
+    #  ----------------------------------------------------------------
+    #  Tests
+    #  ----------------------------------------------------------------
+
+    @contextmanager
+    def budget(self, max_queries=None, max_repeats=None):
+        """Raises QueryBudgetExceeded when a request in the block runs more than max_queries
+        statements, or one fingerprint more than max_repeats times"""
+        seen = []
+        with self._lock:
+            self._watchers.append(seen)
+        try:
+            yield seen
+        finally:
+            with self._lock:
+                self._watchers.remove(seen)
+
+        for report in seen:
+            over_total = max_queries is not None and report['total_queries'] > max_queries
+            over_repeats = max_repeats is not None and report['max_repeats'] > max_repeats
+            if over_total or over_repeats:
+                raise QueryBudgetExceeded('%s %s ran %d queries (budget %s), up to %d of one kind (budget %s): %s' % (
+                    report['method'], report['path'], report['total_queries'], max_queries,
+                    report['max_repeats'], max_repeats,
+                    '; '.join('%dx at %s' % (repeat['count'], repeat['call_site'])
+                              for repeat in report['repeated']) or 'no repeats over the threshold'))
+
+
+#  ----------------------------------------------------------------
+#  SQLAlchemy hooks
+#  ----------------------------------------------------------------
+
+_listen_lock = threading.Lock()
+_listening = False
+
+
+def listen_to_engines():
+    global _listening
+    with _listen_lock:
+        if not _listening:
+            event.listen(Engine, 'before_cursor_execute', _before_execute)
+            _listening = True
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_audit' in g:
+        audit = current_app.extensions.get('query_audit')
+        if audit is not None:
+            audit.record(statement)
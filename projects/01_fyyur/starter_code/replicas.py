@@ -0,0 +1,123 @@
+"""Read replicas for Fyyur's read-only requests.
+
+Every bind in SQLALCHEMY_BINDS whose key starts with 'replica' is a replica of the primary
+database (SQLALCHEMY_DATABASE_URI). GET and HEAD requests read from one of them, picked at
+random for the request; everything else, and everything outside a request, uses the primary.
+A request also switches to the primary for good as soon as it writes, so the rest of its
+transaction sees what it wrote.
+
+Replicas lag behind the primary, so a browser that just wrote reads from the primary for
+REPLICA_STICKY_SECONDS afterwards: after editing a venue, the redirect to its page shows the
+edit. The deadline is kept in the Flask session cookie, so it holds across workers as long
+as they share SECRET_KEY; config.py refuses to start with replicas and no SECRET_KEY.
+
+A replica that cannot be connected to is skipped for REPLICA_RETRY_SECONDS; when none is
+left, reads go to the primary.
+
+CONFIG
+    SQLALCHEMY_BINDS         {'replica_1': uri, ...}; config.py builds it from the space
+                             separated URIs in env DATABASE_REPLICA_URLS
+    REPLICA_STICKY_SECONDS   primary reads after a write (default 10)
+    REPLICA_RETRY_SECONDS    how long an unreachable replica is skipped (default 30)
+"""
+import os
+import time
+import random
+import threading
+
+from flask import current_app, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import exc, orm
+from sqlalchemy.sql.expression import SelectBase
+
+READ_METHODS = ('GET', 'HEAD')
+SESSION_KEY = 'primary_until'
+
+
+def replica_keys(app):
+    return sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or () if key.startswith('replica'))
+
+
+def is_read(clause):
+    """Whether the statement only reads; statements it cannot tell about count as writes"""
+    if clause is None:
+        return True  # a connection for a query of a mapper
+    return isinstance(clause, SelectBase) and getattr(clause, '_for_update_arg', None) is None
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of read-only requests to a replica"""
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.db = db
+        self._replicas = db.replica_engines(self.app)
+        self._wrote = False
+        self._read_bind = None  # picked on the first read
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = super().get_bind(mapper, clause)
+        if not self._replicas or not has_request_context() or primary is not self.bind:
+            return primary  # no replicas, outside a request, or a model with its own __bind_key__
+        if self._wrote or self._flushing or not is_read(clause):
+            if not self._wrote:
+                self._wrote = True
+                session[SESSION_KEY] = time.time() + self.app.config['REPLICA_STICKY_SECONDS']
+            return primary
+        if request.method not in READ_METHODS or session.get(SESSION_KEY, 0) > time.time():
+            return primary
+        if self._read_bind is None:
+            self._read_bind = self.db.connect_replica(self, self._replicas) or primary
+        return self._read_bind
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose sessions read from the replica binds when they can"""
+
+    def __init__(self, *args, **kwargs):
+        self._unavailable = {}  # {bind key: time.monotonic() to retry at}
+        self._lock = threading.Lock()
+        self._engines = (None, {})  # (the SQLALCHEMY_BINDS they were made for, {replica key: engine})
+        super().__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('REPLICA_STICKY_SECONDS', float(os.environ.get('REPLICA_STICKY_SECONDS', 10)))
+        app.config.setdefault('REPLICA_RETRY_SECONDS', float(os.environ.get('REPLICA_RETRY_SECONDS', 30)))
+        super().init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def replica_engines(self, app):
+        """{bind key: engine} of the replicas, made once per SQLALCHEMY_BINDS"""
+        binds, engines = self._engines
+        if binds is not app.config.get('SQLALCHEMY_BINDS'):
+            binds = app.config.get('SQLALCHEMY_BINDS')
+            engines = {key: self.get_engine(app, bind=key) for key in replica_keys(app)}
+            self._engines = (binds, engines)
+        return engines
+
+    def available_replicas(self, app):
+        now = time.monotonic()
+        with self._lock:
+            return [key for key in replica_keys(app) if self._unavailable.get(key, 0) <= now]
+
+    def connect_replica(self, db_session, engines):
+        """The engine of a replica that db_session is now connected to, or None"""
+        app = db_session.app
+        keys = [key for key in self.available_replicas(app) if key in engines]
+        random.shuffle(keys)
+        for key in keys:
+            engine = engines[key]
+            try:
+                # the session keeps this connection for the rest of its transaction
+                db_session.connection(bind=engine)
+            except exc.DBAPIError:
+                retry = app.config['REPLICA_RETRY_SECONDS']
+                with self._lock:
+                    self._unavailable[key] = time.monotonic() + retry
+                current_app.logger.warning('Replica %s is unavailable, skipping it for %ss', key, retry,
+                                           exc_info=True)
+                continue
+            return engine
+        return None
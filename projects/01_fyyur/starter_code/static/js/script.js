@@ -2,3 +2,30 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// suggest venue and artist names from /autocomplete while typing in a search box
+document.addEventListener('DOMContentLoaded', function () {
+  var inputs = document.querySelectorAll('input[data-autocomplete]');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var latest = 0;
+    input.addEventListener('input', function () {
+      var request = ++latest;
+      if (!input.value.trim()) {
+        list.innerHTML = '';
+        return;
+      }
+      fetch('/autocomplete?type=' + input.dataset.autocomplete + '&q=' + encodeURIComponent(input.value))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          if (request !== latest) return;  // an older answer arriving after a newer one
+          list.innerHTML = '';
+          data.suggestions.forEach(function (suggestion) {
+            var option = document.createElement('option');
+            option.value = suggestion.name;
+            list.appendChild(option);
+          });
+        });
+    });
+  });
+});
@@ -0,0 +1,539 @@
+import os
+import gzip
+import json
+import re
+import runpy
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP_DIR, 'fyyur.db')
+os.environ['QUERY_AUDIT'] = 'true'
+
+from app import app, db, query_audit, assets, name_index, Venue, Artist, Show
+from assets import build
+from templating import precompile
+import geo
+from autocomplete import PrefixIndex
+from query_audit import QueryBudgetExceeded, fingerprint
+from log_queue import setup_logging, NonBlockingQueueHandler
+
+
+def tearDownModule():
+    shutil.rmtree(TMP_DIR)
+
+
+class FyyurTestCase(unittest.TestCase):
+    """Runs Fyyur's views on a local sqlite database"""
+
+    def setUp(self):
+        app.config['QUERY_AUDIT_REPORT'] = os.path.join(TMP_DIR, 'n_plus_one.json')
+        self.client = app.test_client()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            venues = [Venue(name='Venue %d' % n, city='San Francisco', state='CA', address='%d Main St' % n,
+                            genres="['Jazz']") for n in range(3)]
+            artists = [Artist(name='Artist %d' % n, city='San Francisco', state='CA', genres="['Jazz']")
+                       for n in range(3)]
+            db.session.add_all(venues + artists)
+            db.session.flush()
+            db.session.add_all([
+                Show(venue_id=venue.id, artist_id=artist.id, start_time=datetime.now() + timedelta(days=n - 4))
+                for n, (venue, artist) in enumerate(zip(venues * 3, artists * 3))
+            ])
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+        if os.path.exists(app.config['QUERY_AUDIT_REPORT']):
+            os.remove(app.config['QUERY_AUDIT_REPORT'])
+
+
+class QueryAuditTestCase(FyyurTestCase):
+    """Checks the N+1 detector and query budgets"""
+
+    def test_fingerprint_ignores_parameters(self):
+        self.assertEqual(fingerprint('SELECT * FROM "Show" WHERE id = 3 AND name = \'x\''),
+                         fingerprint('SELECT *  FROM "Show"\nWHERE id = ? AND name = %(name_1)s'))
+        self.assertEqual(fingerprint('SELECT id FROM "Venue" WHERE id IN (?, ?, ?)'),
+                         fingerprint('SELECT id FROM "Venue" WHERE id IN (?)'))
+
+    def test_within_budget(self):
+        with query_audit.budget(max_queries=1):
+            self.assertEqual(self.client.get('/artists').status_code, 200)
+
+    def test_show_backrefs_are_reported(self):
+        app.config['QUERY_AUDIT_THRESHOLD'] = 3
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            with query_audit.budget(max_repeats=2):
+                self.assertEqual(self.client.get('/shows').status_code, 200)
+        self.assertIn('app.py:', str(raised.exception))
+
+        with open(app.config['QUERY_AUDIT_REPORT']) as report_file:
+            report = json.loads(report_file.readlines()[-1])
+        self.assertEqual(report['view'], 'shows')
+        self.assertTrue(all(repeat['call_site'].startswith('app.py:') for repeat in report['repeated']))
+        self.assertGreaterEqual(report['repeated'][0]['count'], 3)
+
+
+class LoggingTestCase(FyyurTestCase):
+    """Checks that errors are written as JSON lines through the log queue"""
+
+    def setUp(self):
+        super().setUp()
+        self.log_path = os.path.join(TMP_DIR, 'error.log')
+        self.handler = setup_logging(app, path=self.log_path, max_bytes=2000, backup_count=2)
+
+    def tearDown(self):
+        self.handler.stop()
+        app.logger.removeHandler(self.handler)
+        for suffix in ('', '.1', '.2'):
+            if os.path.exists(self.log_path + suffix):
+                os.remove(self.log_path + suffix)
+        super().tearDown()
+
+    def records(self):
+        self.handler.stop()
+        with open(self.log_path) as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_only_the_queue_writes(self):
+        self.assertIn(self.handler, app.logger.handlers)
+        self.assertTrue(all(isinstance(handler, NonBlockingQueueHandler) for handler in app.logger.handlers))
+
+    def test_failed_delete_is_logged_with_its_request(self):
+        self.client.delete('/venues/1000')
+
+        record = self.records()[-1]
+        self.assertEqual(record['level'], 'ERROR')
+        self.assertEqual(record['message'], 'Could not delete venue 1000')
+        self.assertIn('Traceback', record['exception'])
+        self.assertEqual(record['request'], {'method': 'DELETE', 'path': '/venues/1000', 'endpoint': 'delete_venue'})
+
+    def test_extras_and_rotation(self):
+        for n in range(50):
+            app.logger.warning('entry %d', n, extra={'entry': n})
+
+        records = self.records()
+        self.assertEqual(records[-1]['message'], 'entry 49')
+        self.assertEqual(records[-1]['entry'], 49)
+        self.assertNotIn('request', records[-1])
+        self.assertTrue(os.path.exists(self.log_path + '.1'))
+        self.assertFalse(os.path.exists(self.log_path + '.3'))
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        self.handler.stop()
+        self.handler.queue.maxsize = 1
+        self.handler._pid = os.getpid()  # keeps the listener stopped so the queue fills up
+        for n in range(3):
+            app.logger.warning('entry %d', n)
+        self.assertEqual(self.handler.dropped, 2)
+        self.handler._pid = None
+
+
+class AssetsTestCase(FyyurTestCase):
+    """Checks the hashed, precompressed static files and how they are served"""
+
+    def setUp(self):
+        super().setUp()
+        self.dist = os.path.join(TMP_DIR, 'dist')
+        self.manifest = build(app.static_folder, self.dist)
+        assets.load(self.dist)
+
+    def tearDown(self):
+        assets.load(os.path.join(TMP_DIR, 'nowhere'))
+        shutil.rmtree(self.dist)
+        super().tearDown()
+
+    def test_templates_link_hashed_files(self):
+        page = self.client.get('/').get_data(as_text=True)
+        self.assertIn('/static/dist/' + self.manifest['css/main.css'], page)
+        self.assertIn('/static/dist/' + self.manifest['img/front-splash.jpg'], page)
+        self.assertNotIn('"/static/css/', page)
+        # not in static/, so left as it was
+        self.assertIn('/static/ico/favicon.png', page)
+
+    def test_serves_precompressed_with_immutable_caching(self):
+        url = '/static/dist/' + self.manifest['css/bootstrap.min.css']
+        with open(os.path.join(app.static_folder, 'css/bootstrap.min.css'), 'rb') as source:
+            original = source.read()
+
+        res = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(res.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertTrue(res.content_type.startswith('text/css'))
+        self.assertEqual(gzip.decompress(res.get_data()), original)
+        res.close()
+
+        res = self.client.get(url)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(res.get_data(), original)
+        res.close()
+
+    def test_stylesheet_references_are_rewritten(self):
+        static = os.path.join(TMP_DIR, 'static')
+        os.makedirs(os.path.join(static, 'css'))
+        os.makedirs(os.path.join(static, 'fonts'))
+        with open(os.path.join(static, 'fonts', 'icons.woff'), 'wb') as font:
+            font.write(b'font')
+        with open(os.path.join(static, 'css', 'icons.css'), 'w') as css:
+            css.write('a{src:url("../fonts/icons.woff?#iefix")} b{src:url(../fonts/missing.woff)}')
+        try:
+            manifest = build(static)
+            with open(os.path.join(static, 'dist', manifest['css/icons.css'])) as css:
+                text = css.read()
+        finally:
+            shutil.rmtree(static)
+        self.assertIn('url("../%s?#iefix")' % manifest['fonts/icons.woff'], text)
+        self.assertIn('url(../fonts/missing.woff)', text)
+        self.assertRegex(manifest['fonts/icons.woff'], r'^fonts/icons\.[0-9a-f]{12}\.woff$')
+
+    def test_leftovers_of_a_crashed_build_are_not_sources(self):
+        static = os.path.join(TMP_DIR, 'static')
+        os.makedirs(os.path.join(static, 'dist.tmp'))
+        with open(os.path.join(static, 'dist.tmp', 'main.css'), 'w') as css:
+            css.write('a{}')
+        with open(os.path.join(static, 'app.js'), 'w') as script:
+            script.write('1')
+        try:
+            manifest = build(static)
+            self.assertEqual(sorted(os.listdir(static)), ['app.js', 'dist'])
+        finally:
+            shutil.rmtree(static)
+        self.assertEqual(list(manifest), ['app.js'])
+
+
+class TemplatesTestCase(FyyurTestCase):
+    """Checks template precompilation and the pre-rendered select widgets"""
+
+    def test_precompiles_every_page(self):
+        timings = precompile(app)
+        self.assertIn('forms/new_venue.html', timings)
+        self.assertIn('pages/show_venue.html', timings)
+        self.assertNotIn('pages/home.css', timings)
+        self.assertIsNotNone(app.jinja_env.bytecode_cache)
+
+    def test_prerendered_selects_match_wtforms(self):
+        import forms
+        from wtforms.widgets import Select
+
+        with app.test_request_context():
+            for form in (forms.ArtistForm(), forms.VenueForm(state='NY', genres=['Jazz', 'R&B'])):
+                for field, multiple in ((form.state, False), (form.genres, True)):
+                    for _ in range(2):  # rendered, then from the cache
+                        self.assertEqual(field(class_='form-control'),
+                                         Select(multiple=multiple)(field, class_='form-control'))
+
+    def test_edit_form_keeps_selection(self):
+        page = self.client.get('/artists/1/edit').get_data(as_text=True)
+        self.assertIn('<option selected value="CA">CA</option>', page)
+        self.assertIn('<option selected value="Jazz">Jazz</option>', page)
+        self.assertEqual(page.count('<select'), 2)
+
+
+class BookingTestCase(FyyurTestCase):
+    """Checks that shows overlapping another booking of the venue or artist are rejected"""
+
+    def book(self, venue_id, artist_id, start_time, duration=120):
+        return self.client.post('/shows/create', data={
+            'venue_id': venue_id, 'artist_id': artist_id,
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M'), 'duration': duration})
+
+    def shows(self):
+        with app.app_context():
+            return Show.query.count()
+
+    def test_overlapping_bookings_are_rejected(self):
+        start = datetime(2030, 5, 1, 20, 0)
+        self.assertEqual(self.book(1, 1, start).status_code, 200)
+        # the venue, then the artist, is still busy an hour later
+        self.assertEqual(self.book(1, 2, start + timedelta(hours=1)).status_code, 409)
+        self.assertEqual(self.book(2, 1, start - timedelta(hours=1), duration=61).status_code, 409)
+        self.assertEqual(self.shows(), 10)
+
+        # back to back is fine
+        self.assertEqual(self.book(1, 2, start + timedelta(hours=2)).status_code, 200)
+        self.assertEqual(self.book(2, 1, start - timedelta(hours=1), duration=60).status_code, 200)
+        self.assertEqual(self.shows(), 12)
+
+    def test_invalid_bookings(self):
+        self.assertEqual(self.book(1, 1, datetime(2030, 5, 1), duration=0).status_code, 400)
+        self.assertEqual(self.book(1, 1, datetime(2030, 5, 1), duration=25 * 60).status_code, 400)
+        res = self.client.post('/shows/create', data={'venue_id': '1', 'artist_id': 'x', 'start_time': 'soon'})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.shows(), 9)
+
+    def test_conflict_check_is_one_index_range_scan(self):
+        start = datetime(2030, 1, 1)
+        with app.app_context():
+            db.session.add_all([Show(venue_id=1, artist_id=1 + n % 3, start_time=start + timedelta(hours=3 * n))
+                                for n in range(3000)])
+            db.session.commit()
+            conflict = Show.find_conflict(1, 2, start + timedelta(hours=3000), start + timedelta(hours=3001))
+            self.assertEqual(conflict.start_time, start + timedelta(hours=3000))
+            self.assertIsNone(Show.find_conflict(1, 2, start + timedelta(hours=3002), start + timedelta(hours=3003)))
+
+            query = Show.overlapping(1, 2, start, start + timedelta(hours=1))
+            statement = str(query.statement.compile(compile_kwargs={'literal_binds': True}))
+            plan = ' '.join(str(row) for row in db.session.execute('EXPLAIN QUERY PLAN ' + statement))
+            self.assertIn('ix_show_venue_start', plan)
+            self.assertIn('ix_show_artist_start', plan)
+
+        with query_audit.budget(max_queries=2):
+            self.book(1, 2, start + timedelta(hours=1))
+
+
+class VenuesNearTestCase(FyyurTestCase):
+    """Checks the geohash index and the nearby venues search"""
+
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            for venue_id, (latitude, longitude) in zip((1, 2, 3), ((37.7749, -122.4194), (37.8044, -122.2712),
+                                                                   (34.0522, -118.2437))):
+                Venue.query.get(venue_id).set_location(latitude, longitude)
+            db.session.commit()
+
+    def test_geohash(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.search_precision(37.77, 10), 4)
+        cells = geo.covering_cells(37.7749, -122.4194, 10)
+        self.assertEqual(len(cells), 9)
+        # a point 9km east lies in one of them
+        self.assertIn(geo.encode(37.7749, -122.3174, 4), cells)
+        self.assertEqual(geo.covering_cells(0, 0, 6000), [''])
+
+    def test_prefix_range(self):
+        self.assertEqual(geo.prefix_range('dr5r'), ('dr5r', 'dr5s'))
+        self.assertEqual(geo.prefix_range('9q8z'), ('9q8z', '9q9'))
+        self.assertEqual(geo.prefix_range('zz'), ('zz', None))
+        self.assertEqual(geo.prefix_range(''), ('', None))
+
+    def test_prefix_range_under_a_locale_collation(self):
+        # like glibc's en_US: punctuation is ignored at first, so 'dr5r{' sorts before 'dr5rq'
+        def locale_order(left, right):
+            keys = [(re.sub(r'[^0-9a-z]', '', text), text) for text in (left, right)]
+            return (keys[0] > keys[1]) - (keys[0] < keys[1])
+
+        connection = sqlite3.connect(':memory:')
+        connection.create_collation('en_US', locale_order)
+        connection.execute('CREATE TABLE venue (geohash TEXT COLLATE en_US)')
+        connection.executemany('INSERT INTO venue VALUES (?)', [('dr5rq',), ('dr5rzz',), ('dr5s0',), ('dr5r',)])
+        low, high = geo.prefix_range('dr5r')
+        found = connection.execute('SELECT geohash FROM venue WHERE geohash >= ? AND geohash < ? ORDER BY geohash',
+                                   (low, high)).fetchall()
+        self.assertEqual([geohash for geohash, in found], ['dr5r', 'dr5rq', 'dr5rzz'])
+        # the sentinel bound this replaced misses every longer hash under such a collation
+        self.assertEqual(connection.execute('SELECT geohash FROM venue WHERE geohash >= ? AND geohash < ?',
+                                            ('dr5r', 'dr5r{')).fetchall(), [('dr5r',)])
+        connection.close()
+
+    def test_nearest_venues_with_upcoming_shows(self):
+        data = self.client.get('/venues/near?lat=37.78&lon=-122.41&radius=25').get_json()
+        self.assertEqual([venue['id'] for venue in data['venues']], [1, 2])
+        self.assertLess(data['venues'][0]['distance_km'], 1.5)
+        self.assertEqual([venue['num_upcoming_shows'] for venue in data['venues']], [1, 1])
+
+        data = self.client.get('/venues/near?city=Los+Angeles&state=CA&limit=1').get_json()
+        self.assertEqual(data['venues'][0]['id'], 3)
+        self.assertEqual(data['venues'][0]['num_upcoming_shows'], 2)
+
+    def test_only_nearby_cells_are_measured(self):
+        with mock.patch('geo.distance_km', wraps=geo.distance_km) as distance:
+            data = self.client.get('/venues/near?lat=34.05&lon=-118.24&radius=5').get_json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(distance.call_count, 1)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get('/venues/near?lat=37').status_code, 400)
+        self.assertEqual(self.client.get('/venues/near?lat=37&lon=-122&radius=5000').status_code, 400)
+        self.assertEqual(self.client.get('/venues/near?city=Atlantis&state=XX').status_code, 404)
+
+    def test_new_venues_are_located_from_the_gazetteer(self):
+        self.client.post('/venues/create', data={
+            'name': 'The Fillmore', 'city': 'San Francisco', 'state': 'CA', 'address': '1805 Geary Blvd',
+            'phone': '', 'genres': 'Rock n Roll', 'facebook_link': ''})
+        with app.app_context():
+            venue = Venue.query.filter_by(name='The Fillmore').one()
+            self.assertEqual((venue.latitude, venue.longitude), geo.locate('San Francisco', 'CA'))
+            self.assertTrue(venue.geohash.startswith('9q8yy'))
+
+
+class AutocompleteTestCase(FyyurTestCase):
+    """Checks the prefix index behind /autocomplete and its incremental updates"""
+
+    def setUp(self):
+        super().setUp()
+        name_index.load()
+
+    def suggest(self, query, **params):
+        params['q'] = query
+        return [(suggestion['type'], suggestion['id'], suggestion['name'])
+                for suggestion in self.client.get('/autocomplete', query_string=params).get_json()['suggestions']]
+
+    def test_word_prefixes(self):
+        index = PrefixIndex(lambda: [('venue', 1, 'The Musical Hop'), ('venue', 2, 'Park Square Live Music & Coffee'),
+                                     ('artist', 1, 'Guns N Petals')], max_age=None)
+        self.assertEqual([record_id for _, record_id, _ in index.search('mus')], [2, 1])
+        self.assertEqual(index.search('musical h'), [('venue', 1, 'The Musical Hop')])
+        self.assertEqual(index.search('  PETALS'), [('artist', 1, 'Guns N Petals')])
+        self.assertEqual(index.search('mus', kind='artist'), [])
+        self.assertEqual(len(index.search('', limit=5)), 0)
+
+    def test_reload_runs_once_in_the_background_and_keeps_changes(self):
+        loaded, release = [], threading.Event()
+
+        def loader():
+            loaded.append(True)
+            if len(loaded) > 1:
+                release.wait(5)
+            return [('venue', 1, 'The Musical Hop')]
+
+        index = PrefixIndex(loader, max_age=0)
+        self.assertEqual(index.search('mus'), [('venue', 1, 'The Musical Hop')])
+        # stale from now on: searches start one reload and keep answering from the old list
+        for _ in range(5):
+            self.assertEqual(index.search('mus'), [('venue', 1, 'The Musical Hop')])
+        self.assertEqual(len(loaded), 2)
+
+        index.add('artist', 7, 'Musical Youth')  # while the reload runs, which missed it
+        release.set()
+        index._refresher.join(5)
+        self.assertEqual(index.search('mus', kind='artist'), [('artist', 7, 'Musical Youth')])
+
+    def test_failed_reload_keeps_the_old_names(self):
+        rows = [[('venue', 1, 'The Musical Hop')]]
+        index = PrefixIndex(lambda: rows.pop(), max_age=0)
+        index.search('mus')
+        with self.assertLogs('autocomplete', 'ERROR'):
+            index.search('mus')
+            index._refresher.join(5)
+        self.assertEqual(index.search('hop'), [('venue', 1, 'The Musical Hop')])
+
+    def test_endpoint(self):
+        self.assertEqual(self.suggest('artist 1'), [('artist', 2, 'Artist 1')])
+        self.assertEqual(len(self.suggest('venue', limit=2)), 2)
+        res = self.client.get('/autocomplete?q=1&type=venue').get_json()
+        self.assertEqual(res['suggestions'], [{'type': 'venue', 'id': 2, 'name': 'Venue 1', 'url': '/venues/2'}])
+        self.assertEqual(self.client.get('/autocomplete?q=v&type=show').status_code, 400)
+
+    def test_updated_by_create_edit_and_delete(self):
+        self.client.post('/artists/create', data={
+            'name': 'Matt Quevedo', 'city': 'New York', 'state': 'NY', 'phone': '', 'genres': 'Jazz',
+            'facebook_link': ''})
+        self.assertEqual(self.suggest('quev'), [('artist', 4, 'Matt Quevedo')])
+
+        self.client.post('/venues/1/edit', data={
+            'name': 'The Dueling Pianos Bar', 'city': 'New York', 'state': 'NY', 'address': '335 Delancey Street',
+            'phone': '', 'genres': 'Jazz', 'facebook_link': ''})
+        self.assertEqual(self.suggest('duel'), [('venue', 1, 'The Dueling Pianos Bar')])
+        self.assertEqual(self.suggest('venue 0'), [])
+
+        self.client.delete('/venues/1')
+        self.assertEqual(self.suggest('pianos'), [])
+
+
+class DeleteTestCase(FyyurTestCase):
+    """Checks that venues and artists are deleted with their shows in a constant number of queries"""
+
+    def add_shows(self, count):
+        start = datetime(2030, 1, 1)
+        with app.app_context():
+            db.session.add_all([Show(venue_id=1, artist_id=1 + n % 2, start_time=start + timedelta(hours=3 * n))
+                                for n in range(count)])
+            db.session.commit()
+
+    def remaining(self):
+        with app.app_context():
+            return Venue.query.count(), Artist.query.count(), Show.query.count()
+
+    def test_delete_venue_with_many_shows(self):
+        self.add_shows(2000)
+        with query_audit.budget(max_queries=3):
+            self.client.delete('/venues/1')
+        # venue 1 had 3 of the 9 seeded shows
+        self.assertEqual(self.remaining(), (2, 3, 6))
+
+    def test_delete_artist(self):
+        self.add_shows(100)
+        with query_audit.budget(max_queries=3):
+            self.client.delete('/artists/2')
+        self.assertEqual(self.remaining(), (3, 2, 6 + 50))
+
+        self.client.delete('/artists/2')
+        with self.client.session_transaction() as session:
+            self.assertEqual(session['_flashes'][-1][1], 'An error occurred. Artist could not be deleted.')
+
+
+class ReplicaTestCase(FyyurTestCase):
+    """Reads from a second sqlite database standing in for a replica"""
+
+    def setUp(self):
+        super().setUp()
+        self.replica = os.path.join(TMP_DIR, 'replica.db')
+        shutil.copyfile(os.path.join(TMP_DIR, 'fyyur.db'), self.replica)
+        # replication lag: the replica still has the old name
+        with sqlite3.connect(self.replica) as connection:
+            connection.execute('UPDATE "Artist" SET name = \'Stale Artist\' WHERE id = 1')
+        app.config['SQLALCHEMY_BINDS'] = {'replica_1': 'sqlite:///' + self.replica}
+        db._unavailable.clear()
+
+    def tearDown(self):
+        app.config['SQLALCHEMY_BINDS'] = None
+        app.config['REPLICA_STICKY_SECONDS'] = 10
+        super().tearDown()
+
+    def edit_artist(self, client):
+        return client.post('/artists/1/edit', data={
+            'name': 'Artist 0', 'city': 'Oakland', 'state': 'CA', 'phone': '', 'genres': 'Jazz',
+            'facebook_link': ''})
+
+    def test_reads_use_the_replica(self):
+        self.assertIn(b'Stale Artist', self.client.get('/artists/1').data)
+        self.assertIn(b'Stale Artist', self.client.get('/artists').data)
+
+    def test_writes_use_the_primary_and_stick(self):
+        self.edit_artist(self.client)
+        with app.app_context():
+            self.assertEqual(Artist.query.get(1).city, 'Oakland')
+        # the browser that wrote reads its write, others still read the replica
+        self.assertIn(b'Artist 0', self.client.get('/artists/1').data)
+        self.assertIn(b'Stale Artist', app.test_client().get('/artists/1').data)
+
+    def test_stickiness_expires(self):
+        app.config['REPLICA_STICKY_SECONDS'] = 0
+        self.edit_artist(self.client)
+        self.assertIn(b'Stale Artist', self.client.get('/artists/1').data)
+
+    def test_replicas_need_a_shared_secret_key(self):
+        config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.py')
+        with mock.patch.dict(os.environ, {'DATABASE_REPLICA_URLS': 'sqlite:///' + self.replica}):
+            os.environ.pop('SECRET_KEY', None)
+            with self.assertRaisesRegex(RuntimeError, 'SECRET_KEY'):
+                runpy.run_path(config_file)
+            os.environ['SECRET_KEY'] = 'shared'
+            self.assertEqual(runpy.run_path(config_file)['SECRET_KEY'], 'shared')
+
+    def test_falls_back_to_the_primary(self):
+        app.config['SQLALCHEMY_BINDS'] = {'replica_1': 'sqlite:///' + os.path.join(TMP_DIR, 'missing', 'replica.db')}
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            response = self.client.get('/artists/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Artist 0', response.data)
+        self.assertIn('Replica replica_1 is unavailable', logs.output[0])
+        # skipped from then on, without another attempt
+        with app.app_context():
+            self.assertEqual(db.available_replicas(app), [])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
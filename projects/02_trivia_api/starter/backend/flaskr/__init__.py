@@ -7,6 +7,8 @@ import json
 import random
 
 from models import setup_db, Question, Category
+from fsnd_shared.metrics import Metrics
+from fsnd_shared.compression import Compress
 
 QUESTIONS_PER_PAGE = 10
 
@@ -16,6 +18,8 @@ def create_app(test_config=None):
     app = Flask(__name__)
     setup_db(app)
     cors = CORS(app, origins="*")
+    Metrics(app)
+    app.wsgi_app = Compress(app.wsgi_app)  # gzip/brotli for clients that accept it
 
     @app.after_request
     def after_request(response):
@@ -1,16 +1,30 @@
 import os
 from flask import Flask, request, jsonify, abort
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import load_only
 import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
+from .database.models import db_drop_and_create_all, setup_db, validate_recipe, Drink, DrinkSales, DRINK_FIELDS
+from .database.order_buffer import OrderBuffer, OrderBufferFull
 from .database.initialize_db_mock_data import initialize_db_mock_data
-from .auth.auth import AuthError, requires_auth
+from .auth.auth import AuthError, RateLimit, requires_auth
+from fsnd_shared.metrics import Metrics
+from fsnd_shared.compression import Compress
+
+MAX_BATCH_DRINKS = 100
+
+# per-caller request budgets of the authenticated endpoints: bursts of capacity, refilled per_second
+READ_LIMIT = RateLimit(capacity=30, per_second=10)
+WRITE_LIMIT = RateLimit(capacity=10, per_second=1)
+ORDER_LIMIT = RateLimit(capacity=120, per_second=30)  # a POS terminal at rush hour
 
 app = Flask(__name__)
 setup_db(app)
 CORS(app)
+metrics = Metrics(app)
+order_buffer = OrderBuffer(app)
+app.wsgi_app = Compress(app.wsgi_app)  # gzip/brotli for clients that accept it
 
 
 '''
@@ -22,44 +36,116 @@ CORS(app)
 #initialize_db_mock_data()
 
 
+## Helpers
+def parse_fields(in_request):
+    """Reads ?fields=id,title into a list of DRINK_FIELDS, None when not given"""
+    if 'fields' not in in_request.args:
+        return None
+    fields = [field.strip() for field in in_request.args['fields'].split(',') if field.strip()]
+    if not fields or any(field not in DRINK_FIELDS for field in fields):
+        abort(422)
+    return fields
+
+
+def project_query(query, fields):
+    """Skips reading the recipe blob when it is neither rendered nor parsed"""
+    if fields is not None and 'recipe' not in fields:
+        query = query.options(load_only(Drink.id, Drink.title))
+    return query
+
+
+def parse_batch_ids(in_request):
+    """Reads ?ids=1,2,3 into a list of unique ids, in the order the client asked for"""
+    try:
+        ids = [int(drink_id) for drink_id in in_request.args.get('ids', '').split(',') if drink_id.strip()]
+    except ValueError:  # non-integer id
+        abort(422)
+    if not ids or len(ids) > MAX_BATCH_DRINKS:
+        abort(422)
+    return list(dict.fromkeys(ids))
+
+
+def batch_drinks(in_request, detail):
+    """Fetches all requested drinks in a single query, returned in request order"""
+    ids = parse_batch_ids(in_request)
+    fields = parse_fields(in_request)
+    query = project_query(Drink.query.filter(Drink.id.in_(ids)), fields)
+    try:
+        drinks_by_id = {drink.id: drink for drink in query.all()}
+    except SQLAlchemyError as e:  # server error, db uninitialized?
+        abort(500)
+
+    return jsonify({
+        "success": True,
+        "status_code": 200,
+        "drinks": [
+            drinks_by_id[drink_id].long(fields) if detail else drinks_by_id[drink_id].short(fields)
+            for drink_id in ids if drink_id in drinks_by_id
+        ],
+        "missing": [drink_id for drink_id in ids if drink_id not in drinks_by_id],
+    }), 200
+
+
 ## ROUTES
 @app.route('/drinks')
 def drinks():
+    # optional filters, e.g. /drinks?ingredient=milk&color=black, answered from the ingredient index
+    ingredients = request.args.getlist('ingredient')
+    colors = request.args.getlist('color')
+    fields = parse_fields(request)
     try:
-        drinks_db = Drink.query.all()
+        if ingredients or colors:
+            query = Drink.with_ingredients(names=ingredients, colors=colors)
+        else:
+            query = Drink.query
+        drinks_db = project_query(query, fields).all()
     except SQLAlchemyError as e:  # server error, db uninitialized?
         abort(500)
 
     return jsonify({
         "success": True,
         "status_code": 200,
-        "drinks": [drink.short() for drink in drinks_db]
+        "drinks": [drink.short(fields) for drink in drinks_db]
     }), 200
 
 
 @app.route('/drinks-detail')
-@requires_auth(permission='get:drinks-detail')
+@requires_auth(permission='get:drinks-detail', rate_limit=READ_LIMIT)
 def drinks_detail():
+    fields = parse_fields(request)
     try:
-        drinks_db = Drink.query.all()
+        drinks_db = project_query(Drink.query, fields).all()
     except SQLAlchemyError as e:   # server error, db uninitialized?
         abort(500)
 
     return jsonify({
         "success": True,
         "status_code": 200,
-        "drinks": [drink.long() for drink in drinks_db]
+        "drinks": [drink.long(fields) for drink in drinks_db]
     }), 200
 
 
+@app.route('/drinks/batch')
+def drinks_batch():
+    return batch_drinks(request, detail=False)
+
+
+@app.route('/drinks-detail/batch')
+@requires_auth(permission='get:drinks-detail', rate_limit=READ_LIMIT)
+def drinks_detail_batch():
+    return batch_drinks(request, detail=True)
+
+
 @app.route('/drinks', methods=['POST'])
-@requires_auth(permission='post:drinks')
+@requires_auth(permission='post:drinks', rate_limit=WRITE_LIMIT)
 def post_drink():
     drink_dict = request.get_json()
     try:
-        recipe = drink_dict['recipe']
+        recipe = validate_recipe(drink_dict['recipe'])
         title = drink_dict['title']
-    except KeyError:  # request contains no recipe or no title
+    except (KeyError, TypeError):  # request contains no recipe or no title
+        abort(422)
+    except ValueError:  # recipe is not a list of ingredients
         abort(422)
 
     try:
@@ -83,29 +169,29 @@ def post_drink():
 
 
 @app.route('/drinks/<int:id>', methods=['PATCH'])
-@requires_auth(permission='patch:drinks')
+@requires_auth(permission='patch:drinks', rate_limit=WRITE_LIMIT)
 def patch_drink(id):
-    try:
-        drink_matching = Drink.query.get(id)
-    except SQLAlchemyError:  # not found
-        abort(404)
-
-    try:
-        drink_dict = request.get_json()
-        if 'recipe' in drink_dict:
-            recipe = drink_dict['recipe']
-            drink_matching.recipe = json.dumps(recipe)
-        if 'title' in drink_dict:
-            title = drink_dict['title']
-            drink_matching.title = title
-    except SQLAlchemyError:  # bad input
+    drink_dict = request.get_json()
+    if not isinstance(drink_dict, dict):  # bad input
         abort(422)
 
+    recipe = None
+    if 'recipe' in drink_dict:
+        try:
+            recipe = json.dumps(validate_recipe(drink_dict['recipe']))
+        except ValueError:  # recipe is not a list of ingredients
+            abort(422)
+    title = drink_dict.get('title')
+
     try:
-        drink_matching.update()
+        # a single UPDATE (... RETURNING) instead of loading the drink and flushing it
+        drink_matching = Drink.update_by_id(id, title=title, recipe=recipe)
     except SQLAlchemyError:  # server error
         abort(500)
 
+    if drink_matching is None:  # not found
+        abort(404)
+
     return jsonify({
         "success": True,
         "status_code": 200,
@@ -114,22 +200,77 @@ def patch_drink(id):
 
 
 @app.route('/drinks/<int:id>', methods=['DELETE'])
-@requires_auth(permission='delete:drinks')
+@requires_auth(permission='delete:drinks', rate_limit=WRITE_LIMIT)
 def delete_drink(id):
     try:
-        drink_matching = Drink.query.get(id)
-    except SQLAlchemyError:  # not found
+        deleted = Drink.delete_by_id(id)
+    except SQLAlchemyError:  # server error
+        abort(500)
+
+    if not deleted:  # not found
         abort(404)
 
+    return jsonify({
+        "success": True,
+        "status_code": 200,
+        "delete": id,
+    }), 200
+
+
+@app.route('/orders', methods=['POST'])
+@requires_auth(permission='post:orders', rate_limit=ORDER_LIMIT)
+def post_order():
+    order_dict = request.get_json()
     try:
-        drink_matching.delete()
-    except SQLAlchemyError:  # server error
+        drink_id = int(order_dict['drink_id'])
+        quantity = int(order_dict.get('quantity', 1))
+    except (KeyError, TypeError, ValueError, AttributeError):  # missing or non-integer fields
+        abort(422)
+    if quantity < 1:
+        abort(422)
+
+    try:
+        # buffered and written with the next batch; orders for unknown drinks are dropped there
+        order = order_buffer.add(drink_id, quantity)
+    except OrderBufferFull:  # database is not keeping up
+        abort(503)
+
+    return jsonify({
+        "success": True,
+        "status_code": 202,
+        "order": order['token'],
+    }), 202
+
+
+@app.route('/drinks/<int:id>/sales')
+@requires_auth(permission='get:sales', rate_limit=READ_LIMIT)
+def get_drink_sales(id):
+    try:
+        sales = DrinkSales.query.get(id)
+        if sales is None and Drink.query.get(id) is None:
+            abort(404)
+    except SQLAlchemyError as e:  # server error, db uninitialized?
         abort(500)
 
     return jsonify({
         "success": True,
         "status_code": 200,
-        "delete": id,
+        "sales": sales.format() if sales else DrinkSales(drink_id=id, orders=0, quantity=0).format(),
+    }), 200
+
+
+@app.route('/sales')
+@requires_auth(permission='get:sales', rate_limit=READ_LIMIT)
+def get_sales():
+    try:
+        sales_db = DrinkSales.query.order_by(DrinkSales.quantity.desc()).all()
+    except SQLAlchemyError as e:  # server error, db uninitialized?
+        abort(500)
+
+    return jsonify({
+        "success": True,
+        "status_code": 200,
+        "sales": [sales.format() for sales in sales_db],
     }), 200
 
 
@@ -140,7 +281,7 @@ def auth_error(error):
         "success": False,
         "error": error.status_code,
         "message": error.error,
-    }), error.status_code
+    }), error.status_code, error.headers
 
 
 @app.errorhandler(404)
@@ -177,3 +318,12 @@ def server_db_error(error):
         "error": 500,
         "message": "server_db_error"
     }), 500
+
+
+@app.errorhandler(503)
+def service_unavailable(error):
+    return jsonify({
+        "success": False,
+        "error": 503,
+        "message": "service unavailable"
+    }), 503
@@ -1,9 +1,12 @@
 import json
+import math
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
 
+from .rate_limit import RateLimit, limiter
+
 
 AUTH0_DOMAIN = 'zoe-coffeeshop.auth0.com'
 ALGORITHMS = ['RS256']
@@ -20,9 +23,10 @@ A standardized way to communicate auth failure modes
 
 
 class AuthError(Exception):
-    def __init__(self, error, status_code):
+    def __init__(self, error, status_code, headers=None):
         self.error = error
         self.status_code = status_code
+        self.headers = headers or {}
 
 
 ## Auth Header
@@ -124,12 +128,37 @@ def verify_decode_jwt(token):
         }, 400)
 
 
-def requires_auth(permission=''):
+## Rate limiting
+'''
+check_rate_limit(permission, rate_limit, token)
+    spends a token from the caller's bucket for this permission, before any crypto or db work
+    callers are keyed by the sub of a token that verified earlier, otherwise by client ip
+'''
+def check_rate_limit(permission, rate_limit, token):
+    retry_after = limiter.check(permission, rate_limit, token, request.remote_addr)
+    if retry_after:
+        raise AuthError({
+            'code': 'rate_limited',
+            'description': 'Too many requests, retry in {:.1f} seconds.'.format(retry_after),
+        }, 429, headers={'Retry-After': str(math.ceil(retry_after))})
+
+
+'''
+requires_auth(permission, rate_limit)
+    rate_limit is an optional RateLimit applied per caller to this permission
+    EXAMPLE
+        @requires_auth(permission='get:drinks-detail', rate_limit=RateLimit(capacity=20, per_second=5))
+'''
+def requires_auth(permission='', rate_limit=None):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
+            if rate_limit is not None:
+                check_rate_limit(permission, rate_limit, token)
             payload = verify_decode_jwt(token)
+            if rate_limit is not None:
+                limiter.remember(token, payload)
             check_permissions(permission, payload)
             return f(*args, **kwargs)
 
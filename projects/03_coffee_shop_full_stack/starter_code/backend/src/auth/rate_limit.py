@@ -0,0 +1,229 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+'''
+rate limiter settings, each can be overridden with the environment variable of the same name
+    RATE_LIMIT_BACKEND: 'memory' for a per-process limiter, 'sqlite' to share buckets
+        between all workers on the host through RATE_LIMIT_DB
+    RATE_LIMIT_DB: the sqlite file used by the shared backend
+'''
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_DB = os.environ.get(
+    'RATE_LIMIT_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_limit.db'))
+
+
+class RateLimit:
+    """A token bucket: bursts of up to capacity requests, refilled at per_second requests a second
+
+    EXAMPLE
+        @requires_auth(permission='get:drinks-detail', rate_limit=RateLimit(capacity=20, per_second=5))
+    """
+
+    def __init__(self, capacity, per_second):
+        if capacity < 1 or per_second <= 0:
+            raise ValueError("a rate limit needs a capacity of at least 1 and a positive refill rate")
+        self.capacity = capacity
+        self.per_second = per_second
+
+
+def refill(tokens, updated, limit, now):
+    """Tokens in a bucket last seen with tokens at time updated, at time now"""
+    return min(limit.capacity, tokens + (now - updated) * limit.per_second)
+
+
+class MemoryBackend:
+    """Token buckets in a dict of this process, kept to max_keys by evicting the least recently used"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, now):
+        """Spends a token from key's bucket; returns 0 when allowed, else seconds until one is free"""
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (limit.capacity, now, limit))
+            tokens = refill(tokens, updated, limit, now)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now, limit)
+                self._buckets.move_to_end(key)
+                if len(self._buckets) > self.max_keys:
+                    self._prune(now)
+                return 0
+            self._buckets[key] = (tokens, now, limit)
+            self._buckets.move_to_end(key)
+            return (1 - tokens) / limit.per_second
+
+    def _prune(self, now):
+        # a bucket that would be full again behaves exactly like a missing one: drop those among
+        # the least recently used, then evict the least recently used if that was not enough
+        while self._buckets:
+            key, (tokens, updated, limit) = next(iter(self._buckets.items()))
+            if refill(tokens, updated, limit, now) < limit.capacity:
+                break
+            del self._buckets[key]
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+class SqliteBackend:
+    """Token buckets and verified tokens in a sqlite file, shared by every worker process on the host.
+
+    Stands in for a networked store such as redis: anything with the same take() works, and
+    one that also has share_token() and verified_token() shares verified tokens between workers.
+    Every prune_every takes, buckets that are full again and expired tokens are deleted.
+    """
+
+    def __init__(self, path=RATE_LIMIT_DB, prune_every=1000):
+        self.path = path
+        self.prune_every = prune_every
+        self._takes = 0
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(bucket)")]
+            if columns and 'full_at' not in columns:
+                connection.execute("DROP TABLE bucket")  # from before pruning; losing buckets refills them
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL,"
+                " updated REAL NOT NULL, full_at REAL NOT NULL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS verified_token (key BLOB PRIMARY KEY, sub TEXT NOT NULL,"
+                " expires REAL NOT NULL)")
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            # autocommit mode, so BEGIN IMMEDIATE below controls the transaction
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")  # losing a bucket refills it, nothing worse
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def take(self, key, limit, now):
+        """Spends a token from key's bucket; returns 0 when allowed, else seconds until one is free"""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated FROM bucket WHERE key = ?", (key,)).fetchone()
+            tokens = refill(row[0], row[1], limit, now) if row else limit.capacity
+            wait = 0 if tokens >= 1 else (1 - tokens) / limit.per_second
+            if tokens >= 1:
+                tokens -= 1
+            full_at = now + (limit.capacity - tokens) / limit.per_second
+            connection.execute("INSERT OR REPLACE INTO bucket (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                               (key, tokens, now, full_at))
+            self._takes += 1
+            if self._takes % self.prune_every == 0:
+                connection.execute("DELETE FROM bucket WHERE full_at <= ?", (now,))
+                connection.execute("DELETE FROM verified_token WHERE expires <= ?", (now,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+    def share_token(self, key, sub, expires):
+        self._connection().execute("INSERT OR REPLACE INTO verified_token (key, sub, expires) VALUES (?, ?, ?)",
+                                   (key, sub, expires))
+
+    def verified_token(self, key, now):
+        """(sub, expires) of a token shared by share_token() that has not expired, or None"""
+        return self._connection().execute(
+            "SELECT sub, expires FROM verified_token WHERE key = ? AND expires > ?", (key, now)).fetchone()
+
+
+class VerifiedTokens:
+    """LRU of token -> sub for tokens that passed verify_decode_jwt.
+
+    Lets the limiter key a request by its verified sub before doing any crypto; tokens it has
+    never seen are keyed by client ip, so forged tokens cannot spend another user's budget.
+    Entries are keyed by a hash of the whole token: a token that reuses a verified token's
+    signature with another header or payload is a different, unverified token.
+    """
+
+    def __init__(self, max_tokens=10000):
+        self.max_tokens = max_tokens
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def remember(self, token, payload):
+        if 'sub' not in payload:
+            return
+        key = self.key(token)
+        with self._lock:
+            self._tokens[key] = (payload['sub'], payload.get('exp'))
+            self._tokens.move_to_end(key)
+            if len(self._tokens) > self.max_tokens:
+                self._tokens.popitem(last=False)
+
+    def sub(self, token, now):
+        key = self.key(token)
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None:
+                return None
+            sub, expires = entry
+            if expires is not None and expires <= now:
+                del self._tokens[key]
+                return None
+            self._tokens.move_to_end(key)
+            return sub
+
+
+class RateLimiter:
+    """Checks requests against per-permission token buckets keyed by verified sub or client ip
+
+    Verified tokens are remembered by this process and, when the backend can share them, by the
+    backend, so every worker keys a caller the same way. Tokens without an exp claim are
+    only remembered by the process that verified them.
+    """
+
+    def __init__(self, backend=None, clock=time.time):
+        if backend is None:
+            backend = SqliteBackend() if RATE_LIMIT_BACKEND == 'sqlite' else MemoryBackend()
+        self.backend = backend
+        self.clock = clock
+        self.verified_tokens = VerifiedTokens()
+
+    def identity(self, token, remote_addr):
+        sub = self.verified_tokens.sub(token, self.clock()) if token else None
+        if sub is None and token and hasattr(self.backend, 'verified_token'):
+            shared = self.backend.verified_token(VerifiedTokens.key(token), self.clock())
+            if shared is not None:  # verified by another worker
+                sub, expires = shared
+                self.verified_tokens.remember(token, {'sub': sub, 'exp': expires})
+        if sub is not None:
+            return 'sub:' + sub
+        return 'ip:' + str(remote_addr)
+
+    def remember(self, token, payload):
+        """Keys the requests of token, which passed verify_decode_jwt, by its sub from now on"""
+        if 'sub' not in payload or self.verified_tokens.sub(token, self.clock()) == payload['sub']:
+            return
+        self.verified_tokens.remember(token, payload)
+        if payload.get('exp') is not None and hasattr(self.backend, 'share_token'):
+            self.backend.share_token(VerifiedTokens.key(token), payload['sub'], payload['exp'])
+
+    def check(self, permission, limit, token, remote_addr):
+        """Returns 0 when the request may proceed, else the seconds until it may retry"""
+        key = permission + '|' + self.identity(token, remote_addr)
+        return self.backend.take(key, limit, self.clock())
+
+
+limiter = RateLimiter()
@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import Column, String, Integer, exc
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, exc, event, inspect, select, bindparam
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -9,16 +10,132 @@ database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filenam
 
 db = SQLAlchemy()
 
+'''
+sqlite_profile
+    connection tuning applied to every SQLite connection opened by setup_db
+    each value can be overridden with the matching SQLITE_* environment variable
+    (e.g. SQLITE_JOURNAL_MODE=DELETE) or by passing a dict to setup_db
+    - journal_mode: WAL lets readers keep reading while a single writer commits
+    - busy_timeout_ms: how long a writer waits on a lock before "database is locked"
+    - synchronous: NORMAL is durable in WAL mode and skips the fsync on every commit
+    - mmap_size: bytes of the database file read through memory-mapped I/O
+    - pool: 'queue' keeps connections (and their PRAGMAs) open between requests,
+      'null' opens a fresh connection per checkout, 'static' shares one connection
+'''
+sqlite_profile = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'busy_timeout_ms': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'pool': os.environ.get('SQLITE_POOL', 'queue'),
+    'pool_size': int(os.environ.get('SQLITE_POOL_SIZE', 5)),
+}
+
+SQLITE_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SQLITE_SYNCHRONOUS_LEVELS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+SQLITE_POOLS = {'queue': QueuePool, 'null': NullPool, 'static': StaticPool}
+
+
+'''
+build_sqlite_profile(overrides)
+    merges overrides into the default sqlite_profile and validates the result
+    values end up inside PRAGMA statements, so anything unexpected is rejected
+'''
+def build_sqlite_profile(overrides=None):
+    profile = dict(sqlite_profile)
+    profile.update(overrides or {})
+    profile['journal_mode'] = str(profile['journal_mode']).upper()
+    profile['synchronous'] = str(profile['synchronous']).upper()
+    profile['pool'] = str(profile['pool']).lower()
+
+    if profile['journal_mode'] not in SQLITE_JOURNAL_MODES:
+        raise ValueError("unknown sqlite journal_mode: {}".format(profile['journal_mode']))
+    if profile['synchronous'] not in SQLITE_SYNCHRONOUS_LEVELS:
+        raise ValueError("unknown sqlite synchronous level: {}".format(profile['synchronous']))
+    if profile['pool'] not in SQLITE_POOLS:
+        raise ValueError("unknown sqlite pool: {}".format(profile['pool']))
+    for key in ('busy_timeout_ms', 'mmap_size', 'pool_size'):
+        profile[key] = int(profile[key])
+        if profile[key] < 0:
+            raise ValueError("sqlite {} must not be negative".format(key))
+    return profile
+
+
+'''
+sqlite_engine_options(profile)
+    create_engine() keyword arguments for a tuned profile
+'''
+def sqlite_engine_options(profile):
+    options = {
+        'poolclass': SQLITE_POOLS[profile['pool']],
+        'connect_args': {
+            # pooled connections are handed between request threads
+            'check_same_thread': False,
+            'timeout': profile['busy_timeout_ms'] / 1000.0,
+        },
+    }
+    if profile['pool'] == 'queue':
+        options['pool_size'] = profile['pool_size']
+        options['max_overflow'] = profile['pool_size']
+    return options
+
+
+'''
+apply_sqlite_pragmas(engine, profile)
+    runs the profile PRAGMAs on every new DBAPI connection of the engine
+'''
+def apply_sqlite_pragmas(engine, profile):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode={}".format(profile['journal_mode']))
+        cursor.execute("PRAGMA busy_timeout={:d}".format(profile['busy_timeout_ms']))
+        cursor.execute("PRAGMA synchronous={}".format(profile['synchronous']))
+        cursor.execute("PRAGMA mmap_size={:d}".format(profile['mmap_size']))
+        # not a tuning knob: drink_ingredient rows rely on ON DELETE CASCADE
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    return engine
+
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    sqlite databases are opened with the sqlite_profile tuning, see above
+    tables the database lacks are created, see create_missing_tables below
 '''
-def setup_db(app):
+def setup_db(app, database_path=database_path, sqlite_overrides=None):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    profile = None
+    if database_path.startswith("sqlite"):
+        profile = build_sqlite_profile(sqlite_overrides)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlite_engine_options(profile)
+
     db.app = app
     db.init_app(app)
 
+    if profile is not None:
+        # building the engine does not open a connection until first use
+        apply_sqlite_pragmas(db.get_engine(app), profile)
+
+    create_missing_tables(app)
+
+
+'''
+create_missing_tables(app)
+    creates the tables the database lacks, e.g. drink_ingredient, drink_order and drink_sales
+    in a database.db made before they existed, and builds the ingredient index of the drinks
+    already there when its table is new; existing tables and rows are left alone
+'''
+def create_missing_tables(app):
+    existing = set(inspect(db.get_engine(app)).get_table_names())
+    db.create_all(app=app)
+    if Drink.__tablename__ in existing and DrinkIngredient.__tablename__ not in existing:
+        rebuild_ingredient_index()
+
 
 '''
 db_drop_and_create_all()
@@ -30,6 +147,25 @@ def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
 
+
+'''
+rebuild_ingredient_index()
+    re-derives every drink's ingredient index rows from its recipe
+    setup_db runs it for a database created before the drink_ingredient table existed
+    drinks whose recipe is not valid (see validate_recipe) are left out of the index
+'''
+def rebuild_ingredient_index():
+    DrinkIngredient.__table__.create(db.get_engine(), checkfirst=True)
+    for drink in Drink.query.all():
+        try:
+            drink.index_ingredients()
+        except ValueError:
+            continue
+    db.session.commit()
+
+# fields a client can ask for with ?fields=, in serialization order
+DRINK_FIELDS = ('id', 'title', 'recipe')
+
 '''
 Drink
 a persistent drink entity, extends the base SQLAlchemy Model
@@ -42,29 +178,44 @@ class Drink(db.Model):
     # the ingredients blob - this stores a lazy json blob
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
     recipe =  Column(String(180), nullable=False)
+    # inverted index rows derived from the recipe, kept in sync by insert() and update()
+    # and removed by the database's ON DELETE CASCADE
+    ingredients = db.relationship('DrinkIngredient', lazy=True, cascade='all, delete-orphan',
+                                  passive_deletes=True)
 
     '''
-    short()
+    short(fields)
         short form representation of the Drink model
     '''
-    def short(self):
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
-        return {
-            'id': self.id,
-            'title': self.title,
-            'recipe': short_recipe
-        }
+    def short(self, fields=None):
+        return self.project(
+            fields,
+            lambda: [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
+        )
 
     '''
-    long()
+    long(fields)
         long form representation of the Drink model
     '''
-    def long(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'recipe': json.loads(self.recipe)
-        }
+    def long(self, fields=None):
+        return self.project(fields, lambda: json.loads(self.recipe))
+
+    '''
+    project(fields, recipe)
+        the requested subset of DRINK_FIELDS, all of them when fields is None
+        recipe is only called, and the json blob only parsed, when 'recipe' is requested
+    '''
+    def project(self, fields, recipe):
+        if fields is None:
+            fields = DRINK_FIELDS
+        drink = {}
+        if 'id' in fields:
+            drink['id'] = self.id
+        if 'title' in fields:
+            drink['title'] = self.title
+        if 'recipe' in fields:
+            drink['recipe'] = recipe()
+        return drink
 
     '''
     insert()
@@ -76,6 +227,7 @@ class Drink(db.Model):
             drink.insert()
     '''
     def insert(self):
+        self.index_ingredients()
         db.session.add(self)
         db.session.commit()
 
@@ -101,7 +253,268 @@ class Drink(db.Model):
             drink.update()
     '''
     def update(self):
+        if inspect(self).attrs.recipe.history.has_changes():
+            self.index_ingredients()
+        db.session.commit()
+
+    '''
+    index_ingredients()
+        replaces the drink's ingredient index rows with the (name, color) pairs of its recipe
+        the rows are written with the drink on the next commit
+    '''
+    def index_ingredients(self):
+        self.ingredients = [
+            DrinkIngredient(name=name, color=color) for name, color in ingredient_pairs(self.recipe)
+        ]
+
+    '''
+    update_by_id(drink_id, title, recipe)
+        updates a drink with a single UPDATE statement, without loading it first
+        RETURNING hands back the new row in the same round trip where the backend supports it
+        returns a detached Drink holding the new values, or None when no drink has that id
+        EXAMPLE
+            drink = Drink.update_by_id(3, title='Black Coffee')
+    '''
+    @classmethod
+    def update_by_id(cls, drink_id, title=None, recipe=None):
+        table = cls.__table__
+        columns = (table.c.id, table.c.title, table.c.recipe)
+        values = {}
+        if title is not None:
+            values['title'] = title
+        if recipe is not None:
+            values['recipe'] = recipe
+
+        row = None
+        if values:
+            statement = table.update().where(table.c.id == drink_id).values(**values)
+            if supports_returning(db.session):
+                row = db.session.execute(statement.returning(*columns)).first()
+                found = row is not None
+            else:
+                found = db.session.execute(statement).rowcount > 0
+            if not found:
+                db.session.rollback()
+                return None
+            if recipe is not None:
+                reindex_ingredients(drink_id, recipe)
+            if row is None and len(values) == 2:  # every column is already known
+                row = {'id': drink_id, 'title': title, 'recipe': recipe}
+        if row is None:
+            row = db.session.execute(select(columns).where(table.c.id == drink_id)).first()
+        db.session.commit()
+        return cls(**dict(row)) if row is not None else None
+
+    '''
+    delete_by_id(drink_id)
+        deletes a drink with a single DELETE statement, without loading it first
+        its ingredient index rows go with it through ON DELETE CASCADE
+        returns False when no drink has that id
+        EXAMPLE
+            Drink.delete_by_id(3)
+    '''
+    @classmethod
+    def delete_by_id(cls, drink_id):
+        table = cls.__table__
+        deleted = db.session.execute(table.delete().where(table.c.id == drink_id)).rowcount
         db.session.commit()
+        return deleted > 0
+
+    '''
+    with_ingredients(names, colors)
+        query of the drinks containing every ingredient in names and
+        an ingredient of every color in colors, answered from the ingredient index
+        EXAMPLE
+            Drink.with_ingredients(names=['milk'], colors=['black']).all()
+    '''
+    @classmethod
+    def with_ingredients(cls, names=(), colors=()):
+        query = cls.query
+        for name in names:
+            query = query.filter(cls.id.in_(
+                db.session.query(DrinkIngredient.drink_id)
+                .filter(DrinkIngredient.name == normalize_ingredient(name))
+            ))
+        for color in colors:
+            query = query.filter(cls.id.in_(
+                db.session.query(DrinkIngredient.drink_id)
+                .filter(DrinkIngredient.color == normalize_ingredient(color))
+            ))
+        return query
 
     def __repr__(self):
-        return json.dumps(self.short())
\ No newline at end of file
+        return json.dumps(self.short())
+
+
+'''
+supports_returning(session)
+    whether UPDATE ... RETURNING can be used on the session's database
+    SQLAlchemy 1.3 only emits RETURNING for PostgreSQL
+'''
+def supports_returning(session):
+    return session.get_bind().dialect.name == 'postgresql'
+
+
+'''
+validate_recipe(recipe)
+    the decoded recipe as a list of ingredients, each a dict with a string name and color
+    and numeric parts; a single ingredient sent without a list is wrapped in one
+    raises ValueError for anything else, e.g. a list holding a string
+    EXAMPLE
+        recipe = json.dumps(validate_recipe(request.get_json()['recipe']))
+'''
+def validate_recipe(recipe):
+    if isinstance(recipe, dict):  # a single ingredient sent without a list
+        recipe = [recipe]
+    if not isinstance(recipe, list):
+        raise ValueError("a recipe must be a list of ingredients")
+    for ingredient in recipe:
+        if not isinstance(ingredient, dict):
+            raise ValueError("each ingredient must be an object")
+        if not isinstance(ingredient.get('name'), str) or not isinstance(ingredient.get('color'), str):
+            raise ValueError("each ingredient needs a string name and color")
+        parts = ingredient.get('parts')
+        if isinstance(parts, bool) or not isinstance(parts, (int, float)):
+            raise ValueError("each ingredient needs a number of parts")
+    return recipe
+
+
+'''
+ingredient_pairs(recipe)
+    the distinct, normalized (name, color) pairs of a recipe json blob
+    raises ValueError when the blob is not a valid recipe
+'''
+def ingredient_pairs(recipe):
+    return {
+        (normalize_ingredient(r['name']), normalize_ingredient(r['color']))
+        for r in validate_recipe(json.loads(recipe))
+    }
+
+
+'''
+reindex_ingredients(drink_id, recipe)
+    rewrites a drink's ingredient index rows in the current transaction
+    for write paths that change the recipe without loading the Drink
+'''
+def reindex_ingredients(drink_id, recipe):
+    table = DrinkIngredient.__table__
+    db.session.execute(table.delete().where(table.c.drink_id == drink_id))
+    rows = [{'drink_id': drink_id, 'name': name, 'color': color} for name, color in ingredient_pairs(recipe)]
+    if rows:
+        db.session.execute(table.insert(), rows)
+
+
+'''
+normalize_ingredient(value)
+    index key for an ingredient name or color, so "Milk " and "milk" match
+'''
+def normalize_ingredient(value):
+    return str(value or '').strip().lower()
+
+
+'''
+DrinkIngredient
+an ingredient index row: one per distinct (name, color) in a drink's recipe
+lets drinks be filtered by ingredient without parsing every recipe blob
+'''
+class DrinkIngredient(db.Model):
+    __tablename__ = 'drink_ingredient'
+
+    id = Column(Integer, primary_key=True)
+    drink_id = Column(Integer, ForeignKey('drink.id', ondelete='CASCADE'), nullable=False, index=True)
+    name = Column(String(80), nullable=False, index=True)
+    color = Column(String(80), nullable=False, index=True)
+
+
+'''
+Order
+a single drink sale, written in batches by the OrderBuffer (see order_buffer.py)
+token is generated when the order is accepted, so replaying a spill file never double counts
+the drink_id is cleared rather than the order dropped when a drink leaves the menu
+'''
+class Order(db.Model):
+    __tablename__ = 'drink_order'
+
+    id = Column(Integer, primary_key=True)
+    token = Column(String(36), nullable=False, unique=True)
+    drink_id = Column(Integer, ForeignKey('drink.id', ondelete='SET NULL'), index=True)
+    quantity = Column(Integer, nullable=False, default=1)
+    ordered_at = Column(DateTime, nullable=False, index=True)
+
+
+'''
+DrinkSales
+per-drink running totals of Order rows, updated in the same transaction as each batch
+so sales can be read without scanning drink_order
+'''
+class DrinkSales(db.Model):
+    __tablename__ = 'drink_sales'
+
+    drink_id = Column(Integer, ForeignKey('drink.id', ondelete='CASCADE'), primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+
+    def format(self):
+        return {
+            'drink_id': self.drink_id,
+            'orders': self.orders,
+            'quantity': self.quantity,
+        }
+
+
+'''
+record_orders(connection, orders, replay)
+    writes a batch of order dicts (token, drink_id, quantity, ordered_at) and
+    folds them into drink_sales, all on the given connection's transaction
+    orders for drinks that no longer exist are dropped, and with replay=True so are
+    tokens that are already stored (a crash between commit and spill file cleanup)
+    returns the number of orders written
+    EXAMPLE
+        with db.get_engine().begin() as connection:
+            record_orders(connection, orders)
+'''
+def record_orders(connection, orders, replay=False):
+    drinks = Drink.__table__
+    order_table = Order.__table__
+    sales = DrinkSales.__table__
+
+    drink_ids = {order['drink_id'] for order in orders}
+    known_drinks = {row[0] for row in connection.execute(
+        select([drinks.c.id]).where(drinks.c.id.in_(drink_ids)))}
+    orders = [order for order in orders if order['drink_id'] in known_drinks]
+
+    if replay and orders:
+        stored = {row[0] for row in connection.execute(
+            select([order_table.c.token]).where(order_table.c.token.in_([order['token'] for order in orders])))}
+        orders = [order for order in orders if order['token'] not in stored]
+
+    if not orders:
+        return 0
+    connection.execute(order_table.insert(), orders)
+
+    totals = {}
+    for order in orders:
+        count, quantity = totals.get(order['drink_id'], (0, 0))
+        totals[order['drink_id']] = (count + 1, quantity + order['quantity'])
+    existing = {row[0] for row in connection.execute(
+        select([sales.c.drink_id]).where(sales.c.drink_id.in_(list(totals))))}
+
+    updates = [
+        {'sale_drink_id': drink_id, 'new_orders': count, 'new_quantity': quantity}
+        for drink_id, (count, quantity) in totals.items() if drink_id in existing
+    ]
+    if updates:
+        connection.execute(
+            sales.update()
+            .where(sales.c.drink_id == bindparam('sale_drink_id'))
+            .values(orders=sales.c.orders + bindparam('new_orders'),
+                    quantity=sales.c.quantity + bindparam('new_quantity')),
+            updates
+        )
+    inserts = [
+        {'drink_id': drink_id, 'orders': count, 'quantity': quantity}
+        for drink_id, (count, quantity) in totals.items() if drink_id not in existing
+    ]
+    if inserts:
+        connection.execute(sales.insert(), inserts)
+    return len(orders)
@@ -0,0 +1,288 @@
+import os
+import glob
+import json
+import uuid
+import fcntl
+import atexit
+import logging
+import time
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from .models import db, project_dir, record_orders
+
+logger = logging.getLogger(__name__)
+
+'''
+order buffer settings, each can be overridden with the environment variable of the same name
+    ORDER_FLUSH_SIZE: a batch is written as soon as this many orders are waiting
+    ORDER_FLUSH_INTERVAL: seconds between flushes of whatever is waiting
+    ORDER_MAX_PENDING: orders held in memory before new ones are refused (database down)
+    ORDER_SPILL_DIR: where accepted but unwritten orders are logged for crash recovery
+    ORDER_SPILL_FSYNC: 1 to fsync every spilled order (survives power loss, much slower)
+    ORDER_MAX_ATTEMPTS: writes of a batch rejected by the database (e.g. a constraint
+        violation) before it is set aside as an orders-*.failed file in ORDER_SPILL_DIR;
+        batches that fail because the database is unreachable or locked are retried until
+        the buffer is full
+'''
+ORDER_FLUSH_SIZE = int(os.environ.get('ORDER_FLUSH_SIZE', 500))
+ORDER_FLUSH_INTERVAL = float(os.environ.get('ORDER_FLUSH_INTERVAL', 1.0))
+ORDER_MAX_PENDING = int(os.environ.get('ORDER_MAX_PENDING', 20 * ORDER_FLUSH_SIZE))
+ORDER_SPILL_DIR = os.environ.get('ORDER_SPILL_DIR', os.path.join(project_dir, 'order_spill'))
+ORDER_SPILL_FSYNC = os.environ.get('ORDER_SPILL_FSYNC', '0') == '1'
+ORDER_MAX_ATTEMPTS = int(os.environ.get('ORDER_MAX_ATTEMPTS', 3))
+
+# a spill file still hidden under its temporary name this long was left by a crashed open
+ORPHAN_AGE = 60
+
+
+# an open, flock'ed spill file and the path it is visible under
+Spill = namedtuple('Spill', ['file', 'path'])
+
+# orders that failed to write, the spill files holding exactly them, and the failed attempts
+FailedBatch = namedtuple('FailedBatch', ['orders', 'spills', 'attempts'])
+
+
+class OrderBufferFull(Exception):
+    """Raised when orders arrive faster than the database accepts them"""
+
+
+class OrderBuffer:
+    """Collects orders in memory and writes them to the database in batched transactions.
+
+    Every accepted order is first appended to a spill file owned (flock'ed) by this process.
+    A spill file is deleted only once all of its orders are committed, so after a crash the
+    next buffer to start replays any unowned spill files with recover(), from its writer thread.
+
+    A batch that fails is retried on its own with the following flushes, so newer orders are
+    not held up behind it, skipping any of its orders that did get committed. After max_attempts rejections by the database, its spill files are
+    renamed to orders-*.failed and it is dropped from memory; rename them back to .spill to
+    replay them once the cause is fixed.
+    """
+
+    def __init__(self, app=None, flush_size=ORDER_FLUSH_SIZE, flush_interval=ORDER_FLUSH_INTERVAL,
+                 max_pending=ORDER_MAX_PENDING, spill_dir=ORDER_SPILL_DIR, fsync=ORDER_SPILL_FSYNC,
+                 max_attempts=ORDER_MAX_ATTEMPTS):
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_dir = spill_dir
+        self.fsync = fsync
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []
+        self._spill = None
+        self._failed = []
+        self._failed_orders = 0
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['order_buffer'] = self
+        atexit.register(self.close)
+
+    #  ----------------------------------------------------------------
+    #  Request path
+    #  ----------------------------------------------------------------
+
+    def add(self, drink_id, quantity=1):
+        """Accepts an order and returns it; it reaches the database with the next batch"""
+        order = {
+            'token': str(uuid.uuid4()),
+            'drink_id': drink_id,
+            'quantity': quantity,
+            'ordered_at': datetime.utcnow(),
+        }
+        line = json.dumps(dict(order, ordered_at=order['ordered_at'].isoformat())) + '\n'
+
+        with self._lock:
+            self._ensure_started()
+            if len(self._pending) + self._failed_orders >= self.max_pending:
+                raise OrderBufferFull()
+            self._spill.file.write(line)
+            self._spill.file.flush()
+            if self.fsync:
+                os.fsync(self._spill.file.fileno())
+            self._pending.append(order)
+            if len(self._pending) >= self.flush_size:
+                self._wake.set()
+        return order
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending) + self._failed_orders
+
+    #  ----------------------------------------------------------------
+    #  Writer
+    #  ----------------------------------------------------------------
+
+    def flush(self):
+        """Writes what is waiting, each earlier failed batch and then the new orders in their own
+        transaction; returns the number of orders written"""
+        with self._flush_lock:
+            with self._lock:
+                batches, self._failed, self._failed_orders = self._failed, [], 0
+                new = None
+                if self._pending:
+                    new = FailedBatch(self._pending, [self._spill], 0)
+                    batches.append(new)
+                    self._pending = []
+                    self._spill = self._open_spill()
+
+            written = 0
+            for batch in batches:
+                try:
+                    with self._engine().begin() as connection:
+                        # a failed write may have committed before the connection broke
+                        written += record_orders(connection, batch.orders, replay=batch is not new)
+                except SQLAlchemyError as error:
+                    self._failed_batch(batch, error)
+                    continue
+                for spill in batch.spills:
+                    self._remove_spill(spill)
+            return written
+
+    def _failed_batch(self, batch, error):
+        # an unreachable or locked database is not the batch's fault: retry until the buffer is full
+        attempts = batch.attempts if isinstance(error, OperationalError) else batch.attempts + 1
+        if attempts >= self.max_attempts:
+            paths = [self._set_aside(spill) for spill in batch.spills]
+            logger.error("order batch of %d failed %d times, set aside in %s",
+                         len(batch.orders), attempts, ', '.join(paths), exc_info=error)
+            return
+        logger.warning("order batch of %d failed, retrying with the next flush",
+                       len(batch.orders), exc_info=error)
+        with self._lock:
+            self._failed.append(batch._replace(attempts=attempts))
+            self._failed_orders += len(batch.orders)
+
+    def recover(self):
+        """Replays spill files left behind by buffers that died, returns the number of orders written.
+
+        A file that fails to replay becomes a failed batch of this buffer, retried with its flushes.
+        """
+        self._remove_orphans()
+        recovered = 0
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, 'orders-*.spill'))):
+            spill = Spill(open(path, 'r'), path)
+            try:
+                fcntl.flock(spill.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:  # still owned by a live buffer
+                spill.file.close()
+                continue
+
+            orders = []
+            for line in spill.file:
+                try:
+                    order = json.loads(line)
+                except ValueError:  # torn write from the crash
+                    continue
+                order['ordered_at'] = datetime.fromisoformat(order['ordered_at'])
+                orders.append(order)
+
+            try:
+                if orders:
+                    with self._engine().begin() as connection:
+                        recovered += record_orders(connection, orders, replay=True)
+            except SQLAlchemyError as error:
+                # this buffer owns the file now: it is retried, or set aside, like its own batches
+                self._failed_batch(FailedBatch(orders, [spill], 0), error)
+                continue
+            self._remove_spill(spill)
+        return recovered
+
+    def close(self):
+        """Stops the writer thread and writes what is left; unwritten orders stay spilled"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        with self._lock:
+            if not self._pending:
+                self._remove_spill(self._spill)
+            else:
+                self._spill.file.close()
+            for batch in self._failed:
+                for spill in batch.spills:
+                    spill.file.close()
+            self._spill = None
+
+    #  ----------------------------------------------------------------
+    #  Internals
+    #  ----------------------------------------------------------------
+
+    def _engine(self):
+        return db.get_engine(self.app)
+
+    def _ensure_started(self):
+        # buffers are created at import, so a forked worker starts its own thread and spill file
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pending = []
+        self._failed, self._failed_orders = [], 0
+        self._stopping = False
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._spill = self._open_spill()
+        self._thread = threading.Thread(target=self._run, name='order-buffer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # replaying what crashed buffers left is database work, kept off the request threads
+        try:
+            self.recover()
+        except Exception:
+            logger.exception("recovering spilled orders failed, leaving them for the next start")
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopping:  # close() writes the final batch
+                return
+            self.flush()
+
+    def _open_spill(self):
+        # lock before the file becomes visible to recover() under its final name
+        name = 'orders-{}.spill'.format(uuid.uuid4().hex)
+        path = os.path.join(self.spill_dir, name)
+        tmp_path = os.path.join(self.spill_dir, '.' + name)
+        spill_file = open(tmp_path, 'a')
+        fcntl.flock(spill_file.fileno(), fcntl.LOCK_EX)
+        os.rename(tmp_path, path)
+        return Spill(spill_file, path)
+
+    def _remove_spill(self, spill):
+        os.remove(spill.path)
+        spill.file.close()
+
+    def _set_aside(self, spill):
+        path = spill.path[:-len('.spill')] + '.failed'
+        os.rename(spill.path, path)
+        spill.file.close()
+        return path
+
+    def _remove_orphans(self):
+        """Deletes spill files a crash left under their temporary name; no order was written to them"""
+        for path in glob.glob(os.path.join(self.spill_dir, '.orders-*.spill')):
+            try:
+                if time.time() - os.path.getmtime(path) < ORPHAN_AGE:
+                    continue  # may be opening right now, see _open_spill
+                with open(path, 'r') as orphan:
+                    fcntl.flock(orphan.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.remove(path)
+            except OSError:  # locked by a live buffer, or already gone
+                continue
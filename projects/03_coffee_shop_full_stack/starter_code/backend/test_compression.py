@@ -0,0 +1,82 @@
+import gzip
+import json
+import unittest
+
+from flask import Flask, Response, jsonify
+
+from fsnd_shared.compression import Compress, negotiate, benchmark
+
+
+class CompressionTestCase(unittest.TestCase):
+    """Checks encoding negotiation and when responses get compressed"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.drinks = [{'id': n, 'title': 'drink %d' % n, 'recipe': [{'name': 'milk', 'color': 'white', 'parts': n}]}
+                       for n in range(200)]
+
+        @self.app.route('/drinks')
+        def drinks():
+            return jsonify({'success': True, 'drinks': self.drinks})
+
+        @self.app.route('/small')
+        def small():
+            return jsonify({'success': True})
+
+        @self.app.route('/stream')
+        def stream():
+            return Response((json.dumps(drink) + '\n' for drink in self.drinks), content_type='application/json')
+
+        @self.app.route('/image')
+        def image():
+            return Response(b'\x89PNG' * 1000, content_type='image/png')
+
+        self.app.wsgi_app = Compress(self.app.wsgi_app)
+        self.client = self.app.test_client()
+
+    def test_negotiation(self):
+        self.assertEqual(negotiate('gzip, deflate, br', ('br', 'gzip')), 'br')
+        self.assertEqual(negotiate('gzip, deflate, br', ('gzip',)), 'gzip')
+        self.assertEqual(negotiate('br;q=0.5, gzip', ('br', 'gzip')), 'gzip')
+        self.assertEqual(negotiate('*;q=0.1', ('br', 'gzip')), 'br')
+        self.assertIsNone(negotiate('gzip;q=0, identity', ('gzip',)))
+        self.assertIsNone(negotiate('', ('gzip',)))
+
+    def test_large_json_is_gzipped_with_a_length(self):
+        plain = self.client.get('/drinks')
+        res = self.client.get('/drinks', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(int(res.headers['Content-Length']), len(res.get_data()))
+        self.assertLess(len(res.get_data()), len(plain.get_data()) / 5)
+        self.assertEqual(gzip.decompress(res.get_data()), plain.get_data())
+
+    def test_streams_bodies_of_unknown_length(self):
+        res = self.client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', res.headers)
+        lines = gzip.decompress(res.get_data()).decode().splitlines()
+        self.assertEqual(json.loads(lines[-1]), self.drinks[-1])
+
+    def test_skips_small_binary_and_head(self):
+        for path in ('/small', '/image'):
+            res = self.client.get(path, headers={'Accept-Encoding': 'gzip'})
+            self.assertNotIn('Content-Encoding', res.headers, path)
+        self.assertNotIn('Vary', self.client.get('/image').headers)
+
+        res = self.client.head('/drinks', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_benchmark_reports_every_level(self):
+        payload = json.dumps(self.drinks).encode()
+        results = benchmark(payload, levels=(1, 9), brotli_qualities=(4,), rounds=2)
+        gzip_sizes = {level: size for encoding, level, size, _ in results if encoding == 'gzip'}
+        self.assertEqual(set(gzip_sizes), {1, 9})
+        self.assertLessEqual(gzip_sizes[9], gzip_sizes[1])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from flask import Flask
+
+from src.database.models import db, setup_db, db_drop_and_create_all, validate_recipe, Drink, DrinkIngredient, \
+    DrinkSales
+from src.database.initialize_db_mock_data import initialize_db_mock_data
+
+
+class IngredientIndexTestCase(unittest.TestCase):
+    """Checks that the ingredient index follows Drink.insert(), update() and delete()"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite:///{}".format(os.path.join(self.tmp_dir, "index.db")))
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db_drop_and_create_all()
+        initialize_db_mock_data()
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_engine(self.app).dispose()
+        self.ctx.pop()
+        shutil.rmtree(self.tmp_dir)
+
+    def titles(self, names=(), colors=()):
+        return sorted(drink.title for drink in Drink.with_ingredients(names=names, colors=colors).all())
+
+    def test_insert_indexes_recipe(self):
+        self.assertEqual(self.titles(names=['milk']), ['Cappuccino'])
+        self.assertEqual(self.titles(names=['coffee']), ['Cappuccino', 'Coffee', 'Mocha'])
+        self.assertEqual(self.titles(names=['Coffee '], colors=['brown']), ['Mocha'])
+        self.assertEqual(self.titles(names=['tea']), [])
+
+    def test_update_reindexes_recipe(self):
+        drink = Drink.query.filter_by(title='Coffee').one()
+        drink.recipe = '[{"color": "white", "name": "milk", "parts": 2}]'
+        drink.update()
+
+        self.assertEqual(self.titles(names=['milk']), ['Cappuccino', 'Coffee'])
+        self.assertEqual(self.titles(colors=['black']), ['Cappuccino', 'Mocha'])
+
+    def test_delete_removes_index_rows(self):
+        drink = Drink.query.filter_by(title='Cappuccino').one()
+        drink_id = drink.id
+        drink.delete()
+
+        self.assertEqual(self.titles(names=['milk']), [])
+        self.assertEqual(DrinkIngredient.query.filter_by(drink_id=drink_id).count(), 0)
+
+    def test_update_by_id_reindexes_recipe(self):
+        drink_id = Drink.query.filter_by(title='Coffee').one().id
+        drink = Drink.update_by_id(drink_id, recipe='[{"color": "white", "name": "milk", "parts": 2}]')
+
+        self.assertEqual(drink.long()['title'], 'Coffee')
+        self.assertEqual(self.titles(names=['milk']), ['Cappuccino', 'Coffee'])
+        self.assertIsNone(Drink.update_by_id(1000, title='Nothing'))
+
+    def test_delete_by_id_cascades_index_rows(self):
+        drink_id = Drink.query.filter_by(title='Mocha').one().id
+
+        self.assertTrue(Drink.delete_by_id(drink_id))
+        self.assertFalse(Drink.delete_by_id(drink_id))
+        self.assertEqual(DrinkIngredient.query.filter_by(drink_id=drink_id).count(), 0)
+        self.assertEqual(self.titles(colors=['brown']), [])
+
+    def test_invalid_recipes_are_rejected(self):
+        self.assertEqual(validate_recipe({'name': 'milk', 'color': 'white', 'parts': 1}),
+                         [{'name': 'milk', 'color': 'white', 'parts': 1}])
+        for recipe in (['milk'], 'milk', [{'name': 'milk', 'color': 'white'}],
+                       [{'name': 1, 'color': 'white', 'parts': 1}], [None]):
+            with self.assertRaises(ValueError):
+                validate_recipe(recipe)
+
+        with self.assertRaises(ValueError):
+            Drink(title='Latte', recipe='["milk"]').insert()
+        db.session.rollback()
+        self.assertEqual(Drink.query.filter_by(title='Latte').count(), 0)
+
+
+class OlderDatabaseTestCase(unittest.TestCase):
+    """Checks that setup_db brings a database.db made before the index and order tables up to date"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "old.db")
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("CREATE TABLE drink (id INTEGER PRIMARY KEY, title VARCHAR(80) UNIQUE, "
+                               "recipe VARCHAR(180) NOT NULL)")
+            connection.executemany("INSERT INTO drink (title, recipe) VALUES (?, ?)", [
+                ('Water', '[{"color": "blue", "name": "water", "parts": 1}]'),
+                ('Broken', '["water"]'),
+            ])
+        self.app = Flask(__name__)
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_engine(self.app).dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_missing_tables_are_created_and_indexed(self):
+        setup_db(self.app, "sqlite:///{}".format(self.path))
+        with self.app.app_context():
+            self.assertEqual([drink.title for drink in Drink.with_ingredients(names=['water'])], ['Water'])
+            self.assertEqual(DrinkSales.query.count(), 0)
+            self.assertEqual(Drink.query.count(), 2)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask, jsonify
+
+from src.database.models import db, setup_db, db_drop_and_create_all, Drink
+from src.database.initialize_db_mock_data import initialize_db_mock_data
+from fsnd_shared.metrics import Metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+    """Checks per-route latency and query metrics and their Prometheus rendering"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite:///{}".format(os.path.join(self.tmp_dir, "metrics.db")))
+        self.metrics = Metrics(self.app)
+
+        @self.app.route('/drinks/<int:drink_id>')
+        def drink(drink_id):
+            return jsonify(Drink.query.get_or_404(drink_id).short())
+
+        @self.app.route('/drinks')
+        def drinks():
+            # one query for the list, then one per drink
+            return jsonify([Drink.query.filter_by(id=drink.id).one().short() for drink in Drink.query.all()])
+
+        with self.app.app_context():
+            db_drop_and_create_all()
+            initialize_db_mock_data()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_counts_queries_per_route(self):
+        self.client.get('/drinks/1')
+        self.client.get('/drinks/2')
+        self.client.get('/drinks')
+        self.client.get('/drinks/1000')
+
+        queries = self.metrics.queries.snapshot()
+        self.assertEqual(queries[('GET', '/drinks/<int:drink_id>')], (3, 3))
+        self.assertEqual(queries[('GET', '/drinks')], (1, 4))
+
+        latency = self.metrics.latency.snapshot()
+        self.assertEqual(latency[('GET', '/drinks/<int:drink_id>', 200)][0], 2)
+        self.assertEqual(latency[('GET', '/drinks/<int:drink_id>', 404)][0], 1)
+        self.assertGreater(self.metrics.db_time.snapshot()[('GET', '/drinks')][1], 0)
+
+    def test_prometheus_text(self):
+        self.client.get('/drinks/1')
+        self.client.get('/nowhere')
+
+        res = self.client.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain; version=0.0.4'))
+        text = res.get_data(as_text=True)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_request_db_queries_bucket{method="GET",route="/drinks/<int:drink_id>",le="1"} 1', text)
+        self.assertIn('http_request_db_queries_count{method="GET",route="/drinks/<int:drink_id>"} 1', text)
+        self.assertIn('route="<unmatched>",status="404"', text)
+        # scrapes are not recorded
+        self.assertNotIn('route="/metrics"', self.client.get('/metrics').get_data(as_text=True))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+import os
+import glob
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+from src.database.models import db, setup_db, db_drop_and_create_all, Drink, Order, DrinkSales
+from src.database.initialize_db_mock_data import initialize_db_mock_data
+from src.database.order_buffer import OrderBuffer, OrderBufferFull
+
+
+class OrderBufferTestCase(unittest.TestCase):
+    """Checks batching, the sales rollup and crash recovery of the OrderBuffer"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.spill_dir = os.path.join(self.tmp_dir, "spill")
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite:///{}".format(os.path.join(self.tmp_dir, "orders.db")))
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db_drop_and_create_all()
+        initialize_db_mock_data()
+        self.coffee, self.mocha = [Drink.query.filter_by(title=title).one().id for title in ('Coffee', 'Mocha')]
+
+    def tearDown(self):
+        db.session.remove()
+        db.get_engine(self.app).dispose()
+        self.ctx.pop()
+        shutil.rmtree(self.tmp_dir)
+
+    def make_buffer(self, **kwargs):
+        options = dict(flush_size=50, flush_interval=0.05, spill_dir=self.spill_dir)
+        options.update(kwargs)
+        return OrderBuffer(self.app, **options)
+
+    def sales(self, drink_id):
+        db.session.expire_all()
+        return DrinkSales.query.get(drink_id).format()
+
+    def test_concurrent_orders_are_batched_and_rolled_up(self):
+        order_buffer = self.make_buffer()
+
+        def take_orders():
+            for i in range(250):
+                order_buffer.add(self.coffee if i % 2 else self.mocha, quantity=2)
+
+        threads = [threading.Thread(target=take_orders) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        order_buffer.close()
+
+        self.assertEqual(Order.query.count(), 1000)
+        self.assertEqual(self.sales(self.coffee), {'drink_id': self.coffee, 'orders': 500, 'quantity': 1000})
+        self.assertEqual(self.sales(self.mocha), {'drink_id': self.mocha, 'orders': 500, 'quantity': 1000})
+        self.assertEqual(glob.glob(os.path.join(self.spill_dir, '*')), [])
+
+    def test_orders_for_unknown_drinks_are_dropped(self):
+        order_buffer = self.make_buffer()
+        order_buffer.add(self.coffee)
+        order_buffer.add(1000)
+
+        self.assertEqual(order_buffer.flush(), 1)
+        self.assertEqual(Order.query.count(), 1)
+        order_buffer.close()
+
+    def test_full_buffer_refuses_orders(self):
+        order_buffer = self.make_buffer(flush_size=1000, flush_interval=60, max_pending=3)
+        for _ in range(3):
+            order_buffer.add(self.coffee)
+        with self.assertRaises(OrderBufferFull):
+            order_buffer.add(self.coffee)
+        order_buffer.close()
+
+        self.assertEqual(Order.query.count(), 3)
+
+    def test_crashed_buffer_is_recovered_once(self):
+        crashed = self.make_buffer(flush_size=1000, flush_interval=60)
+        for _ in range(10):
+            crashed.add(self.mocha, quantity=3)
+        # the process dies: its lock goes away, its spill file and pending orders do not reach the db
+        crashed._stopping = True
+        crashed._wake.set()
+        crashed._thread.join()
+        crashed._thread = None
+        crashed._spill.file.close()
+
+        spilled = glob.glob(os.path.join(self.spill_dir, 'orders-*.spill'))
+        self.assertEqual(len(spilled), 1)
+        with open(spilled[0]) as spill:
+            first_order = json.loads(spill.readline())
+        # a torn last line must not stop the replay
+        with open(spilled[0], 'a') as spill:
+            spill.write('{"token": "trunc')
+
+        # the same orders spilled twice (committed but not yet cleaned up) only count once
+        shutil.copy(spilled[0], os.path.join(self.spill_dir, 'orders-copy.spill'))
+
+        self.assertEqual(self.make_buffer().recover(), 10)
+        self.assertEqual(self.sales(self.mocha), {'drink_id': self.mocha, 'orders': 10, 'quantity': 30})
+        self.assertEqual(Order.query.filter_by(token=first_order['token']).count(), 1)
+        self.assertEqual(glob.glob(os.path.join(self.spill_dir, 'orders-*.spill')), [])
+
+    def test_rejected_batch_is_set_aside_without_holding_up_others(self):
+        order_buffer = self.make_buffer(flush_size=1000, flush_interval=60, max_attempts=2)
+        # a missing quantity makes every write of that batch break the not null constraint
+        poison = order_buffer.add(self.coffee, quantity=None)
+
+        with self.assertLogs('src.database.order_buffer', 'WARNING'):
+            self.assertEqual(order_buffer.flush(), 0)
+        self.assertEqual(order_buffer.pending(), 1)
+
+        order_buffer.add(self.mocha)
+        with self.assertLogs('src.database.order_buffer', 'ERROR') as logs:
+            self.assertEqual(order_buffer.flush(), 1)
+        self.assertIn('set aside', logs.output[0])
+        self.assertEqual(order_buffer.pending(), 0)
+        self.assertEqual(order_buffer.flush(), 0)
+        order_buffer.close()
+
+        failed = glob.glob(os.path.join(self.spill_dir, 'orders-*.failed'))
+        self.assertEqual(len(failed), 1)
+        with open(failed[0]) as spill:
+            self.assertEqual(json.loads(spill.readline())['token'], poison['token'])
+        self.assertEqual(Order.query.count(), 1)
+
+    def test_retried_batch_skips_what_was_committed(self):
+        order_buffer = self.make_buffer(flush_size=1000, flush_interval=60, max_attempts=2)
+        order = order_buffer.add(self.coffee)
+        with mock.patch('src.database.order_buffer.record_orders', side_effect=IntegrityError('', {}, None)), \
+                self.assertLogs('src.database.order_buffer', 'WARNING'):
+            order_buffer.flush()
+        # the failed write did commit, the connection broke before it was acknowledged
+        db.session.add(Order(token=order['token'], drink_id=self.coffee, quantity=1,
+                             ordered_at=order['ordered_at']))
+        db.session.commit()
+
+        self.assertEqual(order_buffer.flush(), 0)
+        self.assertEqual(order_buffer.pending(), 0)
+        order_buffer.close()
+        self.assertEqual(glob.glob(os.path.join(self.spill_dir, '*')), [])
+        self.assertEqual(Order.query.count(), 1)
+
+    def test_rejected_spill_file_is_set_aside_by_recovery(self):
+        os.makedirs(self.spill_dir)
+        path = os.path.join(self.spill_dir, 'orders-poison.spill')
+        with open(path, 'w') as spill:
+            spill.write(json.dumps({'token': 'poison', 'drink_id': self.coffee, 'quantity': None,
+                                    'ordered_at': '2020-01-01T00:00:00'}) + '\n')
+
+        order_buffer = self.make_buffer(max_attempts=2)
+        with self.assertLogs('src.database.order_buffer', 'WARNING'):
+            self.assertEqual(order_buffer.recover(), 0)
+        self.assertEqual(order_buffer.pending(), 1)
+        with self.assertLogs('src.database.order_buffer', 'ERROR'):
+            order_buffer.flush()
+        self.assertEqual(order_buffer.pending(), 0)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(self.spill_dir, 'orders-poison.failed')))
+
+    def test_recovery_runs_on_the_writer_thread(self):
+        threads = []
+        with mock.patch.object(OrderBuffer, 'recover', lambda buffer: threads.append(threading.current_thread())):
+            order_buffer = self.make_buffer()
+            order_buffer.add(self.coffee)
+            order_buffer._thread.join(0.5)
+        self.assertEqual([thread.name for thread in threads], ['order-buffer'])
+        order_buffer.close()
+
+    def test_orphaned_temporary_spill_files_are_removed(self):
+        os.makedirs(self.spill_dir)
+        old, new = [os.path.join(self.spill_dir, '.orders-{}.spill'.format(name)) for name in ('old', 'new')]
+        for path in (old, new):
+            open(path, 'w').close()
+        os.utime(old, (time.time() - 3600, time.time() - 3600))
+
+        self.make_buffer().recover()
+        self.assertFalse(os.path.exists(old))
+        # may still be in the middle of being opened
+        self.assertTrue(os.path.exists(new))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
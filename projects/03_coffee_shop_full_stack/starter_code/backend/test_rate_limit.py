@@ -0,0 +1,172 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from flask import Flask, jsonify
+
+from src.auth import auth
+from src.auth.auth import AuthError, requires_auth
+from src.auth.rate_limit import RateLimit, RateLimiter, MemoryBackend, SqliteBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    """Checks the token bucket arithmetic against both backends"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.limit = RateLimit(capacity=3, per_second=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_backend(self, backend):
+        now = 1000.0
+        self.assertEqual([backend.take('k', self.limit, now) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(backend.take('k', self.limit, now), 1.0)
+        # other keys have their own bucket
+        self.assertEqual(backend.take('other', self.limit, now), 0)
+        # half a second refills half a token
+        self.assertAlmostEqual(backend.take('k', self.limit, now + 0.5), 0.5)
+        self.assertEqual(backend.take('k', self.limit, now + 1.0), 0)
+
+    def test_memory_backend(self):
+        self.check_backend(MemoryBackend())
+
+    def test_sqlite_backend_is_shared(self):
+        path = os.path.join(self.tmp_dir, "buckets.db")
+        self.check_backend(SqliteBackend(path))
+        # a second backend on the same file, like another worker, sees the same empty bucket
+        self.assertGreater(SqliteBackend(path).take('k', self.limit, 1001.0), 0)
+
+    def test_memory_backend_prunes_full_buckets(self):
+        backend = MemoryBackend(max_keys=2)
+        for key in ('a', 'b', 'c'):
+            backend.take(key, self.limit, 1000.0)
+        backend.take('d', self.limit, 1010.0)
+        self.assertEqual(len(backend._buckets), 1)
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryBackend(max_keys=2)
+        for key in ('a', 'b', 'a', 'c'):
+            backend.take(key, self.limit, 1000.0)
+        # no bucket is full again, so b, the least recently used, goes
+        self.assertEqual(list(backend._buckets), ['a', 'c'])
+
+    def test_sqlite_backend_prunes_full_buckets_and_expired_tokens(self):
+        path = os.path.join(self.tmp_dir, "buckets.db")
+        backend = SqliteBackend(path, prune_every=3)
+        backend.share_token(b'old', 'alice', 1001.0)
+        backend.share_token(b'new', 'bob', 2000.0)
+        backend.take('a', self.limit, 1000.0)
+        backend.take('b', self.limit, 1000.0)
+        backend.take('c', self.limit, 1001.5)
+
+        connection = sqlite3.connect(path)
+        self.assertEqual(connection.execute("SELECT key FROM bucket").fetchall(), [('c',)])
+        self.assertEqual(connection.execute("SELECT key FROM verified_token").fetchall(), [(b'new',)])
+        connection.close()
+
+
+class RequiresAuthRateLimitTestCase(unittest.TestCase):
+    """Checks that requires_auth rejects over-limit callers before verifying their token"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(backend=MemoryBackend(), clock=self.clock)
+        self.app = Flask(__name__)
+
+        @self.app.route('/limited')
+        @requires_auth(permission='get:drinks-detail', rate_limit=RateLimit(capacity=2, per_second=1))
+        def limited():
+            return 'ok'
+
+        @self.app.errorhandler(AuthError)
+        def auth_error(error):
+            return jsonify(error.error), error.status_code, error.headers
+
+        self.client = self.app.test_client()
+        self.payloads = {}
+        # no auth0 here: verification just looks the token up in self.payloads
+        patches = [
+            mock.patch.object(auth, 'limiter', self.limiter),
+            mock.patch.object(auth, 'verify_decode_jwt', side_effect=lambda token: self.payloads[token]),
+            mock.patch.object(auth, 'check_permissions', return_value=True),
+        ]
+        self.verify = [patch.start() for patch in patches][1]
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def get(self, token, ip='10.0.0.1'):
+        return self.client.get('/limited', headers={'Authorization': 'Bearer ' + token},
+                               environ_base={'REMOTE_ADDR': ip})
+
+    def test_rejected_before_verification(self):
+        self.payloads = {'a.b.alice': {'sub': 'alice', 'exp': self.clock.now + 60}}
+        # one request on the ip bucket, then the two of alice's own bucket
+        for _ in range(3):
+            self.assertEqual(self.get('a.b.alice').status_code, 200)
+
+        res = self.get('a.b.alice')
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res.get_json()['code'], 'rate_limited')
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(self.verify.call_count, 3)
+
+        self.clock.now += 1
+        self.assertEqual(self.get('a.b.alice').status_code, 200)
+
+    def test_verified_sub_is_its_own_bucket(self):
+        self.payloads = {
+            'a.b.alice': {'sub': 'alice', 'exp': self.clock.now + 60},
+            'a.b.bob': {'sub': 'bob', 'exp': self.clock.now + 60},
+        }
+        # the first request of a token is keyed by ip, the following ones by its verified sub
+        self.assertEqual(self.get('a.b.alice').status_code, 200)
+        self.assertEqual(self.get('a.b.bob').status_code, 200)
+        self.assertEqual(self.get('a.b.alice').status_code, 200)
+        self.assertEqual(self.get('a.b.bob').status_code, 200)
+        self.assertEqual(self.get('a.b.alice').status_code, 200)
+        self.assertEqual(self.get('a.b.alice').status_code, 429)
+
+    def test_forged_tokens_fall_back_to_ip(self):
+        # tokens that never verified share their client ip's bucket, whatever sub they claim
+        self.payloads = {token: {} for token in ('forged.0', 'forged.1', 'forged.2', 'forged.3')}
+        self.assertEqual(self.get('forged.0').status_code, 200)
+        self.assertEqual(self.get('forged.1').status_code, 200)
+        self.assertEqual(self.get('forged.2').status_code, 429)
+        self.assertEqual(self.get('forged.3', ip='10.0.0.2').status_code, 200)
+
+    def test_verified_tokens_are_shared_through_the_backend(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "buckets.db")
+        workers = [RateLimiter(backend=SqliteBackend(path), clock=self.clock) for _ in range(2)]
+        workers[0].remember('a.b.alice', {'sub': 'alice', 'exp': self.clock.now + 60})
+
+        self.assertEqual(workers[1].identity('a.b.alice', '10.0.0.1'), 'sub:alice')
+        self.assertEqual(workers[1].identity('x.y.alice', '10.0.0.1'), 'ip:10.0.0.1')
+        self.clock.now += 60
+        self.assertEqual(workers[1].identity('a.b.alice', '10.0.0.1'), 'ip:10.0.0.1')
+
+    def test_reused_signature_is_not_the_verified_token(self):
+        self.payloads = {'a.b.alice': {'sub': 'alice', 'exp': self.clock.now + 60}, 'x.y.alice': {}}
+        self.assertEqual(self.get('a.b.alice').status_code, 200)
+        # alice's signature under another header and payload is keyed by ip, not as alice
+        self.assertEqual(self.limiter.identity('x.y.alice', '10.0.0.2'), 'ip:10.0.0.2')
+        self.assertEqual(self.limiter.identity('a.b.alice', '10.0.0.2'), 'sub:alice')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from src.database.models import db, setup_db, Drink, build_sqlite_profile, \
+    sqlite_engine_options, apply_sqlite_pragmas
+
+
+# what setup_db did before the profile existed: rollback journal, fsync on
+# every commit and a brand new connection for every checkout
+LEGACY_PROFILE = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'mmap_size': 0,
+    'pool': 'null',
+}
+
+WRITERS = 4
+READERS = 4
+WRITES_PER_WRITER = 100
+
+
+def run_stress(database_file, overrides):
+    """Hammers one sqlite file with concurrent writers and readers.
+
+    Returns a dict with the write/read counts, lock errors and ops per second."""
+    profile = build_sqlite_profile(overrides)
+    engine = apply_sqlite_pragmas(
+        create_engine("sqlite:///{}".format(database_file), **sqlite_engine_options(profile)),
+        profile
+    )
+    Drink.__table__.create(engine)
+
+    counts = {'writes': 0, 'reads': 0, 'errors': 0}
+    counts_lock = threading.Lock()
+    writers_done = threading.Event()
+
+    def count(key):
+        with counts_lock:
+            counts[key] += 1
+
+    def writer(writer_id):
+        for i in range(WRITES_PER_WRITER):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(
+                        Drink.__table__.insert(),
+                        title="drink-{}-{}".format(writer_id, i),
+                        recipe=json.dumps([{'color': 'black', 'name': 'coffee', 'parts': 1}])
+                    )
+                count('writes')
+            except OperationalError:  # database is locked
+                count('errors')
+
+    def reader():
+        while not writers_done.is_set():
+            try:
+                with engine.connect() as connection:
+                    connection.execute(Drink.__table__.select()).fetchall()
+                count('reads')
+            except OperationalError:  # database is locked
+                count('errors')
+
+    writer_threads = [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+    reader_threads = [threading.Thread(target=reader) for _ in range(READERS)]
+
+    start = time.perf_counter()
+    for thread in reader_threads + writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    writers_done.set()
+    for thread in reader_threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with engine.connect() as connection:
+        counts['rows'] = connection.execute(text("SELECT count(*) FROM drink")).scalar()
+    engine.dispose()
+
+    counts['seconds'] = elapsed
+    counts['ops_per_second'] = (counts['writes'] + counts['reads']) / elapsed
+    return counts
+
+
+class SqliteProfileTestCase(unittest.TestCase):
+    """Checks the sqlite connection profile and compares it against the legacy settings"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_setup_db_applies_profile(self):
+        app = Flask(__name__)
+        setup_db(app, "sqlite:///{}".format(os.path.join(self.tmp_dir, "profile.db")))
+
+        with app.app_context():
+            pragma = lambda name: db.session.execute(text("PRAGMA " + name)).scalar()
+            self.assertEqual(pragma("journal_mode"), "wal")
+            self.assertEqual(pragma("busy_timeout"), 5000)
+            self.assertEqual(pragma("synchronous"), 1)  # NORMAL
+            db.session.remove()
+            db.get_engine(app).dispose()
+
+    def test_bad_profile_values_rejected(self):
+        with self.assertRaises(ValueError):
+            build_sqlite_profile({'journal_mode': 'WAL; DROP TABLE drink'})
+        with self.assertRaises(ValueError):
+            build_sqlite_profile({'synchronous': 'SOMETIMES'})
+        with self.assertRaises(ValueError):
+            build_sqlite_profile({'pool': 'thread'})
+
+    def test_concurrent_read_write_stress(self):
+        legacy = run_stress(os.path.join(self.tmp_dir, "legacy.db"), LEGACY_PROFILE)
+        tuned = run_stress(os.path.join(self.tmp_dir, "tuned.db"), None)
+
+        print("\nsqlite stress ({} writers x {} writes, {} readers)".format(WRITERS, WRITES_PER_WRITER, READERS))
+        for name, result in (('legacy', legacy), ('tuned', tuned)):
+            print("  {:6s} {:8.1f} ops/s  writes={writes} reads={reads} errors={errors} in {seconds:.2f}s".format(
+                name, result['ops_per_second'], **result))
+
+        # every write lands and nobody sees "database is locked"
+        self.assertEqual(tuned['errors'], 0)
+        self.assertEqual(tuned['rows'], WRITERS * WRITES_PER_WRITER)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
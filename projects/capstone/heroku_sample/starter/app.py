@@ -1,17 +1,62 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 import os
-from flask import Flask
-from models import setup_db
+import re
+from flask import Flask, request, abort, jsonify
+from flask_cors import CORS
+from sqlalchemy.exc import SQLAlchemyError
+from models import setup_db, requires_db, db, Person
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+PEOPLE_PER_PAGE = 20
+MAX_PEOPLE_PER_PAGE = 100
+MAX_BULK_PEOPLE = 1000
+
+
+def page_args(in_request):
+    '''
+    (after, limit) of a keyset page request: ?after=<last id seen>&limit=<n>
+    '''
+    after = in_request.args.get('after', default=0, type=int)
+    limit = in_request.args.get('limit', default=PEOPLE_PER_PAGE, type=int)
+    if after < 0 or limit <= 0:
+        abort(400)
+    return after, min(limit, MAX_PEOPLE_PER_PAGE)
+
+
+def people_page(after, limit, words=()):
+    # one extra row tells whether there is a next page without a COUNT
+    people = Person.page(after, limit + 1, words)
+    return jsonify({
+        'success': True,
+        'people': [person.format() for person in people[:limit]],
+        'next_after': people[limit - 1].id if len(people) > limit else None,
+    })
+
 
 def create_app(test_config=None):
+    '''
+    builds the app without touching the database
+    set CHECK_DB_ON_START=true (or pass it in test_config) to connect and check the schema here
+    instead of on the first request that needs it
+    '''
+    started = time.perf_counter()
 
     app = Flask(__name__)
-    setup_db(app)
+    app.config['CHECK_DB_ON_START'] = os.environ.get('CHECK_DB_ON_START') == 'true'
+    if test_config:
+        app.config.update(test_config)
+    setup_db(app, app.config.get('DATABASE_URL'))
     CORS(app)
 
+    schema_check = app.extensions['schema_check']
+
     @app.route('/')
     def get_greeting():
         excited = os.environ['EXCITED']
-        greeting = "Hello" 
+        greeting = "Hello"
         if excited == 'true': greeting = greeting + "!!!!!"
         return greeting
 
@@ -19,9 +64,113 @@ def create_app(test_config=None):
     def be_cool():
         return "Be cool, man, be coooool! You're almost a FSND grad!"
 
+    @app.route('/people')
+    @requires_db
+    def get_people():
+        after, limit = page_args(request)
+        return people_page(after, limit)
+
+    @app.route('/people/search')
+    @requires_db
+    def search_people():
+        '''
+        people with a word in their name or catchphrase starting with every word of ?q=
+        '''
+        words = re.findall(r'\w+', request.args.get('q', ''))
+        if not words:
+            abort(400)
+        after, limit = page_args(request)
+        return people_page(after, limit, words)
+
+    @app.route('/people', methods=['POST'])
+    @requires_db
+    def create_people():
+        '''
+        accepts {"people": [{"name": ..., "catchphrase": ...}, ...]} or a single person
+        '''
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400)
+        people = body['people'] if 'people' in body else [body]
+        if (not isinstance(people, list) or not people or len(people) > MAX_BULK_PEOPLE
+                or not all(isinstance(person, dict) and isinstance(person.get('name'), str)
+                           and person['name'].strip()
+                           and isinstance(person.get('catchphrase', ''), (str, type(None)))
+                           for person in people)):
+            abort(422)
+
+        try:
+            created = Person.insert_many(people)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(500)
+        return jsonify({
+            'success': True,
+            'created': created,
+            'total_created': len(created),
+        }), 201
+
+    @app.route('/ready')
+    def ready():
+        '''
+        readiness probe: 200 once the database answers and has its tables, 503 until then
+        '''
+        try:
+            schema_check.run()
+        except SQLAlchemyError as error:
+            app.logger.warning('database not ready: %s', error)
+            return jsonify({'success': False, 'ready': False}), 503
+        return jsonify({
+            'success': True,
+            'ready': True,
+            'startup_ms': round(app.config['STARTUP_SECONDS'] * 1000, 1),
+            'import_ms': round(IMPORT_SECONDS * 1000, 1),
+            'schema_check_ms': round(schema_check.seconds * 1000, 1),
+            'created_tables': schema_check.created,
+        })
+
+    @app.errorhandler(400)
+    def bad_request(error):
+        return jsonify({
+            "success": False,
+            "status_code": 400,
+            "message": "Bad request",
+        }), 400
+
+    @app.errorhandler(404)
+    def resource_not_found(error):
+        return jsonify({
+            "success": False,
+            "status_code": 404,
+            "message": "Resource not found",
+        }), 404
+
+    @app.errorhandler(422)
+    def unprocessable(error):
+        return jsonify({
+            "success": False,
+            "status_code": 422,
+            "message": "Unprocessable",
+        }), 422
+
+    @app.errorhandler(500)
+    def server_error(error):
+        return jsonify({
+            "success": False,
+            "status_code": 500,
+            "message": "Server error",
+        }), 500
+
+    if app.config['CHECK_DB_ON_START']:
+        schema_check.run()
+
+    app.config['STARTUP_SECONDS'] = time.perf_counter() - started
+    app.logger.info('app created in %.1fms (imports %.1fms)',
+                    app.config['STARTUP_SECONDS'] * 1000, IMPORT_SECONDS * 1000)
     return app
 
 app = create_app()
 
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    app.run()
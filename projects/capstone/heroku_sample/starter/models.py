@@ -1,28 +1,106 @@
-from sqlalchemy import Column, String, create_engine
-from flask_sqlalchemy import SQLAlchemy
-import json
+import os
+import re
+import sys
+import time
+import threading
+from functools import wraps
 
-database_path = os.environ['DATABASE_URL']
+from flask import current_app
+from sqlalchemy import Column, String, Integer, ForeignKey, inspect, select
+from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    nothing connects here: the engine is created on first use, and the schema is checked by
+    the app's SchemaCheck (on the first request that needs the database, or on /ready)
 '''
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_path=None):
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_path or os.environ.get('DATABASE_URL')
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.app = app
     db.init_app(app)
-    db.create_all()
+    app.extensions['schema_check'] = SchemaCheck(app)
+
+
+class SchemaCheck:
+    """Connects and creates any missing tables, once per app.
+
+    Uses a single table listing instead of create_all's per-table lookups. A failed check
+    is retried on the next call, so a worker that started before the database recovers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.done = False
+        self.seconds = None
+        self.created = []
+        self._lock = threading.Lock()
+
+    def run(self):
+        if self.done:
+            return
+        with self._lock:
+            if self.done:
+                return
+            start = time.perf_counter()
+            with self.app.app_context():
+                engine = db.get_engine(self.app)
+                with engine.connect() as connection:
+                    existing = set(inspect(connection).get_table_names())
+                    missing = [table for table in db.metadata.sorted_tables if table.name not in existing]
+                    db.metadata.create_all(connection, tables=missing, checkfirst=False)
+                    if PersonTerm.__table__ in missing and Person.__table__ not in missing:
+                        # the search index is new but people already exist: index them once
+                        rebuild_person_terms(connection)
+            self.created = [table.name for table in missing]
+            self.seconds = time.perf_counter() - start
+            self.done = True
+
+
+def requires_db(f):
+    '''
+    runs the app's schema check before the first request of a view that uses the database
+    '''
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        current_app.extensions['schema_check'].run()
+        return f(*args, **kwargs)
+    return wrapper
+
+
+MAX_TERM_LENGTH = 64
+
+
+'''
+person_terms(name, catchphrase)
+    the distinct lowercased words of a person's name and catchphrase, as stored in person_term
+'''
+def person_terms(name, catchphrase):
+  text = ' '.join(value for value in (name, catchphrase) if value)
+  return sorted({word[:MAX_TERM_LENGTH] for word in re.findall(r'\w+', text.lower())})
+
+
+'''
+term_range(word)
+    (low, high) bounds of the terms starting with word, for a range scan of the term index
+    high is the next prefix, word with its last character bumped, or None when nothing can
+    follow; a sentinel like word + '\U0010ffff' does not sort after every such term under
+    non-C collations or UTF-16 ordering
+'''
+def term_range(word):
+  stem = word.rstrip(chr(sys.maxunicode))
+  if not stem:
+    return word, None
+  return word, stem[:-1] + chr(ord(stem[-1]) + 1)
 
 
 '''
 Person
 Have title and release year
 '''
-class Person(db.Model):  
+class Person(db.Model):
   __tablename__ = 'People'
 
   id = Column(Integer, primary_key=True)
@@ -37,4 +115,85 @@ class Person(db.Model):
     return {
       'id': self.id,
       'name': self.name,
-      'catchphrase': self.catchphrase}
\ No newline at end of file
+      'catchphrase': self.catchphrase}
+
+  '''
+  insert_many(people)
+      inserts [{'name': ..., 'catchphrase': ...}] in batches of batch_size rows together with
+      their search terms, and returns the new people formatted, in order
+      the caller commits
+  '''
+  @classmethod
+  def insert_many(cls, people, batch_size=500):
+    created = []
+    for start in range(0, len(people), batch_size):
+      rows = [{'name': person['name'], 'catchphrase': person.get('catchphrase') or ''}
+              for person in people[start:start + batch_size]]
+      if supports_returning(db.session):
+        # one multi-row INSERT ... RETURNING per batch
+        result = db.session.execute(cls.__table__.insert().values(rows).returning(cls.__table__.c.id))
+        ids = [row[0] for row in result]
+      else:
+        batch = [cls(**row) for row in rows]
+        db.session.add_all(batch)
+        db.session.flush()
+        ids = [person.id for person in batch]
+
+      terms = [{'person_id': person_id, 'term': term}
+               for person_id, row in zip(ids, rows)
+               for term in person_terms(row['name'], row['catchphrase'])]
+      if terms:
+        db.session.execute(PersonTerm.__table__.insert(), terms)
+      created.extend(dict(row, id=person_id) for person_id, row in zip(ids, rows))
+    return created
+
+  '''
+  page(after, limit, words=())
+      up to limit people with id > after, in id order, whose name or catchphrase has a word
+      starting with each of words
+      keyset pagination: the cost does not grow with how deep the page is
+  '''
+  @classmethod
+  def page(cls, after, limit, words=()):
+    query = cls.query.filter(cls.id > after)
+    for word in words:
+      query = query.filter(cls.id.in_(PersonTerm.prefix_matches(word)))
+    return query.order_by(cls.id).limit(limit).all()
+
+
+'''
+PersonTerm
+    inverted index from the words of people's names and catchphrases to the people
+    prefix searches are range scans on the term index
+'''
+class PersonTerm(db.Model):
+  __tablename__ = 'person_term'
+
+  term = Column(String(MAX_TERM_LENGTH), primary_key=True)
+  person_id = Column(Integer, ForeignKey('People.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+  @classmethod
+  def prefix_matches(cls, word):
+    '''
+    select of the ids of people with a term starting with word
+    '''
+    low, high = term_range(word.lower()[:MAX_TERM_LENGTH])
+    # a range instead of LIKE, so both sqlite and postgres use the primary key index
+    query = select([cls.person_id]).where(cls.term >= low)
+    return query if high is None else query.where(cls.term < high)
+
+
+def supports_returning(session):
+  return session.get_bind().dialect.name == 'postgresql'
+
+
+def rebuild_person_terms(connection):
+  '''
+  refills person_term from People
+  '''
+  connection.execute(PersonTerm.__table__.delete())
+  people = connection.execute(select([Person.id, Person.name, Person.catchphrase])).fetchall()
+  terms = [{'person_id': person.id, 'term': term}
+           for person in people for term in person_terms(person.name, person.catchphrase)]
+  if terms:
+    connection.execute(PersonTerm.__table__.insert(), terms)
@@ -0,0 +1,156 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from sqlalchemy import inspect
+
+from app import create_app
+from models import db, Person, PersonTerm, rebuild_person_terms, person_terms, term_range
+
+
+class StartupTestCase(unittest.TestCase):
+    """Checks that the app starts without the database and becomes ready on demand"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.database_path = 'sqlite:///' + os.path.join(self.tmp_dir, 'sample.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_create_app_does_not_connect(self):
+        app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(self.tmp_dir, 'missing', 'sample.db')})
+        client = app.test_client()
+
+        self.assertEqual(client.get('/coolkids').status_code, 200)
+        self.assertEqual(client.get('/ready').status_code, 503)
+
+    def test_ready_creates_the_schema_once(self):
+        app = create_app({'DATABASE_URL': self.database_path})
+        client = app.test_client()
+
+        res = client.get('/ready')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['created_tables'], ['People', 'person_term'])
+        with app.app_context():
+            self.assertIn('People', inspect(db.get_engine(app)).get_table_names())
+
+        res = client.get('/ready')
+        self.assertEqual(res.get_json()['created_tables'], ['People', 'person_term'])
+
+        # a new worker finds the tables already there
+        restarted = create_app({'DATABASE_URL': self.database_path, 'CHECK_DB_ON_START': True})
+        self.assertEqual(restarted.extensions['schema_check'].created, [])
+        self.assertIn('startup_ms', restarted.test_client().get('/ready').get_json())
+
+
+class PersonApiTestCase(unittest.TestCase):
+    """Runs the Person endpoints against a local sqlite database"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.app = create_app({'DATABASE_URL': 'sqlite:///' + os.path.join(self.tmp_dir, 'people.db')})
+        self.client = self.app.test_client()
+        self.people = [
+            {'name': 'Ada Lovelace', 'catchphrase': 'The engine weaves algebraic patterns'},
+            {'name': 'Grace Hopper', 'catchphrase': 'It is easier to ask forgiveness'},
+            {'name': 'Alan Turing', 'catchphrase': 'We can only see a short distance ahead'},
+            {'name': 'Adele Goldberg'},
+        ]
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        shutil.rmtree(self.tmp_dir)
+
+    def create(self, people):
+        return self.client.post('/people', json={'people': people})
+
+    def test_bulk_create(self):
+        res = self.create(self.people)
+
+        self.assertEqual(res.status_code, 201)
+        data = res.get_json()
+        self.assertEqual(data['total_created'], 4)
+        self.assertEqual([person['name'] for person in data['created']], [p['name'] for p in self.people])
+        self.assertEqual(data['created'][3]['catchphrase'], '')
+        with self.app.app_context():
+            self.assertEqual(Person.query.count(), 4)
+            self.assertEqual(PersonTerm.query.filter_by(person_id=data['created'][0]['id']).count(),
+                             len(person_terms(**self.people[0])))
+
+    def test_single_create_and_validation(self):
+        self.assertEqual(self.client.post('/people', json={'name': 'Linus'}).status_code, 201)
+        self.assertEqual(self.create([{'catchphrase': 'nameless'}]).status_code, 422)
+        self.assertEqual(self.create([]).status_code, 422)
+        self.assertEqual(self.client.post('/people', data='nope').status_code, 400)
+
+    def test_keyset_pagination(self):
+        self.create([{'name': 'Person %d' % n} for n in range(25)])
+
+        seen, after = [], 0
+        while after is not None:
+            data = self.client.get('/people?limit=10&after=%d' % after).get_json()
+            seen.extend(person['name'] for person in data['people'])
+            after = data['next_after']
+
+        self.assertEqual(seen, ['Person %d' % n for n in range(25)])
+        self.assertEqual(self.client.get('/people?limit=0').status_code, 400)
+
+    def test_search(self):
+        self.create(self.people)
+
+        def names(query):
+            return [person['name'] for person in self.client.get('/people/search?' + query).get_json()['people']]
+
+        self.assertEqual(names('q=ad'), ['Ada Lovelace', 'Adele Goldberg'])
+        self.assertEqual(names('q=ALG'), ['Ada Lovelace'])
+        self.assertEqual(names('q=ada+weaves'), ['Ada Lovelace'])
+        self.assertEqual(names('q=ask'), ['Grace Hopper'])
+        self.assertEqual(names('q=zzz'), [])
+
+        first = self.client.get('/people/search?q=a&limit=2').get_json()
+        rest = self.client.get('/people/search?q=a&limit=2&after=%d' % first['next_after']).get_json()
+        self.assertEqual(len(first['people']) + len(rest['people']), 4)
+        self.assertIsNone(rest['next_after'])
+        self.assertEqual(self.client.get('/people/search?q=').status_code, 400)
+
+    def test_term_range_under_utf16_order(self):
+        self.assertEqual(term_range('ad'), ('ad', 'ae'))
+        self.assertEqual(term_range('a\U0010ffff'), ('a\U0010ffff', 'b'))
+
+        # like a collation comparing UTF-16: the sentinel's surrogates sort before U+E000 to U+FFFF
+        def utf16_order(left, right):
+            keys = [text.encode('utf-16-be') for text in (left, right)]
+            return (keys[0] > keys[1]) - (keys[0] < keys[1])
+
+        connection = sqlite3.connect(':memory:')
+        connection.create_collation('utf16', utf16_order)
+        connection.execute('CREATE TABLE person_term (term TEXT COLLATE utf16)')
+        connection.executemany('INSERT INTO person_term VALUES (?)',
+                               [('a',), ('a\uff42c',), ('a\U0001d49c',), ('b',)])
+        low, high = term_range('a')
+        found = connection.execute('SELECT term FROM person_term WHERE term >= ? AND term < ? ORDER BY term',
+                                   (low, high))
+        self.assertEqual([term for term, in found], ['a', 'a\U0001d49c', 'a\uff42c'])
+        # the sentinel bound this replaced misses the term with a fullwidth letter
+        found = connection.execute('SELECT term FROM person_term WHERE term >= ? AND term < ?', ('a', 'a\U0010ffff'))
+        self.assertNotIn(('a\uff42c',), found.fetchall())
+        connection.close()
+
+    def test_rebuild_terms(self):
+        self.create(self.people)
+        with self.app.app_context():
+            PersonTerm.query.delete()
+            db.session.commit()
+            with db.get_engine(self.app).begin() as connection:
+                rebuild_person_terms(connection)
+        self.assertEqual(len(self.client.get('/people/search?q=turing').get_json()['people']), 1)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,5 @@
+"""Flask and WSGI helpers shared by the Fyyur, trivia and coffee shop apps.
+
+Each app installs this package from its requirements.txt (`-e` path to projects/shared),
+so a fix made here reaches all of them.
+"""
@@ -0,0 +1,235 @@
+"""gzip and brotli response compression as WSGI middleware.
+
+EXAMPLE
+    from fsnd_shared.compression import Compress
+    app.wsgi_app = Compress(app.wsgi_app)
+
+Each response is compressed with the best encoding the client lists in Accept-Encoding:
+brotli when the Brotli package is installed, otherwise gzip. Responses are left alone when
+they are smaller than min_size, not a text type, already encoded, marked no-transform, or
+answer a HEAD request. Bodies up to buffer_size are compressed in one go and keep a
+Content-Length; larger ones, and bodies of unknown length, are compressed chunk by chunk
+as the app yields them.
+
+level (gzip, 1-9) and brotli_quality (0-11) trade CPU for bytes. Both default to values
+that suit dynamic responses, and can be set through COMPRESS_LEVEL and
+COMPRESS_BROTLI_QUALITY. To see the tradeoff for a real payload:
+    curl -s localhost:5000/questions > questions.json
+    python -m fsnd_shared.compression questions.json
+
+The trivia and coffee shop APIs both import it from here.
+"""
+import os
+import sys
+import time
+import zlib
+import argparse
+from itertools import chain
+from functools import lru_cache
+
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'application/xml',
+                      'image/svg+xml', 'text/')
+UNSUPPORTED = (204, 304)
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding, available):
+    """The encoding out of available with the highest q value in accept_encoding, or None.
+    Ties go to the one listed first in available."""
+    qualities = {}
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name.strip()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class Compress:
+    """WSGI middleware compressing responses for clients that accept it.
+
+    Apps must send their body through the returned iterable; the legacy write() callable
+    of start_response is not supported.
+    """
+
+    def __init__(self, app, level=None, brotli_quality=None, min_size=500, buffer_size=64 * 1024,
+                 mimetypes=COMPRESSIBLE_TYPES):
+        self.app = app
+        self.level = level if level is not None else int(os.environ.get('COMPRESS_LEVEL', 6))
+        self.brotli_quality = (brotli_quality if brotli_quality is not None
+                               else int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4)))
+        self.min_size = min_size
+        self.buffer_size = buffer_size
+        self.mimetypes = tuple(mimetypes)
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def __call__(self, environ, start_response):
+        started = {}
+
+        def capture(status, headers, exc_info=None):
+            started.update(status=status, headers=headers, exc_info=exc_info)
+            return self._no_write
+
+        body = self.app(environ, capture)
+        # closes the app's body even if the response is dropped before it is iterated
+        return ClosingIterator(self._respond(environ, body, started, start_response),
+                               getattr(body, 'close', None))
+
+    @staticmethod
+    def _no_write(data):
+        raise NotImplementedError('Compress does not support the write() callable')
+
+    def compressor(self, encoding):
+        """(compress, finish) functions of a fresh streaming compressor"""
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, compressor.finish
+        # wbits 31: deflate with a gzip header and trailer
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress, compressor.flush
+
+    def compress(self, data, encoding):
+        compress, finish = self.compressor(encoding)
+        return compress(data) + finish()
+
+    #  ----------------------------------------------------------------
+    #  Responses
+    #  ----------------------------------------------------------------
+
+    def _respond(self, environ, body, started, start_response):
+        chunks = iter(body)
+        first = []
+        if not started:
+            # apps that only call start_response once their body is iterated
+            first = [next(chunks, b'')]
+        status, headers = started['status'], list(started['headers'])
+        length = self._compressible_length(environ, status, headers)
+        encoding = None
+        if length is not False:
+            add_vary(headers)
+            encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''), self.encodings)
+        if encoding is None or (length is not None and length < self.min_size):
+            start_response(status, headers, started['exc_info'])
+            yield from first
+            yield from chunks
+            return
+
+        if length is not None and length <= self.buffer_size:
+            data = b''.join(first + list(chunks))
+            compressed = self.compress(data, encoding)
+            if len(compressed) >= len(data):
+                start_response(status, headers, started['exc_info'])
+                yield data
+                return
+            headers = encoded_headers(headers, encoding, len(compressed))
+            start_response(status, headers, started['exc_info'])
+            yield compressed
+            return
+
+        start_response(status, encoded_headers(headers, encoding, None), started['exc_info'])
+        compress, finish = self.compressor(encoding)
+        for chunk in chain(first, chunks):
+            data = compress(chunk)
+            if data:
+                yield data
+        yield finish()
+
+    def _compressible_length(self, environ, status, headers):
+        """False when the response must go out as it is, else its Content-Length (None if unknown)"""
+        if environ.get('REQUEST_METHOD') == 'HEAD' or int(status.split(None, 1)[0]) in UNSUPPORTED:
+            return False
+        values = {name.lower(): value for name, value in headers}
+        content_type = values.get('content-type', '').lower()
+        if ('content-encoding' in values or 'no-transform' in values.get('cache-control', '')
+                or not content_type.startswith(self.mimetypes)):
+            return False
+        length = values.get('content-length')
+        return int(length) if length is not None else None
+
+
+def add_vary(headers):
+    """Adds Accept-Encoding to the response's Vary header, for caches"""
+    for index, (name, value) in enumerate(headers):
+        if name.lower() == 'vary':
+            if 'accept-encoding' not in value.lower() and value.strip() != '*':
+                headers[index] = (name, value + ', Accept-Encoding')
+            return
+    headers.append(('Vary', 'Accept-Encoding'))
+
+
+def encoded_headers(headers, encoding, length):
+    """headers for the compressed body: new length, Content-Encoding and a weak ETag"""
+    result = []
+    for name, value in headers:
+        lower = name.lower()
+        if lower == 'content-length':
+            continue
+        if lower == 'etag' and not value.startswith('W/'):
+            # the compressed bytes differ from the ones the strong validator names
+            value = 'W/' + value
+        result.append((name, value))
+    result.append(('Content-Encoding', encoding))
+    if length is not None:
+        result.append(('Content-Length', str(length)))
+    return result
+
+
+#  ----------------------------------------------------------------
+#  Benchmark
+#  ----------------------------------------------------------------
+
+def benchmark(payload, levels=(1, 3, 6, 9), brotli_qualities=(1, 4, 6, 11), rounds=None):
+    """[(encoding, level, compressed size, microseconds per response)] for payload"""
+    rounds = rounds or max(1, min(1000, 5 * 1024 * 1024 // max(len(payload), 1)))
+    settings = [('gzip', level) for level in levels]
+    if brotli is not None:
+        settings += [('br', quality) for quality in brotli_qualities]
+
+    results = []
+    for encoding, level in settings:
+        middleware = Compress(None, level=level, brotli_quality=level)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            size = len(middleware.compress(payload, encoding))
+        results.append((encoding, level, size, (time.perf_counter() - start) / rounds * 1e6))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compares compression levels on a response body.')
+    parser.add_argument('payload', help='file holding a response body, e.g. saved with curl')
+    args = parser.parse_args(argv)
+
+    with open(args.payload, 'rb') as payload_file:
+        payload = payload_file.read()
+    print('%d bytes uncompressed' % len(payload))
+    print('%-8s %5s %10s %7s %12s' % ('encoding', 'level', 'bytes', 'ratio', 'us/response'))
+    for encoding, level, size, micros in benchmark(payload):
+        print('%-8s %5d %10d %6.1f%% %12.1f' % (encoding, level, size, 100.0 * size / len(payload), micros))
+    if brotli is None:
+        print('Brotli is not installed, so only gzip was measured (pip install Brotli)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""Per-route request latency and SQL metrics in the Prometheus text format.
+
+EXAMPLE
+    from fsnd_shared.metrics import Metrics
+    metrics = Metrics(app)
+    # GET /metrics now serves, per method and route:
+    #   http_request_duration_seconds   histogram of request latency (also by status)
+    #   http_request_db_queries         histogram of SQL statements per request
+    #   http_request_db_seconds         histogram of time spent in SQL per request
+
+Queries are counted through SQLAlchemy engine events for every engine in the process, and
+charged to the request running on the same thread. Numbers are per process: with several
+workers, scrape each one or aggregate them in Prometheus.
+
+Fyyur, the trivia API and the coffee shop API all import it from here.
+"""
+import time
+import threading
+from bisect import bisect_left
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Thread-safe histogram per label values, rendered with cumulative buckets"""
+
+    def __init__(self, name, description, label_names, buckets):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # one count per bucket plus +Inf, then the sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.description), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            label_text = ','.join('%s="%s"' % (name, escape(value))
+                                  for name, value in zip(self.label_names, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append('%s_bucket{%sle="%s"} %d' % (self.name, prefix, bound, cumulative))
+            lines.append('%s_sum{%s} %r' % (self.name, label_text, values[-1]))
+            lines.append('%s_count{%s} %d' % (self.name, label_text, cumulative))
+        return lines
+
+    def snapshot(self):
+        """{labels: (count, sum)}"""
+        with self._lock:
+            return {labels: (sum(values[:-1]), values[-1]) for labels, values in self._series.items()}
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Flask extension recording request latency and SQL use per route.
+
+    endpoint is where the metrics are served; None adds no route, e.g. to serve render() from
+    a protected view instead. Requests to the endpoint itself are not recorded.
+    """
+
+    def __init__(self, app=None, endpoint='/metrics'):
+        self.endpoint = endpoint
+        self.latency = Histogram('http_request_duration_seconds', 'Request latency in seconds.',
+                                 ('method', 'route', 'status'), LATENCY_BUCKETS)
+        self.queries = Histogram('http_request_db_queries', 'SQL statements executed per request.',
+                                 ('method', 'route'), QUERY_BUCKETS)
+        self.db_time = Histogram('http_request_db_seconds', 'Time spent executing SQL per request.',
+                                 ('method', 'route'), LATENCY_BUCKETS)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['metrics'] = self
+        app.before_request(self._start_request)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish_request)
+        if self.endpoint:
+            app.add_url_rule(self.endpoint, 'metrics', self.render)
+        listen_to_engines()
+
+    #  ----------------------------------------------------------------
+    #  Request hooks
+    #  ----------------------------------------------------------------
+
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_seconds = 0.0
+
+    def _record_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _finish_request(self, error=None):
+        start = g.pop('metrics_start', None)
+        if start is None or request.endpoint == 'metrics':
+            return
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        status = g.pop('metrics_status', 500)
+        self.latency.observe((request.method, route, status), elapsed)
+        self.queries.observe((request.method, route), g.metrics_queries)
+        self.db_time.observe((request.method, route), g.metrics_db_seconds)
+
+    #  ----------------------------------------------------------------
+    #  Exposition
+    #  ----------------------------------------------------------------
+
+    def render(self):
+        lines = self.latency.render() + self.queries.render() + self.db_time.render()
+        return Response('\n'.join(lines) + '\n', content_type=CONTENT_TYPE)
+
+
+#  ----------------------------------------------------------------
+#  SQLAlchemy hooks
+#  ----------------------------------------------------------------
+
+_listen_lock = threading.Lock()
+_listening = False
+
+
+def listen_to_engines():
+    """Times every statement of every engine, including ones created later; runs once per process"""
+    global _listening
+    with _listen_lock:
+        if not _listening:
+            event.listen(Engine, 'before_cursor_execute', _before_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_execute)
+            event.listen(Engine, 'handle_error', _failed_execute)
+            _listening = True
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _failed_execute(exception_context):
+    # after_cursor_execute does not run for a failed statement
+    if exception_context.connection is not None:
+        starts = exception_context.connection.info.get('metrics_query_start')
+        if starts:
+            starts.pop()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    # charged to the request on this thread, if its app records metrics
+    if has_request_context() and 'metrics_start' in g and 'metrics' in current_app.extensions:
+        g.metrics_queries += 1
+        g.metrics_db_seconds += elapsed
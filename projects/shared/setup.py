@@ -0,0 +1,10 @@
+from setuptools import setup
+
+setup(
+    name='fsnd-shared',
+    version='1.0.0',
+    description='Flask and WSGI helpers shared by the Full-Stack Nanodegree projects',
+    packages=['fsnd_shared'],
+    install_requires=['Flask', 'SQLAlchemy'],
+    extras_require={'brotli': ['Brotli']},
+)